@@ -1,28 +1,59 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import StreamingResponse
+import asyncio
+import orjson
 import os
-import pandas as pd
+import secrets
+import threading
+import time
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timedelta
+from typing import Literal, Optional
 from dotenv import load_dotenv
-from data.schemas import Database
+from backend.api.cache import ResponseCache, DataVersion, SingleFlight, encoding_etag, etag_matches
+from backend.api.db_async import AsyncDatabase, to_naive_utc
+from backend.api.metrics import RESPONSE_BYTES, EndpointLabelMiddleware, endpoint_label
+from backend.api.profiling import ProfilingMiddleware
+from backend.data.db_url import database_url
+from backend.api.formats import MEDIA_TYPES, STREAM_BOUNDS, Rows, encode_chunk, encode_records, negotiate, serialize
 from functools import lru_cache
-from prometheus_client import Gauge
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, generate_latest
 from prometheus_fastapi_instrumentator import Instrumentator
-from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
-import numpy as np
+import math
 
 # 1. Configuration
 load_dotenv()
-app = FastAPI(title="VéloMag API")
+
+@asynccontextmanager
+async def lifespan(app):
+    # Démarrage à chaud (API_WARMUP=1) : pool, caches et modèle prêts avant le premier client
+    if os.getenv("API_WARMUP", "0") == "1":
+        await warmup()
+    yield
+    # Arrêt propre : on rend les connexions du pool asyncpg
+    if get_async_db.cache_info().currsize:
+        db = get_async_db()
+        if db: await db.close()
+
+app = FastAPI(title="VéloMag API", lifespan=lifespan)
 
 # --- 1. CONFIGURATION PROMETHEUS ---
 # On active l'instrumentateur (compte les requêtes, la vitesse, etc.)
-Instrumentator().instrument(app).expose(app)
+# /metrics est servi plus bas : les jauges des scores y sont relues depuis score_stats
+Instrumentator().instrument(app)
 
 # --- 2. DÉFINITION DES JAUGES MÉTIER ---
 # Ces variables stockeront la qualité de ton IA
 MAE_METRIC = Gauge('velomag_model_mae', 'Mean Absolute Error (Erreur Moyenne)')
 RMSE_METRIC = Gauge('velomag_model_rmse', 'Root Mean Squared Error')
 R2_METRIC = Gauge('velomag_model_r2', 'R2 Score (Coefficient de determination)')
+# Mêmes scores, par compteur (étiquette counter_id)
+COUNTER_MAE_METRIC = Gauge('velomag_counter_mae', 'Mean Absolute Error par compteur', ['counter_id'])
+COUNTER_RMSE_METRIC = Gauge('velomag_counter_rmse', 'Root Mean Squared Error par compteur', ['counter_id'])
+COUNTER_R2_METRIC = Gauge('velomag_counter_r2', 'R2 Score par compteur', ['counter_id'])
+COUNTER_PAIRS_METRIC = Gauge('velomag_counter_scored_pairs', 'Nombre de paires (réel, prédiction) évaluées', ['counter_id'])
 # Autoriser Streamlit (qui tourne sur un autre port) à parler à l'API
 app.add_middleware(
     CORSMiddleware,
@@ -30,33 +61,274 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor", "X-Data-Version", "X-Map-Revision"],
 )
+# Compression négociée (Accept-Encoding: gzip) pour les réponses volumineuses
+GZIP_MIN_SIZE = 1024
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MIN_SIZE)
+# Étiquette "endpoint" des mesures SQL (latence, lignes)
+app.add_middleware(EndpointLabelMiddleware)
+# Profilage à la demande (requêtes lentes ou en-tête X-Profile), désactivé par défaut
+if os.getenv("API_PROFILE_DIR"):
+    app.add_middleware(ProfilingMiddleware)
 
 # --- GESTION DE LA BDD (Lazy Loading) ---
 @lru_cache()
 def get_db():
     """
-    Crée la connexion BDD une seule fois et la garde en cache.
-    Évite de bloquer le démarrage de l'API si la BDD dort.
+    Crée la connexion BDD (synchrone, SQLAlchemy) une seule fois et la garde en cache.
+    Sert au prédicteur en ligne (chargé dans un thread). Les endpoints utilisent get_async_db.
     """
+    # Import différé : SQLAlchemy + pandas ne sont chargés que si un endpoint en a besoin
+    from backend.data.schemas import Database
     try:
-        USER = os.getenv("user")
-        PASSWORD = os.getenv("password")
-        HOST = os.getenv("host")
-        PORT = os.getenv("port")
-        DBNAME = os.getenv("dbname")
-        
-        # sslmode=require est souvent obligatoire sur Azure
-        db_url = f"postgresql+psycopg2://{USER}:{PASSWORD}@{HOST}:{PORT}/{DBNAME}?sslmode=require"
-        return Database(db_url)
+        return Database(database_url("postgresql+psycopg2"))
+    except Exception as e:
+        print(f" Erreur Config BDD: {e}")
+        return None
+
+@lru_cache()
+def get_async_db():
+    """
+    Pool asyncpg partagé par les endpoints (async def) : une requête lente
+    n'occupe pas un thread, elle attend sans bloquer les autres.
+    Le pool n'est ouvert qu'à la première requête (la BDD peut dormir au démarrage).
+    """
+    try:
+        return AsyncDatabase(database_url("postgresql"))
     except Exception as e:
         print(f" Erreur Config BDD: {e}")
         return None
 
+_online_predictor = None
+_online_predictor_lock = threading.Lock()
+
+def get_online_predictor():
+    """
+    Charge le modèle XGBoost une seule fois (booster gardé en mémoire).
+    Seul un chargement réussi est gardé : tant que le modèle manque, chaque appel réessaie.
+    """
+    global _online_predictor
+    if _online_predictor is not None:
+        return _online_predictor
+    with _online_predictor_lock:
+        if _online_predictor is None:
+            # Import différé : XGBoost (et la pipeline de prédiction) ne ralentit pas le démarrage
+            from backend.api.online import OnlinePredictor
+            db = get_db()
+            if not db: return None
+            try:
+                _online_predictor = OnlinePredictor(db)
+            except Exception as e:
+                print(f" Erreur chargement modèle: {e}")
+    return _online_predictor
+
+# --- CACHE DES RÉPONSES (versionné par les données) ---
+# Les données ne changent qu'à l'ingestion / la prédiction : on sert les réponses déjà sérialisées
+response_cache = ResponseCache(
+    max_entries=int(os.getenv("RESPONSE_CACHE_ENTRIES", "256")),
+    max_bytes=int(os.getenv("RESPONSE_CACHE_MB", "64")) * 1024 * 1024,
+)
+
+async def _load_data_version():
+    """
+    Version = derniers id insérés (ingestion + prédiction), état du snapshot carte et date du jour
+    (fenêtres CURRENT_DATE). Le snapshot est rafraîchi après l'insertion des lignes : une réponse
+    calculée entre les deux reste sous l'ancienne version du snapshot et n'est plus servie ensuite.
+    """
+    db = get_async_db()
+    query = """
+        SELECT (SELECT MAX(id) FROM velo_clean) AS velo, (SELECT MAX(id) FROM model_data) AS pred,
+               (SELECT last_velo_id || '.' || last_pred_id || '.' || window_date
+                FROM map_snapshot_state WHERE id = 1) AS snapshot
+    """
+    row = await db.fetchrow(query)
+    return f"{row['velo']}-{row['pred']}-{row['snapshot']}-{date.today()}"
+
+data_version = DataVersion(_load_data_version, ttl_seconds=int(os.getenv("DATA_VERSION_TTL", "300")))
+
+# Single-flight : requêtes identiques concurrentes servies par un seul calcul
+single_flight = SingleFlight()
+SINGLEFLIGHT_CALLS = Counter('velomag_singleflight_calls_total', 'Calculs lancés (requêtes meneuses)', ['endpoint'])
+SINGLEFLIGHT_COALESCED = Counter('velomag_singleflight_coalesced_total', 'Requêtes ayant rejoint un calcul déjà en cours', ['endpoint'])
+
+async def coalesced(endpoint: str, key: str, fn):
+    """Exécute `fn` une seule fois pour toutes les requêtes concurrentes de même clé."""
+    result, shared = await single_flight.do(key, fn)
+    (SINGLEFLIGHT_COALESCED if shared else SINGLEFLIGHT_CALLS).labels(endpoint=endpoint).inc()
+    return result
+
+async def cached_response(request: Request, endpoint: str, params: dict, load, group_by: str = None) -> Response:
+    """
+    Sert la réponse depuis le cache (clé = endpoint + paramètres + format + version des données).
+    `load` est une coroutine qui retourne des Rows ou un DataFrame (ou un couple données, en-têtes
+    supplémentaires), sérialisés dans le format négocié (JSON, colonnes, Arrow, Parquet).
+    Un dict (réponse structurée, non tabulaire) est toujours servi en JSON.
+    Gère ETag / If-None-Match : le client reçoit un 304 si rien n'a changé.
+    Une requête SQL qui dépasse DB_QUERY_TIMEOUT renvoie un 504.
+    """
+    try:
+        fmt = negotiate(request)
+    except ValueError as e:
+        raise HTTPException(406, str(e))
+
+    version = await data_version.current()
+    key = ResponseCache.make_key(endpoint, {**params, "format": fmt}, version)
+
+    async def compute():
+        try:
+            result = await load()
+        except TimeoutError:
+            raise HTTPException(504, f"Requête trop longue ({endpoint})")
+        data, extra_headers = result if isinstance(result, tuple) else (result, {})
+        if isinstance(data, dict):
+            body, media_type = orjson.dumps(data), MEDIA_TYPES["json"]
+        else:
+            body, media_type = serialize(data, fmt, group_by), MEDIA_TYPES[fmt]
+        return response_cache.put(key, body, media_type, extra_headers)
+
+    entry = response_cache.get(key)
+    if entry is None:
+        # Cache froid : les requêtes identiques simultanées partagent un seul calcul
+        entry = await coalesced(endpoint, key, compute)
+
+    # Même décision que GZipMiddleware : le corps compressé a son propre ETag
+    gzipped = len(entry.body) >= GZIP_MIN_SIZE and "gzip" in request.headers.get("accept-encoding", "")
+    etag = encoding_etag(entry.etag, "gzip" if gzipped else None)
+    headers = {
+        **entry.headers, "ETag": etag, "X-Data-Version": version,
+        "Cache-Control": "no-cache", "Vary": "Accept, Accept-Encoding",
+    }
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    RESPONSE_BYTES.labels(endpoint=endpoint_label(request.url.path), format=fmt).observe(len(entry.body))
+    return Response(content=entry.body, media_type=entry.media_type, headers=headers)
+
+def wants_stream(request: Request, stream: bool) -> Optional[str]:
+    """Format de diffusion en flux (ndjson, ou json avec ?stream=true), sinon None."""
+    try:
+        fmt = negotiate(request)
+    except ValueError as e:
+        raise HTTPException(406, str(e))
+    if fmt == "ndjson" or (stream and fmt == "json"):
+        return fmt
+    return None
+
+def streamed_response(request: Request, db, query: str, params: dict, fmt: str, headers: dict = None) -> StreamingResponse:
+    """
+    Diffuse le résultat au fil d'un curseur serveur, lot par lot, sans construire
+    la réponse entière en mémoire. Chaque lot n'est lu qu'après l'envoi du précédent
+    (backpressure : un client lent ralentit la lecture, pas la mémoire).
+    Pas de cache ni d'ETag sur ce chemin : la réponse n'est jamais entièrement matérialisée.
+    """
+    opening, closing = STREAM_BOUNDS[fmt]
+
+    async def body():
+        yield opening
+        first = True
+        size = len(opening) + len(closing)
+        try:
+            async for columns, rows in db.stream(query, params):
+                chunk = encode_chunk(Rows(columns, rows), fmt, first)
+                size += len(chunk)
+                yield chunk
+                first = False
+        except Exception as e:
+            # Les en-têtes (200) sont déjà partis : on ne peut que tronquer la réponse
+            print(f" Erreur pendant la diffusion : {e}")
+            raise
+        yield closing
+        RESPONSE_BYTES.labels(endpoint=endpoint_label(request.url.path), format=fmt).observe(size)
+
+    return StreamingResponse(body(), media_type=MEDIA_TYPES[fmt], headers=headers)
+
 @app.get("/")
-def root():
+async def root():
     return {"message": "API VéloMag est en ligne ! 🚲", "status": "secure & fast"}
 
+@app.get("/version")
+async def get_data_version():
+    """Version courante des données : un client peut garder ses réponses tant qu'elle ne change pas."""
+    return {"version": await data_version.current()}
+
+# --- DÉMARRAGE À CHAUD ---
+# État du préchauffage (pending -> done | failed), étapes et durée (secondes), exposés par /ready
+warmup_state = {"status": "pending", "steps": {}, "error": None}
+
+async def _internal_get(path: str) -> int:
+    """GET interne (sans réseau) à travers toute la pile ASGI : remplit le cache de réponses."""
+    status = 0
+    path, _, query = path.partition("?")
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": query.encode(),
+        "root_path": "", "headers": [], "client": ("127.0.0.1", 0), "server": ("warmup", 80),
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    await app(scope, receive, send)
+    return status
+
+async def warmup():
+    """
+    Ouvre le pool, lit la version des données, précalcule les réponses les plus demandées
+    (API_WARMUP_PATHS) et charge le modèle en ligne. Borné par API_WARMUP_TIMEOUT :
+    une BDD endormie ne bloque pas le démarrage, le premier client paiera simplement le coût.
+    """
+    paths = [p for p in os.getenv("API_WARMUP_PATHS", "/counters,/map-summary,/map-data").split(",") if p]
+    steps = warmup_state["steps"]
+
+    async def run():
+        start = time.perf_counter()
+        db = get_async_db()
+        if db:
+            await db.pool()
+            await data_version.current()
+        steps["pool"] = round(time.perf_counter() - start, 3)
+
+        for path in paths:
+            start = time.perf_counter()
+            status = await _internal_get(path)
+            steps[path] = round(time.perf_counter() - start, 3)
+            if status != 200:
+                print(f" ⚠ Préchauffage {path} : HTTP {status}")
+
+        start = time.perf_counter()
+        await asyncio.to_thread(get_online_predictor)
+        steps["model"] = round(time.perf_counter() - start, 3)
+
+    try:
+        await asyncio.wait_for(run(), timeout=float(os.getenv("API_WARMUP_TIMEOUT", "60")))
+        warmup_state["status"] = "done"
+        print(f" Préchauffage terminé : {steps}")
+    except Exception as e:
+        # Échec consigné : l'API reste prête, les réponses non préchauffées seront calculées à la demande
+        warmup_state["status"] = "failed"
+        warmup_state["error"] = f"{type(e).__name__}: {e}"
+        print(f" ⚠ Préchauffage interrompu ({type(e).__name__}) : {steps}")
+
+@app.get("/ready")
+async def readiness():
+    """
+    Sonde de disponibilité : 200 si la BDD répond et que le préchauffage (s'il est activé) a été tenté.
+    Un préchauffage en échec ne bloque pas : son état et son erreur sont dans la réponse.
+    """
+    db = get_async_db()
+    try:
+        await db.fetchrow("SELECT 1", timeout=2)
+    except Exception as e:
+        raise HTTPException(503, f"BDD indisponible : {e}")
+    if os.getenv("API_WARMUP", "0") == "1" and warmup_state["status"] == "pending":
+        raise HTTPException(503, "Préchauffage en cours")
+    return {"status": "ready", "warmup": warmup_state}
+
 # #Version lourde :
 # @app.get("/counters")
 # def get_list_counters():
@@ -73,22 +345,20 @@ def root():
 #         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/counters")
-def get_list_counters():
+async def get_list_counters():
     """Retourne la liste unique des compteurs (Optimisé SQL)."""
-    db = get_db()
+    db = get_async_db()
     if not db: raise HTTPException(500, "Database non connectée")
     
     try:
         # OPTIMISATION : On ne récupère que les noms uniques
         query = "SELECT DISTINCT counter_id FROM model_data ORDER BY counter_id"
-        
-        with db.engine.connect() as conn:
-            df = pd.read_sql(query, conn)
-        
-        if df.empty: return {"counters": []}
-        
-        return {"counters": df['counter_id'].tolist()}
+        # Requêtes simultanées (rafraîchissements groupés) : une seule lecture en BDD
+        _, rows = await coalesced("counters", "counters", lambda: db.fetch(query))
+        return {"counters": [row[0] for row in rows]}
 
+    except TimeoutError:
+        raise HTTPException(504, "Requête trop longue (counters)")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
@@ -116,30 +386,93 @@ def get_list_counters():
 #     except Exception as e:
 #         raise HTTPException(status_code=500, detail=str(e))
 
+# Fenêtre par défaut (depuis la dernière donnée du compteur) selon la résolution :
+# un appel sans bornes reste borné, et une courbe longue reste à quelques centaines de points
+HISTORY_DEFAULT_WINDOW = {"hour": "30 day", "day": "365 day", "week": "1825 day"}
+
 @app.get("/history/{counter_id}")
-def get_history(counter_id: str):
-    """Retourne l'historique réel (Sécurisé & Optimisé)."""
-    db = get_db()
+async def get_history(
+    counter_id: str,
+    request: Request,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    resolution: Literal["hour", "day", "week"] = "hour",
+    after: Optional[datetime] = Query(None, description="Curseur : renvoie les points strictement après cette date"),
+    limit: int = Query(5000, ge=1, le=50000),
+    stream: bool = Query(False, description="Diffusion en flux (tableau JSON envoyé par morceaux)"),
+    days: Optional[int] = Query(None, ge=1, le=3650, description="Fenêtre (jours) depuis la dernière donnée, sans start"),
+):
+    """
+    Retourne l'historique réel (Sécurisé & Optimisé, mis en cache avec ETag).
+    - start / end : bornes temporelles (défaut : fenêtre récente selon la résolution, ou `days` jours)
+    - resolution : hour (brut) / day / week (agrégé en SQL avec date_trunc)
+    - after + limit : pagination par clé ; le curseur suivant est dans l'en-tête X-Next-Cursor
+    - stream / Accept: application/x-ndjson : diffusion en flux depuis un curseur serveur
+      (au plus `limit` points, sans X-Next-Cursor : on repart de la dernière date reçue)
+    """
+    db = get_async_db()
     if not db: raise HTTPException(500, "Database non connectée")
-    
+
+    def history_query(row_limit):
+        # SÉCURITÉ : On utilise des placeholders %(...)s (traduits en $1, $2... pour asyncpg)
+        # OPTIMISATION : On ne sélectionne que les colonnes (et la période) utiles
+        params = {"id": counter_id, "limit": row_limit}
+        conditions = ["counter_id = %(id)s"]
+        if start:
+            conditions.append("datetime >= %(start)s")
+            params["start"] = start
+        else:
+            window = f"{days} day" if days else HISTORY_DEFAULT_WINDOW[resolution]
+            conditions.append(
+                "datetime >= (SELECT MAX(datetime) FROM velo_clean WHERE counter_id = %(id)s)"
+                f" - INTERVAL '{window}'"
+            )
+        if end:
+            conditions.append("datetime < %(end)s")
+            params["end"] = end
+        where = " AND ".join(conditions)
+
+        if resolution == "hour":
+            source = f"SELECT datetime, intensity FROM velo_clean WHERE {where}"
+        else:
+            # Agrégation côté SQL : un point par jour / semaine
+            source = f"""
+                SELECT date_trunc('{resolution}', datetime) AS datetime, SUM(intensity) AS intensity
+                FROM velo_clean WHERE {where}
+                GROUP BY 1
+            """
+
+        # Pagination par clé (keyset) : pas d'OFFSET, on repart du dernier point reçu
+        query = f"SELECT datetime, intensity AS count FROM ({source}) AS h"
+        if after:
+            query += " WHERE datetime > %(after)s"
+            params["after"] = after
+        query += " ORDER BY datetime ASC LIMIT %(limit)s"
+        return query, params
+
+    stream_fmt = wants_stream(request, stream)
+    if stream_fmt:
+        return streamed_response(request, db, *history_query(limit), stream_fmt)
+
+    async def load():
+        # L'injection SQL est bloquée ici grâce à 'params'
+        _, rows = await db.fetch(*history_query(limit + 1))
+
+        headers = {}
+        if len(rows) > limit:
+            rows = rows[:limit]
+            headers["X-Next-Cursor"] = rows[-1][0].isoformat()
+
+        return Rows(["datetime", "count"], rows), headers
+
+    key_params = {
+        "id": counter_id, "start": start, "end": end,
+        "resolution": resolution, "after": after, "limit": limit, "days": days,
+    }
     try:
-        # SÉCURITÉ : On utilise un placeholder %(id)s
-        # OPTIMISATION : On ne sélectionne que les colonnes utiles
-        query = """
-            SELECT datetime, intensity 
-            FROM velo_clean 
-            WHERE counter_id = %(id)s
-            ORDER BY datetime ASC
-        """
-        
-        with db.engine.connect() as conn:
-            # L'injection SQL est bloquée ici grâce à 'params'
-            df = pd.read_sql(query, conn, params={"id": counter_id})
-            
-        df = df.rename(columns={'intensity': 'count'})
-        df['datetime'] = df['datetime'].astype(str)
-        
-        return df.to_dict(orient="records")
+        return await cached_response(request, "history", key_params, load)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -157,30 +490,186 @@ def get_history(counter_id: str):
 #         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/prediction/{counter_id}")
-def get_prediction(counter_id: str):
+async def get_prediction(counter_id: str, request: Request):
     """
-    Retourne les prédictions.
+    Retourne les prédictions (mises en cache avec ETag).
     CORRECTIF : On regarde 30 jours en arrière pour combler les trous
     si l'historique réel s'est arrêté il y a longtemps (ex: le 2 déc).
     """
-    db = get_db()
+    db = get_async_db()
     if not db: raise HTTPException(500, "Database unavailable")
-    try:
+
+    async def load():
         # AVANT : AND datetime >= CURRENT_DATE (Stricte futur -> Créait le trou du 2 au 14 déc)
         # APRES : AND datetime >= CURRENT_DATE - INTERVAL '30 day'
         query = """
-            SELECT datetime, predicted_values 
+            SELECT datetime, predicted_values AS count
             FROM model_data 
             WHERE counter_id = %(id)s
             AND datetime >= CURRENT_DATE - INTERVAL '21 day'
             ORDER BY datetime ASC
         """
-        with db.engine.connect() as conn:
-            df = pd.read_sql(query, conn, params={"id": counter_id})
-            
-        df = df.rename(columns={'predicted_values': 'count'})
-        df['datetime'] = df['datetime'].astype(str)
-        return df.to_dict(orient="records")
+        return Rows(*await db.fetch(query, {"id": counter_id}))
+
+    try:
+        return await cached_response(request, "prediction", {"id": counter_id}, load)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/predict/{counter_id}")
+async def predict_online(
+    counter_id: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    temperature_2m: Optional[float] = None,
+    wind_speed_10m: Optional[float] = None,
+    precipitation: Optional[float] = None,
+):
+    """
+    Prédiction à la demande (what-if) : compteur, plage horaire et météo optionnelle.
+    Par défaut : les 24h de demain. Les requêtes concurrentes sont regroupées en micro-lots.
+    """
+    import pandas as pd
+
+    # Chargement (ou nouvel essai) hors de la boucle d'événements
+    predictor = await asyncio.to_thread(get_online_predictor)
+    if not predictor: raise HTTPException(500, "Modèle indisponible")
+
+    # Même convention que les tables : UTC sans fuseau
+    start = pd.Timestamp(to_naive_utc(start)) if start else pd.Timestamp.now().normalize() + timedelta(days=1)
+    end = pd.Timestamp(to_naive_utc(end)) if end else start + timedelta(hours=23)
+    if end < start:
+        raise HTTPException(400, "'end' doit être postérieur à 'start'")
+    if end - start > timedelta(days=14):
+        raise HTTPException(400, "Plage limitée à 14 jours")
+
+    weather = {
+        'temperature_2m': temperature_2m,
+        'wind_speed_10m': wind_speed_10m,
+        'precipitation': precipitation,
+    }
+    try:
+        df = await predictor.predict(counter_id, start, end, weather)
+    except KeyError:
+        raise HTTPException(404, f"Compteur inconnu : {counter_id}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    df['datetime'] = df['datetime'].astype(str)
+    return df.to_dict(orient="records")
+
+# --- ENDPOINTS MULTI-COMPTEURS : une seule requête SQL pour N compteurs ---
+MAX_BATCH_ROWS = int(os.getenv("MAX_BATCH_ROWS", "500000"))
+
+async def _read_batch(db, query: str, params: dict) -> Rows:
+    """Exécute une requête batch bornée à MAX_BATCH_ROWS lignes (413 au-delà)."""
+    rows = Rows(*await db.fetch(query + " LIMIT %(max_rows)s", {**params, "max_rows": MAX_BATCH_ROWS + 1}))
+    if len(rows) > MAX_BATCH_ROWS:
+        raise HTTPException(413, f"Plus de {MAX_BATCH_ROWS} lignes : réduisez la période ou la liste de compteurs")
+    return rows
+
+@app.get("/batch/history")
+async def get_history_batch(
+    request: Request,
+    counter_ids: Optional[list[str]] = Query(None, description="Compteurs (répéter le paramètre). Vide = tous"),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    resolution: Literal["hour", "day", "week"] = "hour",
+):
+    """
+    Historique réel de plusieurs compteurs (ou de tous) en un seul aller-retour,
+    regroupé par compteur dans la réponse.
+    """
+    db = get_async_db()
+    if not db: raise HTTPException(500, "Database non connectée")
+
+    async def load():
+        params = {}
+        conditions = []
+        if counter_ids:
+            conditions.append("counter_id = ANY(%(ids)s)")
+            params["ids"] = list(counter_ids)
+        if start:
+            conditions.append("datetime >= %(start)s")
+            params["start"] = start
+        else:
+            conditions.append(
+                "datetime >= (SELECT MAX(datetime) FROM velo_clean)"
+                f" - INTERVAL '{HISTORY_DEFAULT_WINDOW[resolution]}'"
+            )
+        if end:
+            conditions.append("datetime < %(end)s")
+            params["end"] = end
+        where = " AND ".join(conditions)
+
+        if resolution == "hour":
+            query = f"""
+                SELECT counter_id, datetime, intensity AS count
+                FROM velo_clean WHERE {where}
+                ORDER BY counter_id, datetime
+            """
+        else:
+            query = f"""
+                SELECT counter_id, date_trunc('{resolution}', datetime) AS datetime, SUM(intensity) AS count
+                FROM velo_clean WHERE {where}
+                GROUP BY 1, 2
+                ORDER BY 1, 2
+            """
+        return await _read_batch(db, query, params)
+
+    key_params = {
+        "ids": sorted(counter_ids or []), "start": start, "end": end, "resolution": resolution,
+    }
+    try:
+        return await cached_response(request, "batch-history", key_params, load, group_by="counter_id")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/batch/prediction")
+async def get_prediction_batch(
+    request: Request,
+    counter_ids: Optional[list[str]] = Query(None, description="Compteurs (répéter le paramètre). Vide = tous"),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+):
+    """
+    Prédictions de plusieurs compteurs (ou de tous) en un seul aller-retour,
+    regroupées par compteur. Par défaut : même fenêtre que /prediction (J-21 -> ...).
+    """
+    db = get_async_db()
+    if not db: raise HTTPException(500, "Database unavailable")
+
+    async def load():
+        params = {}
+        conditions = ["counter_id IS NOT NULL"]
+        if counter_ids:
+            conditions.append("counter_id = ANY(%(ids)s)")
+            params["ids"] = list(counter_ids)
+        if start:
+            conditions.append("datetime >= %(start)s")
+            params["start"] = start
+        else:
+            conditions.append("datetime >= CURRENT_DATE - INTERVAL '21 day'")
+        if end:
+            conditions.append("datetime < %(end)s")
+            params["end"] = end
+
+        query = f"""
+            SELECT counter_id, datetime, predicted_values AS count
+            FROM model_data WHERE {" AND ".join(conditions)}
+            ORDER BY counter_id, datetime
+        """
+        return await _read_batch(db, query, params)
+
+    key_params = {"ids": sorted(counter_ids or []), "start": start, "end": end}
+    try:
+        return await cached_response(request, "batch-prediction", key_params, load, group_by="counter_id")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -337,16 +826,93 @@ def get_prediction(counter_id: str):
 #         print(f" Erreur map-data: {e}")
 #         raise HTTPException(status_code=500, detail=str(e))
 
+_MAP_SNAPSHOT_SELECT = """
+    SELECT counter_id, datetime AS date, value AS predicted_intensity, is_real, lat, lon,
+           15.0::float8 AS temperature_2m
+    FROM map_snapshot
+    WHERE datetime >= CURRENT_DATE - INTERVAL '21 day'
+    AND datetime < CURRENT_DATE + INTERVAL '2 day'
+"""
+MAP_SNAPSHOT_QUERY = _MAP_SNAPSHOT_SELECT + "    ORDER BY counter_id, datetime\n"
+# Synchro incrémentale : lignes insérées / modifiées après la révision `since`
+MAP_DELTA_QUERY = _MAP_SNAPSHOT_SELECT + "    AND revision > %(since)s\n    ORDER BY counter_id, datetime\n"
+MAP_DELETED_QUERY = """
+    SELECT counter_id, datetime AS date FROM map_snapshot_deleted
+    WHERE revision > %(since)s ORDER BY revision
+"""
+# Révision courante (dernière ligne modifiée ou supprimée) et plus ancienne révision servie en delta
+MAP_REVISION_QUERY = """
+    SELECT GREATEST(
+        (SELECT COALESCE(MAX(revision), 0) FROM map_snapshot),
+        (SELECT COALESCE(MAX(revision), 0) FROM map_snapshot_deleted)
+    ) AS revision,
+    (SELECT COALESCE(MAX(min_revision), 0) FROM map_snapshot_state) AS min_revision
+"""
+
+async def _map_revision(db):
+    """(révision, révision minimale) du snapshot, None si la synchro incrémentale n'est pas disponible."""
+    try:
+        row = await db.fetchrow(MAP_REVISION_QUERY)
+        return row["revision"], row["min_revision"]
+    except TimeoutError:
+        raise
+    except Exception as e:
+        print(f" ⚠ Révision du snapshot illisible : {e}")
+        return None
+
+async def _load_map_snapshot(db) -> Rows:
+    """Lit le snapshot de la carte (fenêtre J-21 -> J+2). Rows vide si indisponible."""
+    try:
+        return Rows(*await db.fetch(MAP_SNAPSHOT_QUERY))
+    except TimeoutError:
+        raise
+    except Exception as e:
+        print(f" ⚠ Snapshot carte indisponible : {e}")
+        return Rows([], [])
+
 @app.get("/map-data")
-def get_map_data():
+async def get_map_data(
+    request: Request,
+    stream: bool = Query(False, description="Diffusion en flux (tableau JSON envoyé par morceaux)"),
+    since: Optional[int] = Query(None, ge=0, description="Synchro incrémentale : révision déjà reçue (X-Map-Revision)"),
+):
     """
     Route Carte : Assure une continuité parfaite Historique -> Prédiction.
     On récupère large en SQL pour être sûr d'avoir une prédiction en face de chaque trou potentiel.
+    Réponse mise en cache (ETag) : recalculée seulement quand les données changent.
+    Avec stream / Accept: application/x-ndjson, le snapshot est diffusé en flux.
+    La révision du snapshot est dans l'en-tête X-Map-Revision ; avec ?since=<révision>,
+    seules les lignes modifiées et les clés supprimées depuis sont renvoyées (cf. map_data_delta).
     """
-    db = get_db()
+    db = get_async_db()
     if not db: raise HTTPException(500, "Database non connectée")
 
-    try:
+    if since is not None:
+        return await map_data_delta(request, db, since)
+
+    stream_fmt = wants_stream(request, stream)
+    if stream_fmt:
+        try:
+            has_snapshot = await db.fetchrow("SELECT EXISTS (SELECT 1 FROM map_snapshot) AS ok")
+        except Exception as e:
+            print(f" ⚠ Snapshot carte indisponible : {e}")
+            has_snapshot = None
+        # Sans snapshot, le calcul de repli (en mémoire) passe par la réponse en cache
+        if has_snapshot and has_snapshot["ok"]:
+            # Révision lue AVANT les lignes : au pire le prochain delta renvoie des lignes déjà reçues
+            revision = await _map_revision(db)
+            headers = {"X-Map-Revision": str(revision[0])} if revision else None
+            return streamed_response(request, db, MAP_SNAPSHOT_QUERY, {}, stream_fmt, headers)
+
+    async def load():
+        # 0. LECTURE DIRECTE DU SNAPSHOT PRÉ-CALCULÉ (une seule requête indexée)
+        # Le "zippage" réel/prédiction est déjà fait à l'ingestion / la prédiction.
+        revision = await _map_revision(db)
+        snapshot = await _load_map_snapshot(db)
+        if len(snapshot):
+            return snapshot, ({"X-Map-Revision": str(revision[0])} if revision else {})
+
+        # Repli (snapshot absent ou vide) : calcul à la volée
         # 1. DÉFINITION DE LA FENÊTRE LARGE
         # On regarde 3 jours en arrière pour être sûr de combler les trous récents
         # et 2 jours en avant pour le futur.
@@ -371,10 +937,11 @@ def get_map_data():
 
         query_loc = "SELECT DISTINCT ON (counter_id) counter_id, lat, lon FROM velo_clean"
 
-        with db.engine.connect() as conn:
-            df_real = pd.read_sql(query_real, conn)
-            df_pred = pd.read_sql(query_pred, conn)
-            df_locs = pd.read_sql(query_loc, conn)
+        import pandas as pd
+
+        # Les trois requêtes partent en parallèle sur le pool
+        results = await asyncio.gather(db.fetch(query_real), db.fetch(query_pred), db.fetch(query_loc))
+        df_real, df_pred, df_locs = (pd.DataFrame.from_records(rows, columns=cols) for cols, rows in results)
 
         # 2. STANDARDISATION
         df_real['datetime'] = pd.to_datetime(df_real['datetime'])
@@ -403,7 +970,6 @@ def get_map_data():
         })
         
         df_final['temperature_2m'] = 15.0
-        df_final['date'] = df_final['date'].astype(str)
         
         # On trie pour avoir une belle ligne continue
         df_final = df_final.sort_values(by=['counter_id', 'date'])
@@ -412,8 +978,12 @@ def get_map_data():
         cols_to_keep = ['counter_id', 'date', 'predicted_intensity', 'lat', 'lon', 'temperature_2m']
         cols_final = [c for c in cols_to_keep if c in df_final.columns]
 
-        return df_final[cols_final].to_dict(orient="records")
+        return df_final[cols_final]
 
+    try:
+        return await cached_response(request, "map-data", {}, load)
+    except HTTPException:
+        raise
     except Exception as e:
         print(f" Erreur map-data: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -421,60 +991,290 @@ def get_map_data():
 
 
     
+# Même fenêtre que /map-data (snapshot J-21 -> J+2)
+MAP_WINDOW = "datetime >= CURRENT_DATE - INTERVAL '21 day' AND datetime < CURRENT_DATE + INTERVAL '2 day'"
+
+async def map_data_delta(request: Request, db, since: int) -> Response:
+    """
+    Delta du snapshot carte depuis la révision `since` :
+    {"revision", "reset", "rows": [...], "deleted": [{"counter_id", "date"}]}.
+    Le client applique d'abord les suppressions, puis remplace les lignes reçues (clé : counter_id, date).
+    reset=true : `since` est trop ancien (suppressions purgées) ou inconnu, `rows` contient tout le snapshot.
+    revision=null : pas de synchro possible (snapshot absent), le client repasse par /map-data.
+    """
+    async def load():
+        revision = await _map_revision(db)
+        if revision is None:
+            return {"revision": None, "reset": True, "rows": [], "deleted": []}
+        current, floor = revision
+        reset = since < floor or since > current
+        if reset:
+            rows, deleted = await _load_map_snapshot(db), Rows([], [])
+        else:
+            params = {"since": since}
+            (cols_r, rows_r), (cols_d, rows_d) = await asyncio.gather(
+                db.fetch(MAP_DELTA_QUERY, params), db.fetch(MAP_DELETED_QUERY, params)
+            )
+            rows, deleted = Rows(cols_r, rows_r), Rows(cols_d, rows_d)
+        return {
+            "revision": current, "reset": reset,
+            "rows": encode_records(rows), "deleted": encode_records(deleted),
+        }
+
+    try:
+        return await cached_response(request, "map-data-delta", {"since": since}, load)
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f" Erreur map-data (delta): {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Source de repli de /map-summary quand le snapshot est vide ou périmé : même "zippage" que le
+# snapshot (réel sinon prédiction, sinon 0), calculé en SQL sur velo_clean / model_data
+MAP_LIVE_SOURCE = f"""(
+    WITH real AS (
+        SELECT DISTINCT ON (counter_id, datetime) counter_id, datetime, intensity
+        FROM velo_clean WHERE datetime >= CURRENT_DATE - INTERVAL '7 day'
+        ORDER BY counter_id, datetime, id DESC
+    ),
+    pred AS (
+        SELECT DISTINCT ON (counter_id, datetime) counter_id, datetime, predicted_values
+        FROM model_data WHERE counter_id IS NOT NULL AND {MAP_WINDOW}
+        ORDER BY counter_id, datetime, id DESC
+    ),
+    merged AS (
+        SELECT COALESCE(r.counter_id, p.counter_id) AS counter_id,
+               COALESCE(r.datetime, p.datetime) AS datetime,
+               COALESCE(r.intensity, p.predicted_values, 0) AS value
+        FROM real r FULL OUTER JOIN pred p ON p.counter_id = r.counter_id AND p.datetime = r.datetime
+    ),
+    locs AS (
+        SELECT DISTINCT ON (counter_id) counter_id, lat, lon FROM velo_clean
+        WHERE counter_id IN (SELECT counter_id FROM merged)
+        ORDER BY counter_id, id DESC
+    )
+    SELECT m.counter_id, m.datetime, m.value, l.lat, l.lon
+    FROM merged m LEFT JOIN locs l ON l.counter_id = m.counter_id
+) AS live"""
+
+# Snapshot utilisable : non vide et reconstruit pour la fenêtre du jour
+MAP_SNAPSHOT_FRESH_QUERY = """
+    SELECT EXISTS (SELECT 1 FROM map_snapshot)
+       AND EXISTS (SELECT 1 FROM map_snapshot_state WHERE window_date = CURRENT_DATE) AS fresh
+"""
+
+async def _map_summary_source(db) -> str:
+    """Table agrégée par /map-summary : le snapshot s'il est à jour, sinon le calcul SQL de repli."""
+    try:
+        row = await db.fetchrow(MAP_SNAPSHOT_FRESH_QUERY)
+        if row and row["fresh"]:
+            return "map_snapshot"
+    except TimeoutError:
+        raise
+    except Exception as e:
+        print(f" ⚠ Snapshot carte indisponible : {e}")
+    print(" ⚠ Snapshot carte vide ou périmé : résumé calculé sur velo_clean / model_data.")
+    return MAP_LIVE_SOURCE
+
+@app.get("/map-summary")
+async def get_map_summary(request: Request, day: Optional[date] = Query(None, alias="date")):
+    """
+    Résumé de la carte pour une journée, agrégé en SQL sur le snapshot :
+    - counters : total du jour par compteur (avec coordonnées) -> marqueurs
+    - hourly : profil horaire de la ville (24 points)
+    - dates : journées disponibles (défaut : aujourd'hui si disponible, sinon la plus récente)
+    Quelques centaines d'octets au lieu des lignes horaires de tous les compteurs.
+    Snapshot vide ou périmé (pas reconstruit aujourd'hui) : même agrégat sur velo_clean / model_data.
+    """
+    db = get_async_db()
+    if not db: raise HTTPException(500, "Database non connectée")
+
+    async def load():
+        source = await _map_summary_source(db)
+        _, date_rows = await db.fetch(f"SELECT DISTINCT datetime::date AS day FROM {source} WHERE {MAP_WINDOW} ORDER BY 1")
+        dates = [row[0] for row in date_rows]
+        selected = day or (date.today() if date.today() in dates else (dates[-1] if dates else None))
+        summary = {
+            "date": selected.isoformat() if selected else None,
+            "dates": [d.isoformat() for d in dates],
+            "counters": [],
+            "hourly": [{"hour": h, "total": 0.0} for h in range(24)],
+            "total": 0.0,
+            "temperature_2m": 15.0,
+        }
+        if selected is None:
+            return summary
+
+        # Seuls les compteurs localisés sont affichés (et comptés)
+        day_filter = """
+            datetime >= %(day)s::date AND datetime < %(day)s::date + 1
+            AND lat IS NOT NULL AND lon IS NOT NULL
+        """
+        query_counters = f"""
+            SELECT counter_id, SUM(value) AS total, MAX(lat) AS lat, MAX(lon) AS lon
+            FROM {source} WHERE {day_filter}
+            GROUP BY counter_id ORDER BY counter_id
+        """
+        query_hourly = f"""
+            SELECT h.hour, COALESCE(SUM(s.value), 0) AS total
+            FROM generate_series(0, 23) AS h(hour)
+            LEFT JOIN (SELECT datetime, value FROM {source} WHERE {day_filter}) s
+              ON EXTRACT(HOUR FROM s.datetime) = h.hour
+            GROUP BY h.hour ORDER BY h.hour
+        """
+        params = {"day": selected}
+        (cols_c, rows_c), (cols_h, rows_h) = await asyncio.gather(
+            db.fetch(query_counters, params), db.fetch(query_hourly, params)
+        )
+        summary["counters"] = [dict(zip(cols_c, row)) for row in rows_c]
+        summary["hourly"] = [dict(zip(cols_h, row)) for row in rows_h]
+        summary["total"] = sum(row["total"] for row in summary["counters"])
+        return summary
+
+    try:
+        return await cached_response(request, "map-summary", {"date": day}, load)
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f" Erreur map-summary: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/cache/invalidate")
+async def invalidate_cache(request: Request):
+    """
+    À appeler quand de nouvelles données sont publiées (ingestion / prédiction) :
+    vide le cache des réponses et force la relecture de la version des données.
+    """
+    # Sans CACHE_INVALIDATE_TOKEN configuré, l'endpoint est fermé
+    token = os.getenv("CACHE_INVALIDATE_TOKEN")
+    if not token or not secrets.compare_digest(request.headers.get("x-invalidate-token", "").encode(), token.encode()):
+        raise HTTPException(403, "Token invalide")
+
+    data_version.bump()
+    response_cache.clear()
+    if _online_predictor is not None:
+        _online_predictor.window.invalidate()
+    return {"status": "success"}
+
+def _scores_from_sums(n, sum_abs_err, sum_sq_err, sum_real, sum_sq_real) -> dict:
+    """MAE / RMSE / R² à partir des statistiques suffisantes (sommes, sommes des carrés, effectif)."""
+    # Somme des carrés totale : sum(y²) - (sum y)² / n
+    sst = sum_sq_real - sum_real * sum_real / n
+    return {
+        "mae": sum_abs_err / n,
+        "rmse": math.sqrt(sum_sq_err / n),
+        "r2": 1 - sum_sq_err / sst if sst > 0 else float("nan"),
+    }
+
+def _json_float(value: float, digits: int):
+    # NaN (R² indéfini sur une série constante) n'existe pas en JSON
+    return None if math.isnan(value) else round(value, digits)
+
+def _scores_by_counter(rows) -> tuple:
+    """({counter_id: (paires, scores)}, sommes globales) à partir des lignes (counter_id, n, sommes...) de score_stats."""
+    per_counter, totals = {}, [0.0] * 5
+    for counter_id, *sums in rows:
+        sums = [float(x) for x in sums]
+        per_counter[counter_id] = (sums[0], _scores_from_sums(*sums))
+        totals = [t + x for t, x in zip(totals, sums)]
+    return per_counter, totals
+
+def _set_score_gauges(rows):
+    """Jauges Prometheus des scores (par compteur puis global), sur tout l'historique de score_stats."""
+    per_counter, totals = _scores_by_counter(rows)
+    for counter_id, (pairs, scores) in per_counter.items():
+        COUNTER_MAE_METRIC.labels(counter_id=counter_id).set(scores["mae"])
+        COUNTER_RMSE_METRIC.labels(counter_id=counter_id).set(scores["rmse"])
+        COUNTER_R2_METRIC.labels(counter_id=counter_id).set(scores["r2"])
+        COUNTER_PAIRS_METRIC.labels(counter_id=counter_id).set(pairs)
+    if totals[0]:
+        scores = _scores_from_sums(*totals)
+        MAE_METRIC.set(scores["mae"])
+        RMSE_METRIC.set(scores["rmse"])
+        R2_METRIC.set(scores["r2"])
+
+# Sommes par compteur (quelques lignes) ; `window` : filtre optionnel sur la journée
+SCORE_SUMS_QUERY = """
+    SELECT counter_id, SUM(n) AS n, SUM(sum_abs_err) AS sum_abs_err, SUM(sum_sq_err) AS sum_sq_err,
+           SUM(sum_real) AS sum_real, SUM(sum_sq_real) AS sum_sq_real
+    FROM score_stats {window}
+    GROUP BY counter_id ORDER BY counter_id
+"""
+
+# Dernière relecture des jauges (horloge monotone)
+_score_gauges_read_at = float("-inf")
+
+async def refresh_score_gauges(force: bool = False):
+    """
+    Relit les scores depuis score_stats, au plus toutes les SCORE_GAUGES_TTL secondes (défaut 60) :
+    les jauges suivent les mises à jour faites hors de l'API (orchestrateur, cli_data update-scores).
+    """
+    global _score_gauges_read_at
+    if not force and time.monotonic() - _score_gauges_read_at < float(os.getenv("SCORE_GAUGES_TTL", "60")):
+        return
+    # Marqué avant la lecture : les scrapes concurrents ne relancent pas la requête
+    _score_gauges_read_at = time.monotonic()
+    db = get_async_db()
+    if not db:
+        return
+    try:
+        _, rows = await db.fetch(SCORE_SUMS_QUERY.format(window=""))
+    except Exception as e:
+        print(f" ⚠ Scores non relus : {e}")
+        return
+    _set_score_gauges(rows)
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Exposition Prometheus, jauges des scores rafraîchies depuis la base."""
+    await refresh_score_gauges()
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
 @app.post("/metrics/update-scores")
-def update_scores():
+async def update_scores(days: Optional[int] = Query(None, ge=1, description="Fenêtre des scores (jours). Défaut : tout l'historique")):
     """
-    Calcule les performances.
-    MODE HYBRIDE : Tente le SQL, sinon bascule en Simulation pour ne pas bloquer le monitoring.
+    Calcule les performances de façon incrémentale :
+    seules les paires (réel, prédiction) apparues depuis le dernier appel sont agrégées (en SQL)
+    dans score_stats (sommes par compteur et par jour) ; les scores sont déduits de ces sommes.
+    Renvoie les scores globaux et par compteur sur la fenêtre `days` ; les jauges Prometheus
+    (tout l'historique) sont relues dans la foulée.
     """
     db = get_db()
-    if not db: return {"status": "error", "detail": "Base de données non connectée"}
+    adb = get_async_db()
+    if not db or not adb: return {"status": "error", "detail": "Base de données non connectée"}
 
     try:
-        # 1. Tentative SQL (Données réelles)
-        query = """
-            SELECT v.intensity as real_value, m.predicted_values as pred_value
-            FROM velo_clean v
-            JOIN model_data m ON v.counter_id = m.counter_id AND v.datetime = m.datetime
-        """
-        
-        with db.engine.connect() as conn:
-            df = pd.read_sql(query, conn)
-
-        # 2. Logique de repli (Fallback)
-        if df.empty or len(df) < 10:
-            # CAS ACTUEL : Pas de chevauchement -> On SIMULE pour valider le monitoring
-            print(" Pas de chevauchement de données. Mode SIMULATION activé.")
-            import random
-            
-            # On génère des scores réalistes (un peu aléatoires pour voir les courbes bouger)
-            mae = 10.0 + random.uniform(-1, 1)  # Entre 9 et 11
-            rmse = 15.0 + random.uniform(-1, 1) # Entre 14 et 16
-            r2 = 0.85 + random.uniform(-0.02, 0.02) # Entre 0.83 et 0.87
-            mode = "Simulation (Données disjointes)"
-            
-        else:
-            # CAS IDÉAL : On a des données -> Vrai calcul
-            y_true = df['real_value']
-            y_pred = df['pred_value']
-            mae = mean_absolute_error(y_true, y_pred)
-            rmse = np.sqrt(mean_squared_error(y_true, y_pred))
-            r2 = r2_score(y_true, y_pred)
-            mode = "Calcul Réel SQL"
-
-        # 3. Mise à jour Prometheus
-        MAE_METRIC.set(mae)
-        RMSE_METRIC.set(rmse)
-        R2_METRIC.set(r2)
-        
+        # 1. Mise à jour incrémentale des sommes (requête synchrone -> thread)
+        await asyncio.to_thread(db.update_score_stats)
+
+        # 2. Jauges Prometheus (tout l'historique)
+        await refresh_score_gauges(force=True)
+
+        # 3. Lecture des sommes agrégées par compteur sur la fenêtre demandée
+        window, params = "", {}
+        if days:
+            window, params["days"] = "WHERE day >= CURRENT_DATE - %(days)s::int", days
+        _, rows = await adb.fetch(SCORE_SUMS_QUERY.format(window=window), params)
+
+        if not rows:
+            return {"status": "success", "mode": "Aucune paire réel/prédiction", "metrics": None}
+
+        per_counter, totals = _scores_by_counter(rows)
+        scores = _scores_from_sums(*totals)
+
         return {
-            "status": "success", 
-            "mode": mode,
+            "status": "success",
+            "mode": "Calcul incrémental SQL",
+            "pairs": int(totals[0]),
             "metrics": {
-                "mae": round(mae, 2), 
-                "rmse": round(rmse, 2),
-                "r2": round(r2, 4)
-            }
+                "mae": _json_float(scores["mae"], 2),
+                "rmse": _json_float(scores["rmse"], 2),
+                "r2": _json_float(scores["r2"], 4)
+            },
+            "counters": {
+                counter_id: {k: _json_float(v, 4) for k, v in counter_scores.items()}
+                for counter_id, (_, counter_scores) in per_counter.items()
+            },
         }
 
     except Exception as e:
@@ -483,43 +1283,44 @@ def update_scores():
 
 
 @app.get("/api-test/diag")  # <--- On change en GET et on change le nom pour être sûr
-def diagnostic_db():
+async def diagnostic_db():
     """
     FONCTION DE DIAGNOSTIC
     Vérifie les plages de dates dans les deux tables.
     """
-    db = get_db()
+    db = get_async_db()
     if not db: return {"status": "error", "detail": "Pas de DB"}
 
     try:
-        with db.engine.connect() as conn:
-            # 1. Check Table RÉEL
-            res_real = pd.read_sql("SELECT MIN(datetime) as min_date, MAX(datetime) as max_date, COUNT(*) as total FROM velo_clean", conn)
-            
-            # 2. Check Table PRÉDICTION
-            res_pred = pd.read_sql("SELECT MIN(datetime) as min_date, MAX(datetime) as max_date, COUNT(*) as total FROM model_data", conn)
-            
-            # 3. Check INTERSECTION (Le Join sans filtre)
-            query_join = """
-            SELECT COUNT(*) as nb_matchs 
-            FROM velo_clean v
-            JOIN model_data m ON v.counter_id = m.counter_id AND v.datetime = m.datetime
-            """
-            res_join = pd.read_sql(query_join, conn)
+        # 1. Check Table RÉEL
+        query_real = "SELECT MIN(datetime) as min_date, MAX(datetime) as max_date, COUNT(*) as total FROM velo_clean"
+
+        # 2. Check Table PRÉDICTION
+        query_pred = "SELECT MIN(datetime) as min_date, MAX(datetime) as max_date, COUNT(*) as total FROM model_data"
+
+        # 3. Check INTERSECTION (Le Join sans filtre)
+        query_join = """
+        SELECT COUNT(*) as nb_matchs 
+        FROM velo_clean v
+        JOIN model_data m ON v.counter_id = m.counter_id AND v.datetime = m.datetime
+        """
+        res_real, res_pred, res_join = await asyncio.gather(
+            db.fetchrow(query_real), db.fetchrow(query_pred), db.fetchrow(query_join)
+        )
 
         return {
             "status": "diagnostic",
             "table_velo_clean (Reel)": {
-                "total_lignes": int(res_real['total'].iloc[0]),
-                "debut": str(res_real['min_date'].iloc[0]),
-                "fin": str(res_real['max_date'].iloc[0])
+                "total_lignes": int(res_real['total']),
+                "debut": str(res_real['min_date']),
+                "fin": str(res_real['max_date'])
             },
             "table_model_data (Pred)": {
-                "total_lignes": int(res_pred['total'].iloc[0]),
-                "debut": str(res_pred['min_date'].iloc[0]),
-                "fin": str(res_pred['max_date'].iloc[0])
+                "total_lignes": int(res_pred['total']),
+                "debut": str(res_pred['min_date']),
+                "fin": str(res_pred['max_date'])
             },
-            "INTERSECTION (Matchs)": int(res_join['nb_matchs'].iloc[0])
+            "INTERSECTION (Matchs)": int(res_join['nb_matchs'])
         }
 
     except Exception as e:
@@ -0,0 +1,134 @@
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+
+@dataclass
+class CachedResponse:
+    body: bytes
+    etag: str
+    media_type: str = "application/json"
+    headers: dict = field(default_factory=dict)
+
+
+class ResponseCache:
+    """
+    Cache LRU des réponses déjà sérialisées, borné en nombre d'entrées et en octets.
+    La clé contient la version des données : une nouvelle version rend les anciennes entrées inatteignables.
+    """
+
+    def __init__(self, max_entries: int = 256, max_bytes: int = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(endpoint: str, params: dict, version: str) -> str:
+        return json.dumps([endpoint, params, version], sort_keys=True, default=str)
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: str, body: bytes, media_type: str = "application/json", headers: dict = None) -> CachedResponse:
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        entry = CachedResponse(body, etag, media_type, headers or {})
+        if len(body) > self.max_bytes:
+            return entry  # trop gros pour être gardé, on le sert quand même
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old.body)
+            self._entries[key] = entry
+            self._bytes += len(body)
+
+            # Éviction LRU
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted.body)
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+class DataVersion:
+    """
+    Version courante des données (ex : derniers id de velo_clean / model_data).
+    `loader` est une coroutine, relue au plus toutes les `ttl_seconds`, ou immédiatement après `bump()`.
+    """
+
+    def __init__(self, loader, ttl_seconds: int = 300):
+        self.loader = loader
+        self.ttl = ttl_seconds
+        self.value = None
+        self.checked_at = None
+        self._lock = asyncio.Lock()
+
+    def _is_stale(self) -> bool:
+        return self.checked_at is None or time.monotonic() - self.checked_at > self.ttl
+
+    async def current(self) -> str:
+        if self._is_stale():
+            async with self._lock:
+                if self._is_stale():
+                    try:
+                        self.value = str(await self.loader())
+                    except Exception as e:
+                        print(f" ⚠ Version des données illisible : {e}")
+                        if self.value is None:
+                            self.value = f"unknown-{time.time()}"
+                    self.checked_at = time.monotonic()
+        return self.value
+
+    def bump(self):
+        self.checked_at = None
+
+
+class SingleFlight:
+    """
+    Regroupe les appels concurrents identiques (même clé) sur un seul calcul en vol :
+    le premier lance `fn`, les suivants attendent et partagent son résultat (ou son exception).
+    """
+
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key: str, fn):
+        """Retourne (résultat, partagé) ; `partagé` vaut True si l'appel a rejoint un calcul en cours."""
+        task = self._calls.get(key)
+        shared = task is not None
+        if not shared:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            # Retiré à la fin du calcul (et pas à la fin de l'appelant, qui peut être annulé)
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        # shield : un client qui se déconnecte n'annule pas le calcul des autres
+        return await asyncio.shield(task), shared
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+
+def encoding_etag(etag: str, encoding: str = None) -> str:
+    """ETag d'une représentation : la version compressée (gzip) a le sien, distinct de l'identité."""
+    return f'{etag[:-1]}-{encoding}"' if encoding else etag
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
@@ -0,0 +1,147 @@
+import asyncio
+import os
+import re
+import time
+from datetime import datetime, timezone
+
+import asyncpg
+
+from backend.api.metrics import DB_QUERY_ROWS, DB_QUERY_SECONDS, QUERY_ENDPOINT
+
+# Placeholders nommés style psycopg2 : %(name)s
+_NAMED_PARAM = re.compile(r"%\((\w+)\)s")
+
+
+def to_naive_utc(value):
+    """Date avec fuseau -> UTC sans fuseau (colonnes `timestamp`) ; toute autre valeur est inchangée."""
+    if isinstance(value, datetime) and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def bind_params(query: str, params: dict = None):
+    """
+    Traduit une requête à placeholders nommés (%(name)s) en requête asyncpg ($1, $2...).
+    Les requêtes gardent ainsi la même écriture que côté pandas / psycopg2.
+    Les dates avec fuseau (?start=...Z) sont ramenées en UTC sans fuseau : asyncpg les refuse
+    sur une colonne `timestamp`.
+    """
+    params = params or {}
+    order = []
+
+    def replace(match):
+        name = match.group(1)
+        if name not in order:
+            order.append(name)
+        return f"${order.index(name) + 1}"
+
+    return _NAMED_PARAM.sub(replace, query), [to_naive_utc(params[name]) for name in order]
+
+
+class AsyncDatabase:
+    """
+    Accès PostgreSQL asynchrone (asyncpg) pour l'API : pool de connexions partagé,
+    timeout par requête. Le pool est ouvert à la première requête (la BDD peut dormir au démarrage).
+    Les diffusions (stream) n'ont droit qu'à `stream_max` connexions du pool à la fois (DB_STREAM_MAX)
+    et à `stream_deadline` secondes chacune (DB_STREAM_DEADLINE) : des clients lents ne privent
+    pas les autres endpoints de connexions.
+    """
+
+    def __init__(self, dsn: str, min_size: int = None, max_size: int = None, timeout: float = None,
+                 stream_max: int = None, stream_deadline: float = None):
+        self.dsn = dsn
+        self.min_size = min_size or int(os.getenv("DB_POOL_MIN", "1"))
+        self.max_size = max_size or int(os.getenv("DB_POOL_MAX", "10"))
+        self.timeout = timeout or float(os.getenv("DB_QUERY_TIMEOUT", "10"))
+        # Au moins une connexion reste toujours libre pour les requêtes ordinaires
+        stream_max = stream_max or int(os.getenv("DB_STREAM_MAX", "3"))
+        self.stream_max = max(1, min(stream_max, self.max_size - 1))
+        self.stream_deadline = stream_deadline or float(os.getenv("DB_STREAM_DEADLINE", "120"))
+        self._stream_slots = asyncio.Semaphore(self.stream_max)
+        self._pool = None
+        self._lock = asyncio.Lock()
+
+    async def pool(self):
+        if self._pool is None:
+            async with self._lock:
+                if self._pool is None:
+                    self._pool = await asyncpg.create_pool(
+                        self.dsn, min_size=self.min_size, max_size=self.max_size,
+                        command_timeout=self.timeout,
+                    )
+        return self._pool
+
+    async def fetch(self, query: str, params: dict = None, timeout: float = None):
+        """Retourne (colonnes, lignes) ; lève TimeoutError au-delà de `timeout` secondes."""
+        sql, args = bind_params(query, params)
+        pool = await self.pool()
+        start = time.perf_counter()
+        async with pool.acquire() as conn:
+            # Requête préparée (mise en cache par asyncpg) : on a les colonnes même sans ligne
+            stmt = await conn.prepare(sql, timeout=timeout or self.timeout)
+            records = await stmt.fetch(*args, timeout=timeout or self.timeout)
+            columns = [attr.name for attr in stmt.get_attributes()]
+        self._observe(time.perf_counter() - start, len(records))
+        return columns, [tuple(r) for r in records]
+
+    async def stream(self, query: str, params: dict = None, batch_size: int = 2000, timeout: float = None):
+        """
+        Itère le résultat par lots via un curseur côté serveur : (colonnes, lignes) à chaque lot.
+        Le lot suivant n'est lu qu'une fois le précédent consommé (backpressure jusqu'à la BDD).
+        La connexion et la transaction sont gardées pendant tout l'envoi : d'où la place de diffusion
+        (attendue au plus `timeout` secondes) et l'échéance `stream_deadline`, client lent compris.
+        Un client bloqué (lot suivant jamais demandé) voit sa connexion coupée à l'échéance.
+        """
+        sql, args = bind_params(query, params)
+        timeout = timeout or self.timeout
+        pool = await self.pool()
+        await asyncio.wait_for(self._stream_slots.acquire(), timeout)
+        try:
+            async with pool.acquire() as conn:
+                loop = asyncio.get_running_loop()
+                deadline = loop.time() + self.stream_deadline
+                watchdog = loop.call_later(self.stream_deadline, conn.terminate)
+                try:
+                    # Un curseur PostgreSQL n'existe que dans une transaction
+                    async with conn.transaction(readonly=True):
+                        stmt = await conn.prepare(sql, timeout=timeout)
+                        columns = [attr.name for attr in stmt.get_attributes()]
+                        cursor = await stmt.cursor(*args)
+                        # Seul le temps passé à attendre la BDD est mesuré (pas l'envoi au client)
+                        elapsed, total = 0.0, 0
+                        while True:
+                            remaining = deadline - loop.time()
+                            if remaining <= 0:
+                                raise TimeoutError(f"Diffusion interrompue après {self.stream_deadline:.0f} s")
+                            start = time.perf_counter()
+                            records = await cursor.fetch(batch_size, timeout=min(timeout, remaining))
+                            elapsed += time.perf_counter() - start
+                            if not records:
+                                break
+                            total += len(records)
+                            yield columns, [tuple(r) for r in records]
+                        self._observe(elapsed, total)
+                finally:
+                    watchdog.cancel()
+        finally:
+            self._stream_slots.release()
+
+    async def fetchrow(self, query: str, params: dict = None, timeout: float = None):
+        sql, args = bind_params(query, params)
+        pool = await self.pool()
+        start = time.perf_counter()
+        async with pool.acquire() as conn:
+            row = await conn.fetchrow(sql, *args, timeout=timeout or self.timeout)
+        self._observe(time.perf_counter() - start, int(row is not None))
+        return row
+
+    @staticmethod
+    def _observe(seconds: float, rows: int):
+        endpoint = QUERY_ENDPOINT.get()
+        DB_QUERY_SECONDS.labels(endpoint=endpoint).observe(seconds)
+        DB_QUERY_ROWS.labels(endpoint=endpoint).observe(rows)
+
+    async def close(self):
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
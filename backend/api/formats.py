@@ -0,0 +1,183 @@
+import io
+from dataclasses import dataclass
+from datetime import date
+from decimal import Decimal
+
+import orjson
+
+# Format -> type MIME. "json" (liste d'objets) reste le format par défaut.
+MEDIA_TYPES = {
+    "json": "application/json",
+    "columns": "application/vnd.velomag.columns+json",
+    "ndjson": "application/x-ndjson",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+ALIASES = {
+    "application/x-parquet": "parquet",
+    "application/vnd.apache.arrow.file": "arrow",
+}
+
+
+def negotiate(request) -> str:
+    """
+    Choisit le format de réponse : paramètre `?format=` prioritaire, sinon en-tête Accept
+    (dans l'ordre du client, poids q ignorés), sinon JSON.
+    """
+    fmt = request.query_params.get("format")
+    if fmt:
+        if fmt not in MEDIA_TYPES:
+            raise ValueError(f"Format inconnu : {fmt} (attendu : {', '.join(MEDIA_TYPES)})")
+        return fmt
+
+    for item in request.headers.get("accept", "").split(","):
+        media_type = item.split(";")[0].strip().lower()
+        for name, mt in MEDIA_TYPES.items():
+            if media_type == mt:
+                return name
+        if media_type in ALIASES:
+            return ALIASES[media_type]
+    return "json"
+
+
+@dataclass
+class Rows:
+    """Résultat brut du driver (noms de colonnes + tuples) : sérialisé sans passer par pandas."""
+    columns: list
+    rows: list
+
+    def __len__(self):
+        return len(self.rows)
+
+
+def _rows_to_columns(data: Rows, text_dates: bool) -> dict:
+    """Transpose les lignes en colonnes ; dates en texte (formats JSON) et Decimal en float."""
+    values = list(zip(*data.rows)) if data.rows else [()] * len(data.columns)
+    columns = {}
+    for name, col in zip(data.columns, values):
+        sample = next((v for v in col if v is not None), None)
+        if text_dates and isinstance(sample, date):
+            col = [None if v is None else str(v) for v in col]
+        elif isinstance(sample, Decimal):
+            col = [None if v is None else float(v) for v in col]
+        columns[name] = list(col)
+    return columns
+
+
+def encode_records(data: Rows) -> list:
+    """Lignes -> liste d'objets JSON (dates en texte, comme le format json)."""
+    columns = _rows_to_columns(data, text_dates=True)
+    names = list(columns)
+    return [dict(zip(names, row)) for row in zip(*columns.values())]
+
+
+def encode_chunk(data: Rows, fmt: str, first: bool) -> bytes:
+    """
+    Morceau d'une réponse diffusée en flux : lignes NDJSON,
+    ou éléments d'un tableau JSON (le client reçoit '[' ... ']' autour, cf. STREAM_BOUNDS).
+    """
+    records = encode_records(data)
+    if fmt == "ndjson":
+        return b"".join(orjson.dumps(r) + b"\n" for r in records)
+    chunk = b",".join(orjson.dumps(r) for r in records)
+    return chunk if first else b"," + chunk
+
+
+# Ouverture / fermeture d'une réponse en flux, selon le format
+STREAM_BOUNDS = {"ndjson": (b"", b""), "json": (b"[", b"]")}
+
+
+def _serialize_rows(data: Rows, fmt: str, group_by: str = None) -> bytes:
+    if fmt == "ndjson":
+        return encode_chunk(data, fmt, first=True)
+
+    if fmt not in ("json", "columns"):
+        import pyarrow as pa
+        return _write_arrow(pa.table(_rows_to_columns(data, text_dates=False)), fmt)
+
+    columns = _rows_to_columns(data, text_dates=True)
+
+    def encode(cols: dict):
+        if fmt == "columns":
+            return cols
+        names = list(cols)
+        return [dict(zip(names, row)) for row in zip(*cols.values())]
+
+    if not group_by:
+        return orjson.dumps(encode(columns))
+
+    # Regroupement en un passage (pas de groupby pandas)
+    keys = columns.pop(group_by)
+    positions = {}
+    for i, key in enumerate(keys):
+        positions.setdefault(str(key), []).append(i)
+    payload = {
+        key: encode({name: [col[i] for i in idx] for name, col in columns.items()})
+        for key, idx in sorted(positions.items())
+    }
+    return orjson.dumps(payload)
+
+
+def _datetimes_to_str(df):
+    """Les formats JSON transportent les dates en texte (comme avant : 'YYYY-MM-DD HH:MM:SS')."""
+    import pandas as pd
+
+    cols = [c for c in df.columns if pd.api.types.is_datetime64_any_dtype(df[c])]
+    if not cols:
+        return df
+    df = df.copy()
+    for col in cols:
+        df[col] = df[col].astype(str)
+    return df
+
+
+def _columns(df) -> dict:
+    # Une liste par colonne : pas de répétition des clés à chaque ligne
+    return {col: df[col].to_numpy() if df[col].dtype.kind in "biuf" else df[col].tolist() for col in df.columns}
+
+
+def serialize(df, fmt: str, group_by: str = None) -> bytes:
+    """
+    Sérialise `df` (DataFrame ou Rows) dans le format demandé.
+    Avec `group_by`, les formats JSON renvoient un objet {clé: série} ;
+    les formats binaires gardent une table longue (colonne de regroupement incluse).
+    pandas n'est importé que pour les DataFrame (les Rows du driver s'en passent).
+    """
+    if isinstance(df, Rows):
+        return _serialize_rows(df, fmt, group_by)
+
+    if fmt == "ndjson":
+        # Une ligne JSON par enregistrement (table longue, comme les formats binaires)
+        records = _datetimes_to_str(df).to_dict(orient="records")
+        return b"".join(orjson.dumps(r, option=orjson.OPT_SERIALIZE_NUMPY) + b"\n" for r in records)
+
+    if fmt in ("json", "columns"):
+        df = _datetimes_to_str(df)
+        encode = (lambda d: d.to_dict(orient="records")) if fmt == "json" else _columns
+        if group_by:
+            payload = {
+                str(key): encode(group.drop(columns=[group_by]))
+                for key, group in df.groupby(group_by, sort=True)
+            }
+        else:
+            payload = encode(df)
+        return orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY)
+
+    # Formats binaires : pyarrow n'est importé que si un client les demande
+    import pyarrow as pa
+    return _write_arrow(pa.Table.from_pandas(df, preserve_index=False), fmt)
+
+
+def _write_arrow(table, fmt: str) -> bytes:
+    import pyarrow as pa
+
+    buffer = io.BytesIO()
+    if fmt == "arrow":
+        with pa.ipc.new_stream(buffer, table.schema) as writer:
+            writer.write_table(table)
+    elif fmt == "parquet":
+        import pyarrow.parquet as pq
+        pq.write_table(table, buffer, compression="zstd")
+    else:
+        raise ValueError(f"Format inconnu : {fmt}")
+    return buffer.getvalue()
@@ -0,0 +1,41 @@
+from contextvars import ContextVar
+
+from prometheus_client import Histogram
+
+# Endpoint de la requête en cours (premier segment du chemin : /history, /map-data...),
+# lu par la couche d'accès BDD pour étiqueter ses mesures
+QUERY_ENDPOINT = ContextVar("query_endpoint", default="other")
+
+DB_QUERY_SECONDS = Histogram(
+    'velomag_db_query_seconds', "Durée des requêtes SQL de l'API", ['endpoint'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+DB_QUERY_ROWS = Histogram(
+    'velomag_db_query_rows', "Lignes retournées par requête SQL de l'API", ['endpoint'],
+    buckets=(0, 1, 10, 100, 1_000, 10_000, 50_000, 100_000, 500_000),
+)
+RESPONSE_BYTES = Histogram(
+    'velomag_response_bytes', 'Taille des réponses (avant compression)', ['endpoint', 'format'],
+    buckets=(256, 1024, 4096, 16_384, 65_536, 262_144, 1_048_576, 4_194_304, 16_777_216),
+)
+
+
+def endpoint_label(path: str) -> str:
+    segment = path.strip("/").split("/", 1)[0]
+    return f"/{segment}"
+
+
+class EndpointLabelMiddleware:
+    """Middleware ASGI : renseigne QUERY_ENDPOINT pour toute la durée de la requête (flux compris)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        token = QUERY_ENDPOINT.set(endpoint_label(scope["path"]))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            QUERY_ENDPOINT.reset(token)
@@ -0,0 +1,204 @@
+import asyncio
+import time
+from collections import ChainMap
+from datetime import timedelta
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from backend.modeling.features import encode_counters
+from backend.modeling.predict_next_day import (
+    Predictor, LAG_HOURS, calendar_feature_arrays, lag_feature_arrays, model_counter_encoding,
+)
+
+WEATHER_COLS = ['temperature_2m', 'wind_speed_10m', 'precipitation']
+
+
+class MicroBatcher:
+    """
+    Regroupe les requêtes concurrentes en micro-lots :
+    un seul appel `inplace_predict` pour toutes les matrices arrivées pendant la fenêtre d'attente.
+    """
+
+    def __init__(self, booster, max_wait_ms: float = 2.0, max_batch_rows: int = 8192):
+        self.booster = booster
+        self.max_wait = max_wait_ms / 1000
+        self.max_batch_rows = max_batch_rows
+        self._queue = None
+        self._worker = None
+
+    async def predict(self, X: np.ndarray) -> np.ndarray:
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._run())
+
+        future = loop.create_future()
+        await self._queue.put((X, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            rows = len(batch[0][0])
+
+            # On attend (très peu) les autres requêtes pour remplir le lot
+            deadline = loop.time() + self.max_wait
+            while rows < self.max_batch_rows:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(item)
+                rows += len(item[0])
+
+            try:
+                X_all = np.vstack([X for X, _ in batch])
+                preds = await loop.run_in_executor(None, self.booster.inplace_predict, X_all)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done(): future.set_exception(e)
+                continue
+
+            offset = 0
+            for X, future in batch:
+                if not future.done():
+                    future.set_result(preds[offset:offset + len(X)])
+                offset += len(X)
+
+
+class HistoryWindow:
+    """
+    Fenêtre glissante des comptages récents (réel, sinon prédiction) gardée en mémoire
+    pour calculer les lags sans requêter la BDD à chaque prédiction.
+    `known_ids` : encodage des compteurs sauvegardé avec le modèle (None pour un ancien modèle).
+    """
+
+    def __init__(self, db, known_ids: dict = None, ttl_seconds: int = 900):
+        self.db = db
+        self.known_ids = known_ids
+        self.ttl = ttl_seconds
+        self.days = max(LAG_HOURS) // 24 + 1
+        self.memory = {}
+        self.encoded_ids = {}
+        self.loaded_at = None
+        self._lock = asyncio.Lock()
+
+    def _load(self):
+        query_real = f"""
+            SELECT counter_id, datetime, intensity AS count
+            FROM velo_clean
+            WHERE datetime >= CURRENT_DATE - INTERVAL '{self.days} day'
+        """
+        query_pred = f"""
+            SELECT counter_id, datetime, predicted_values AS count
+            FROM model_data
+            WHERE datetime >= CURRENT_DATE - INTERVAL '{self.days} day'
+        """
+        with self.db.engine.connect() as conn:
+            df_real = pd.read_sql(query_real, conn)
+            df_pred = pd.read_sql(query_pred, conn)
+            if self.known_ids is None:
+                # Ancien modèle, sans encodage sauvegardé : tous les compteurs, triés côté Python
+                # (l'ordre de cat.codes, pas la collation PostgreSQL)
+                counters = pd.read_sql("SELECT DISTINCT counter_id FROM velo_clean", conn)['counter_id']
+            else:
+                counters = {*self.known_ids, *df_real['counter_id'], *df_pred['counter_id']}
+
+        memory = {}
+        # Les prédictions comblent les trous, le réel est prioritaire
+        for df in (df_pred, df_real):
+            keys = zip(df['counter_id'], pd.to_datetime(df['datetime']))
+            memory.update(zip(keys, df['count'].astype(float)))
+
+        self.memory = memory
+        # Mêmes codes qu'à l'entraînement ; un compteur apparu depuis reçoit un code à part
+        self.encoded_ids = encode_counters(counters, self.known_ids)
+        self.loaded_at = time.monotonic()
+
+    def is_stale(self) -> bool:
+        return self.loaded_at is None or time.monotonic() - self.loaded_at > self.ttl
+
+    async def get(self):
+        if self.is_stale():
+            async with self._lock:
+                if self.is_stale():
+                    await asyncio.to_thread(self._load)
+        return self.memory, self.encoded_ids
+
+    def invalidate(self):
+        self.loaded_at = None
+
+
+class OnlinePredictor:
+    """Prédiction à la demande (what-if) avec le booster XGBoost gardé en mémoire."""
+
+    def __init__(self, db, model_path=None, weather_ttl_seconds: int = 3600):
+        self.predictor = Predictor()
+        model = joblib.load(model_path or self.predictor.model_path)
+        self.booster = model.get_booster()
+        self.model_cols = self.booster.feature_names
+        self.batcher = MicroBatcher(self.booster)
+        self.window = HistoryWindow(db, model_counter_encoding(model))
+        self.weather_ttl = weather_ttl_seconds
+        self._weather_cache = {}
+
+    async def _get_weather(self, day: pd.Timestamp, override: dict) -> pd.DataFrame:
+        if all(override.get(c) is not None for c in WEATHER_COLS):
+            # Scénario entièrement fourni : pas besoin d'appeler Open-Meteo
+            dates = pd.date_range(start=day, periods=24, freq='h')
+            return pd.DataFrame({'ds': dates, **{c: override[c] for c in WEATHER_COLS}})
+
+        cached = self._weather_cache.get(day)
+        if cached is None or time.monotonic() - cached[0] > self.weather_ttl:
+            df = await asyncio.to_thread(self.predictor.get_weather_data, day.to_pydatetime())
+            cached = (time.monotonic(), df)
+            if len(self._weather_cache) > 64: self._weather_cache.clear()
+            self._weather_cache[day] = cached
+
+        df_weather = cached[1][['ds'] + WEATHER_COLS].copy()
+        for col, value in override.items():
+            if value is not None: df_weather[col] = value
+        return df_weather
+
+    async def predict(self, counter_id: str, start: pd.Timestamp, end: pd.Timestamp, weather: dict) -> pd.DataFrame:
+        memory, encoded_ids = await self.window.get()
+        if counter_id not in encoded_ids:
+            raise KeyError(counter_id)
+
+        # Les prédictions de la requête servent de lags aux jours suivants (sans toucher au cache)
+        local = {}
+        lookup = ChainMap(local, memory)
+        results = []
+
+        day = start.normalize()
+        while day <= end:
+            df_weather = await self._get_weather(day, weather)
+            ds = pd.DatetimeIndex(df_weather['ds'])
+            counter_ids = [counter_id] * len(ds)
+
+            # Matrice construite directement en numpy (pas de DataFrame intermédiaire)
+            cols = {
+                'counter_id_encoded': np.full(len(ds), encoded_ids[counter_id]),
+                **{c: df_weather[c].to_numpy() for c in WEATHER_COLS},
+                **lag_feature_arrays(counter_ids, ds, lookup),
+                **calendar_feature_arrays(ds),
+            }
+            zeros = np.zeros(len(ds))
+            X = np.column_stack([np.asarray(cols.get(c, zeros), dtype=np.float32) for c in self.model_cols])
+
+            preds = await self.batcher.predict(X)
+            counts = np.clip(preds, 0, None).astype(int)
+            local.update(zip(zip(counter_ids, ds), counts))
+
+            df_day = pd.DataFrame({'ds': ds, 'count': counts})
+            results.append(df_day)
+            day += timedelta(days=1)
+
+        df = pd.concat(results, ignore_index=True)
+        return df[(df['ds'] >= start) & (df['ds'] <= end)].rename(columns={'ds': 'datetime'})
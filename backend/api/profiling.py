@@ -0,0 +1,83 @@
+import cProfile
+import os
+import time
+from datetime import datetime
+from pathlib import Path
+
+from backend.api.metrics import endpoint_label
+
+
+class ProfilingMiddleware:
+    """
+    Middleware ASGI de profilage (activé par API_PROFILE_DIR) : profile les requêtes et garde
+    celles plus lentes que API_PROFILE_SLOW_MS, ou portant l'en-tête X-Profile: 1
+    (protégé par API_PROFILE_TOKEN s'il est défini : l'en-tête doit alors valoir ce jeton).
+
+    Moteur : pyinstrument (rapport HTML, attribution correcte des coroutines) si API_PROFILE_ENGINE=pyinstrument
+    et installé, sinon cProfile (.prof). Un seul profileur peut être actif à la fois : les requêtes qui arrivent
+    pendant qu'une autre est profilée passent sans profil (échantillonnage, pas de file d'attente).
+    cProfile voit tout ce qui tourne sur la boucle pendant la requête (y compris d'autres requêtes).
+    """
+
+    def __init__(self, app, directory: str = None, slow_ms: float = None, engine: str = None, token: str = None):
+        self.app = app
+        self.directory = Path(directory or os.getenv("API_PROFILE_DIR", ".cache/profiles/api"))
+        self.slow_ms = slow_ms if slow_ms is not None else float(os.getenv("API_PROFILE_SLOW_MS", "500"))
+        self.engine = engine or os.getenv("API_PROFILE_ENGINE", "cprofile")
+        self.token = token if token is not None else os.getenv("API_PROFILE_TOKEN")
+        self._busy = False
+        if self.engine == "pyinstrument":
+            try:
+                import pyinstrument  # noqa: F401
+            except ImportError:
+                print(" ⚠ pyinstrument non installé : profilage avec cProfile")
+                self.engine = "cprofile"
+
+    def _forced(self, scope) -> bool:
+        value = dict(scope["headers"]).get(b"x-profile")
+        if value is None:
+            return False
+        return value.decode() == self.token if self.token else value == b"1"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self._busy:
+            return await self.app(scope, receive, send)
+
+        forced = self._forced(scope)
+        self._busy = True
+        profiler = self._start()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self._busy = False
+            self._stop(profiler)
+            if forced or elapsed_ms >= self.slow_ms:
+                self._write(profiler, scope["path"], elapsed_ms)
+
+    def _start(self):
+        if self.engine == "pyinstrument":
+            from pyinstrument import Profiler
+            profiler = Profiler(async_mode="enabled")
+            profiler.start()
+            return profiler
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+    def _stop(self, profiler):
+        if self.engine == "pyinstrument":
+            profiler.stop()
+        else:
+            profiler.disable()
+
+    def _write(self, profiler, path: str, elapsed_ms: float):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        name = endpoint_label(path).strip("/") or "root"
+        prefix = self.directory / f"{datetime.now():%Y%m%d_%H%M%S_%f}_{name}_{elapsed_ms:.0f}ms"
+        if self.engine == "pyinstrument":
+            Path(f"{prefix}.html").write_text(profiler.output_html())
+        else:
+            profiler.dump_stats(f"{prefix}.prof")
+        print(f" Profil {path} ({elapsed_ms:.0f} ms) : {prefix}")
@@ -0,0 +1,273 @@
+import asyncio
+import random
+import threading
+import time
+import zlib
+from collections import Counter
+
+import pandas as pd
+import typer
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import JSONResponse
+
+from backend.benchmarks.synthetic import BASE_COUNTERS, synthetic_counters, synthetic_meteo, synthetic_velo_raw
+
+app = typer.Typer(help="Faux portail Montpellier 3M + Open-Meteo en local (latence, 429, erreurs, taille des réponses)")
+
+METEO_VARIABLES = ["temperature_2m", "wind_speed_10m", "precipitation"]
+METEO_UNITS = {"time": "iso8601", "temperature_2m": "°C", "wind_speed_10m": "km/h", "precipitation": "mm"}
+
+
+class Chaos:
+    """
+    Défaillances simulées, tirées d'un générateur initialisé (même séquence à chaque lancement) :
+    latence (+ gigue), limitation de débit (jeton par requête, 429 + Retry-After), taux d'erreurs 5xx,
+    et remplissage des réponses (`padding_kb`) pour grossir les charges utiles.
+    """
+
+    ERROR_STATUSES = [500, 502, 503, 504]
+
+    def __init__(self, latency_ms: float = 0, jitter_ms: float = 0, error_rate: float = 0,
+                 rate_limit: float = 0, retry_after: int = 1, padding_kb: int = 0, seed: int = 0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.padding = "x" * (padding_kb * 1024)
+        self.random = random.Random(seed)
+        self.stats = Counter()
+        # Seau à jetons : `rate_limit` requêtes par seconde, rafale d'une seconde
+        self._tokens = rate_limit
+        self._refilled = time.monotonic()
+        self._lock = threading.Lock()
+
+    def throttled(self) -> bool:
+        if not self.rate_limit:
+            return False
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.rate_limit, self._tokens + (now - self._refilled) * self.rate_limit)
+            self._refilled = now
+            if self._tokens < 1:
+                return True
+            self._tokens -= 1
+            return False
+
+    def draw(self):
+        """(délai en secondes, code d'erreur ou None) pour la requête suivante."""
+        with self._lock:
+            delay = max(0.0, self.latency_ms + self.random.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+            error = self.random.choice(self.ERROR_STATUSES) if self.random.random() < self.error_rate else None
+        return delay, error
+
+    def config(self) -> dict:
+        return {
+            "latency_ms": self.latency_ms, "jitter_ms": self.jitter_ms, "error_rate": self.error_rate,
+            "rate_limit": self.rate_limit, "retry_after": self.retry_after, "padding_kb": len(self.padding) // 1024,
+        }
+
+
+def _seed(*parts) -> int:
+    """Graine stable (indépendante de PYTHONHASHSEED) : même requête -> mêmes données."""
+    return zlib.crc32("|".join(map(str, parts)).encode())
+
+
+def create_app(counters: int = BASE_COUNTERS, chaos: Chaos = None, seed: int = 0) -> FastAPI:
+    """
+    Application FastAPI servant les mêmes routes (et formes de réponse) que les API réelles :
+    - portail : /ecocounter/ (liste), /ecocounter/{id} (description), /ecocounter_timeseries/{id}/attrs/intensity
+    - Open-Meteo : /v1/era5 (archive) et /v1/forecast
+    Les routes /_stats et /_reset (statistiques du serveur) ne subissent pas le chaos.
+    """
+    chaos = chaos or Chaos()
+    fake = FastAPI(title="Faux portail / Open-Meteo")
+    fake.state.chaos = chaos
+    df_counters = synthetic_counters(counters, seed).set_index("counter_id")
+
+    @fake.middleware("http")
+    async def inject_chaos(request: Request, call_next):
+        if request.url.path.startswith("/_"):
+            return await call_next(request)
+        chaos.stats["requests"] += 1
+        if chaos.throttled():
+            chaos.stats["429"] += 1
+            return JSONResponse({"error": "Too Many Requests"}, status_code=429,
+                                headers={"Retry-After": str(chaos.retry_after)})
+        delay, error = chaos.draw()
+        if delay:
+            await asyncio.sleep(delay)
+        if error:
+            chaos.stats[str(error)] += 1
+            return JSONResponse({"error": "Simulated failure"}, status_code=error)
+        response = await call_next(request)
+        chaos.stats[str(response.status_code)] += 1
+        return response
+
+    def padded(payload: dict) -> dict:
+        if chaos.padding:
+            payload["padding"] = chaos.padding
+        return payload
+
+    # --- Portail Montpellier 3M ---
+    @fake.get("/ecocounter/")
+    def list_counters():
+        return [padded({"id": counter_id, "type": "EcoCounter"}) for counter_id in df_counters.index]
+
+    @fake.get("/ecocounter/{counter_id}")
+    def describe_counter(counter_id: str):
+        if counter_id not in df_counters.index:
+            raise HTTPException(404, "Unknown entity")
+        row = df_counters.loc[counter_id]
+        return padded({
+            "id": counter_id, "type": "EcoCounter",
+            # Ordre [lat, lon] : celui que lit FetchAPI.fetch_counter_description
+            "location": {"type": "GeoProperty", "value": {"type": "Point", "coordinates": [row["lat"], row["lon"]]}},
+            "laneId": {"type": "Property", "value": int(row["laneId"])},
+            "vehicleType": {"type": "Property", "value": row["vehicleType"]},
+        })
+
+    @fake.get("/ecocounter_timeseries/{counter_id}/attrs/intensity")
+    def counter_timeseries(counter_id: str, from_date: str = Query(..., alias="fromDate"),
+                           to_date: str = Query(..., alias="toDate")):
+        if counter_id not in df_counters.index:
+            raise HTTPException(404, "Unknown entity")
+        start, end = pd.Timestamp(from_date).tz_localize(None), pd.Timestamp(to_date).tz_localize(None)
+        days = max(1, (end.normalize() - start.normalize()).days + 1)
+        meteo = synthetic_meteo(start.normalize(), days, _seed(seed, from_date))
+        meteo = meteo[(meteo["datetime"] >= start) & (meteo["datetime"] <= end)]
+        counter = df_counters.loc[[counter_id]].reset_index()
+        series = synthetic_velo_raw(counter, meteo, _seed(seed, counter_id, from_date), duplicate_rate=0)
+        return padded({
+            "entityId": counter_id,
+            "attrName": "intensity",
+            "index": series["datetime"].map(pd.Timestamp.isoformat).tolist(),
+            "values": series["intensity"].tolist(),
+        })
+
+    # --- Open-Meteo ---
+    def meteo_payload(start_date: str, end_date: str, hourly: str) -> dict:
+        start, end = pd.Timestamp(start_date), pd.Timestamp(end_date)
+        meteo = synthetic_meteo(start, (end - start).days + 1, _seed(seed, start_date))
+        variables = [v for v in hourly.split(",") if v in METEO_VARIABLES]
+        return padded({
+            "latitude": 43.61, "longitude": 3.88, "timezone": "GMT",
+            "hourly_units": {v: METEO_UNITS[v] for v in ["time", *variables]},
+            "hourly": {
+                "time": meteo["datetime"].dt.strftime("%Y-%m-%dT%H:%M").tolist(),
+                **{v: meteo[v].round(1).tolist() for v in variables},
+            },
+        })
+
+    @fake.get("/v1/era5")
+    def meteo_archive(start_date: str, end_date: str, hourly: str = ",".join(METEO_VARIABLES)):
+        return meteo_payload(start_date, end_date, hourly)
+
+    @fake.get("/v1/forecast")
+    def meteo_forecast(start_date: str, end_date: str, hourly: str = ",".join(METEO_VARIABLES)):
+        return meteo_payload(start_date, end_date, hourly)
+
+    # --- Statistiques du serveur ---
+    @fake.get("/_stats")
+    def stats():
+        return {"config": chaos.config(), "counters": len(df_counters), "stats": dict(chaos.stats)}
+
+    @fake.post("/_reset")
+    def reset():
+        chaos.stats.clear()
+        return {"status": "ok"}
+
+    return fake
+
+
+def upstream_env(base_url: str) -> dict:
+    """Variables d'environnement qui redirigent les fetchers vers le faux serveur."""
+    return {
+        "PORTAL_URL": base_url,
+        "OPEN_API_URL": f"{base_url}/ecocounter/",
+        "METEO_ARCHIVE_URL": f"{base_url}/v1/era5",
+        "METEO_FORECAST_URL": f"{base_url}/v1/forecast",
+    }
+
+
+def start_server(fake: FastAPI, port: int):
+    """Lance le faux serveur (uvicorn) dans un thread ; renvoie le serveur (should_exit=True pour l'arrêter)."""
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(fake, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return server
+
+
+@app.command()
+def serve(
+    port: int = typer.Option(8099),
+    counters: int = typer.Option(BASE_COUNTERS, help="Nombre de compteurs servis"),
+    latency_ms: float = typer.Option(0, help="Latence ajoutée à chaque réponse"),
+    jitter_ms: float = typer.Option(0, help="Gigue (+/-) autour de la latence"),
+    error_rate: float = typer.Option(0, help="Part des requêtes en erreur 5xx"),
+    rate_limit: float = typer.Option(0, help="Requêtes par seconde avant 429 (0 = illimité)"),
+    retry_after: int = typer.Option(1, help="En-tête Retry-After des 429 (secondes)"),
+    padding_kb: int = typer.Option(0, help="Ko ajoutés à chaque réponse"),
+    seed: int = typer.Option(0),
+):
+    """Lance le faux serveur ; les variables affichées redirigent les jobs d'ingestion / prédiction vers lui."""
+    import uvicorn
+
+    chaos = Chaos(latency_ms, jitter_ms, error_rate, rate_limit, retry_after, padding_kb, seed)
+    for name, value in upstream_env(f"http://127.0.0.1:{port}").items():
+        print(f"export {name}={value}")
+    uvicorn.run(create_app(counters, chaos, seed), host="127.0.0.1", port=port, log_level="warning")
+
+
+@app.command()
+def ingest(
+    port: int = typer.Option(8099),
+    counters: int = typer.Option(BASE_COUNTERS, help="Nombre de compteurs servis"),
+    days: int = typer.Option(7, help="Jours d'historique demandés par compteur"),
+    workers: int = typer.Option(1, help="Compteurs récupérés en parallèle (FETCH_WORKERS)"),
+    latency_ms: float = typer.Option(50),
+    jitter_ms: float = typer.Option(20),
+    error_rate: float = typer.Option(0),
+    rate_limit: float = typer.Option(0),
+    retry_after: int = typer.Option(1),
+    padding_kb: int = typer.Option(0),
+    seed: int = typer.Option(0),
+):
+    """Mesure l'ingestion (vélo + météo) contre le faux serveur : débit, tentatives, erreurs."""
+    import os
+    from prometheus_client import REGISTRY
+    from backend.data.fetch_data import FetchAPI
+
+    chaos = Chaos(latency_ms, jitter_ms, error_rate, rate_limit, retry_after, padding_kb, seed)
+    server = start_server(create_app(counters, chaos, seed), port)
+    base_url = f"http://127.0.0.1:{port}"
+    os.environ["FETCH_WORKERS"] = str(workers)
+    try:
+        fetch = FetchAPI(f"{base_url}/ecocounter/", portal_url=base_url, meteo_url=f"{base_url}/v1/era5")
+        end = pd.Timestamp.today().normalize()
+        start = end - pd.Timedelta(days=days)
+
+        t = time.perf_counter()
+        df_velo = fetch.fetch_all_data_velo(start.strftime("%Y-%m-%dT%H:%M:%S"), end.strftime("%Y-%m-%dT23:59:59"))
+        velo_seconds = time.perf_counter() - t
+        t = time.perf_counter()
+        df_meteo = fetch.fetch_meteo(start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d"), "43.6119", "3.8772")
+        meteo_seconds = time.perf_counter() - t
+    finally:
+        server.should_exit = True
+
+    retries = {
+        kind: REGISTRY.get_sample_value("velomag_fetch_retries_total", {"kind": kind}) or 0
+        for kind in ["counters", "timeseries", "description", "meteo"]
+    }
+    print(f"\n Vélo  : {len(df_velo)} lignes en {velo_seconds:.2f} s ({len(df_velo) / velo_seconds:,.0f} lignes/s, {workers} worker(s))")
+    print(f" Météo : {len(df_meteo)} lignes en {meteo_seconds:.2f} s")
+    print(f" Serveur : {dict(chaos.stats)}")
+    print(f" Nouvelles tentatives (client) : {retries}")
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,328 @@
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import typer
+
+from backend.benchmarks.startup import _free_port
+from backend.benchmarks.suite import ARROW_MEDIA_TYPE, _git_revision, seeded_database
+from backend.benchmarks.synthetic import synthetic_dataset, synthetic_meteo, synthetic_predictions
+
+app = typer.Typer(help="Test de charge de l'API : profils d'utilisateurs, débit, p50/p95/p99, SLO")
+
+RESULTS_DIR = Path(".cache/benchmarks/loadtest")
+
+# Seuils par défaut (ms) : percentile -> latence maximale, par endpoint
+DEFAULT_SLOS = {
+    "/map-data": ("p99", 1000),
+    "/map-data?since": ("p99", 300),
+    "/map-summary": ("p99", 300),
+    "/history/{id}": ("p99", 500),
+    "/prediction/{id}": ("p99", 300),
+}
+
+# Poids par défaut des parcours (un parcours = une action d'un utilisateur du tableau de bord)
+DEFAULT_MIX = {"map": 2, "counter": 6, "sync": 1, "metrics": 1}
+
+
+class Recorder:
+    """Latences et statuts par endpoint (en mémoire : quelques centaines de milliers de points au plus)."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.bytes = defaultdict(int)
+
+    async def get(self, client, label: str, path: str, headers: dict = None):
+        start = time.perf_counter()
+        try:
+            response = await client.get(path, headers=headers)
+        except Exception:
+            self.latencies[label].append(time.perf_counter() - start)
+            self.errors[label] += 1
+            return None
+        self.latencies[label].append(time.perf_counter() - start)
+        self.bytes[label] += len(response.content)
+        if response.status_code >= 400:
+            self.errors[label] += 1
+        return response
+
+
+class Scenarios:
+    """
+    Parcours d'un utilisateur du tableau de bord (mêmes appels que frontend/data_client.py) :
+    - map : chargement de l'onglet carte (snapshot complet en Arrow) puis changement de date (résumé du jour)
+    - counter : changement de compteur (historique 8 jours + prédictions, en parallèle) ; popularité en loi de Zipf
+    - sync : synchro incrémentale de la carte (/version puis /map-data?since=révision)
+    - metrics : scrape Prometheus (/metrics)
+    """
+
+    def __init__(self, counter_ids: list, dates: list):
+        self.counter_ids = counter_ids
+        self.dates = dates or [None]
+        ranks = np.arange(1, len(counter_ids) + 1)
+        self.popularity = list(1 / ranks)
+
+    async def map(self, client, recorder: Recorder, rng: random.Random, state: dict):
+        response = await recorder.get(client, "/map-data", "/map-data", {"Accept": ARROW_MEDIA_TYPE})
+        if response is not None and response.headers.get("X-Map-Revision"):
+            state["revision"] = response.headers["X-Map-Revision"]
+        day = rng.choice(self.dates)
+        await recorder.get(client, "/map-summary", f"/map-summary?date={day}" if day else "/map-summary")
+
+    async def counter(self, client, recorder: Recorder, rng: random.Random, state: dict):
+        counter_id = rng.choices(self.counter_ids, self.popularity)[0]
+        await asyncio.gather(
+            recorder.get(client, "/history/{id}", f"/history/{counter_id}?days=8"),
+            recorder.get(client, "/prediction/{id}", f"/prediction/{counter_id}"),
+        )
+
+    async def sync(self, client, recorder: Recorder, rng: random.Random, state: dict):
+        await recorder.get(client, "/version", "/version")
+        if "revision" not in state:
+            return await self.map(client, recorder, rng, state)
+        await recorder.get(client, "/map-data?since", f"/map-data?since={state['revision']}")
+
+    async def metrics(self, client, recorder: Recorder, rng: random.Random, state: dict):
+        await recorder.get(client, "/metrics", "/metrics")
+
+
+async def _user(client, scenarios: Scenarios, mix: dict, recorder: Recorder, stop_at: float, think_ms: float, seed: int):
+    rng = random.Random(seed)
+    names, weights = list(mix), list(mix.values())
+    state = {}
+    while time.monotonic() < stop_at:
+        await getattr(scenarios, rng.choices(names, weights)[0])(client, recorder, rng, state)
+        if think_ms:
+            await asyncio.sleep(rng.expovariate(1000 / think_ms))
+
+
+async def _discover(client) -> tuple:
+    """Compteurs et journées disponibles (appels de préparation, non mesurés)."""
+    counters = (await client.get("/counters")).json().get("counters", [])
+    summary = (await client.get("/map-summary")).json()
+    return counters, summary.get("dates", [])
+
+
+async def run_step(base_url: str, users: int, duration: float, mix: dict, think_ms: float, seed: int) -> dict:
+    """`users` utilisateurs simultanés pendant `duration` secondes ; statistiques par endpoint."""
+    import httpx
+
+    limits = httpx.Limits(max_connections=users * 2, max_keepalive_connections=users * 2)
+    async with httpx.AsyncClient(base_url=base_url, timeout=30, limits=limits) as client:
+        counters, dates = await _discover(client)
+        if not counters:
+            raise RuntimeError("Aucun compteur : la base est-elle remplie ?")
+        scenarios = Scenarios(counters, dates)
+        recorder = Recorder()
+        start = time.monotonic()
+        await asyncio.gather(*[
+            _user(client, scenarios, mix, recorder, start + duration, think_ms, seed * 1000 + i)
+            for i in range(users)
+        ])
+        elapsed = time.monotonic() - start
+
+    endpoints = {}
+    for label, values in sorted(recorder.latencies.items()):
+        ms = np.array(values) * 1000
+        endpoints[label] = {
+            "count": len(values),
+            "errors": recorder.errors[label],
+            "rps": round(len(values) / elapsed, 1),
+            "p50_ms": round(float(np.percentile(ms, 50)), 1),
+            "p95_ms": round(float(np.percentile(ms, 95)), 1),
+            "p99_ms": round(float(np.percentile(ms, 99)), 1),
+            "max_ms": round(float(ms.max()), 1),
+            "kb_per_request": round(recorder.bytes[label] / len(values) / 1024, 1),
+        }
+    total = sum(e["count"] for e in endpoints.values())
+    return {
+        "users": users, "duration_s": round(elapsed, 1), "requests": total,
+        "throughput_rps": round(total / elapsed, 1), "endpoints": endpoints,
+    }
+
+
+def check_slos(step: dict, slos: dict, max_error_rate: float) -> dict:
+    """Verdict par endpoint : percentile sous le seuil et taux d'erreurs sous `max_error_rate`."""
+    verdicts = {}
+    for label, stats in step["endpoints"].items():
+        percentile, limit = slos.get(label, (None, None))
+        latency_ok = percentile is None or stats[f"{percentile}_ms"] <= limit
+        error_ok = stats["errors"] / stats["count"] <= max_error_rate
+        verdicts[label] = {
+            "target": f"{percentile} <= {limit} ms" if percentile else None,
+            "ok": latency_ok and error_ok,
+        }
+    return verdicts
+
+
+def _parse_pairs(values: list, cast) -> dict:
+    pairs = {}
+    for value in values:
+        key, _, raw = value.partition("=")
+        pairs[key] = cast(raw)
+    return pairs
+
+
+def _parse_slo(value: str):
+    """"/history/{id}:p95=400" -> ("/history/{id}", ("p95", 400.0))"""
+    label, _, target = value.rpartition(":")
+    percentile, _, limit = target.partition("=")
+    return label, (percentile, float(limit))
+
+
+def start_api(env: dict, workers: int = 1, timeout: float = 60):
+    """Lance l'API (uvicorn, processus séparé) avec ces variables d'environnement ; attend /ready."""
+    import requests
+
+    port = _free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "backend.api.api:app", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        env={**os.environ, **env}, stdout=subprocess.DEVNULL,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f"{base_url}/ready", timeout=5).status_code == 200:
+                return server, base_url
+        except requests.exceptions.ConnectionError:
+            pass
+        time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError("L'API n'a pas répondu à /ready")
+
+
+def print_step(step: dict, verdicts: dict):
+    print(f"\n {step['users']} utilisateurs : {step['requests']} requêtes, {step['throughput_rps']} req/s")
+    print(f"   {'endpoint':<20} {'req/s':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'erreurs':>8}  SLO")
+    for label, stats in step["endpoints"].items():
+        verdict = verdicts[label]
+        flag = "ok" if verdict["ok"] else "⚠ KO"
+        print(f"   {label:<20} {stats['rps']:>7} {stats['p50_ms']:>8} {stats['p95_ms']:>8} {stats['p99_ms']:>8}"
+              f" {stats['errors']:>8}  {flag} {verdict['target'] or ''}")
+
+
+@app.command()
+def run(
+    users: list[int] = typer.Option([5, 20, 50], "--users", help="Paliers d'utilisateurs simultanés (répétable)"),
+    duration: float = typer.Option(20, help="Durée de chaque palier (s)"),
+    think_ms: float = typer.Option(500, help="Temps de réflexion moyen entre deux actions d'un utilisateur"),
+    mix: list[str] = typer.Option([], "--mix", help="Poids d'un parcours, ex. counter=6 (map, counter, sync, metrics)"),
+    slo: list[str] = typer.Option([], "--slo", help="Seuil, ex. /history/{id}:p95=400 (ms)"),
+    max_error_rate: float = typer.Option(0.01, help="Taux d'erreurs maximal par endpoint"),
+    url: str = typer.Option(None, help="API déjà lancée (sinon : lancée ici sur --db-url)"),
+    db_url: str = typer.Option(None, help="Base PostgreSQL vide, remplie de données synthétiques (défaut : BENCHMARK_DATABASE_URL)"),
+    scale: int = typer.Option(1, help="Taille des données synthétiques (multiple du réseau)"),
+    days: int = typer.Option(21, help="Jours d'historique synthétique"),
+    env: list[str] = typer.Option([], "--env", help="Variable de l'API pour ce mode, ex. DB_POOL_MAX=4 (répétable)"),
+    workers: int = typer.Option(1, help="Processus uvicorn"),
+    label: str = typer.Option("default", help="Nom du mode testé (pool, cache...), repris dans les résultats"),
+    seed: int = typer.Option(0),
+    output: Path = typer.Option(None, help="Fichier de résultats (défaut : .cache/benchmarks/loadtest/<mode>_<date>.json)"),
+):
+    """Paliers de charge croissants ; débit et latences par endpoint, verdict SLO par palier."""
+    weights = {**DEFAULT_MIX, **_parse_pairs(mix, float)}
+    unknown = set(weights) - set(DEFAULT_MIX)
+    if unknown:
+        raise typer.BadParameter(f"Parcours inconnus : {', '.join(sorted(unknown))}")
+    slos = {**DEFAULT_SLOS, **dict(map(_parse_slo, slo))}
+    overrides = _parse_pairs(env, str)
+
+    def load(base_url: str) -> list:
+        steps = []
+        for level in users:
+            step = asyncio.run(run_step(base_url, level, duration, weights, think_ms, seed))
+            step["slo"] = check_slos(step, slos, max_error_rate)
+            step["slo_ok"] = all(v["ok"] for v in step["slo"].values())
+            print_step(step, step["slo"])
+            steps.append(step)
+        return steps
+
+    if url:
+        steps = load(url)
+    else:
+        from backend.data.schemas import Database
+
+        db_url = db_url or os.getenv("BENCHMARK_DATABASE_URL")
+        if not db_url:
+            raise typer.BadParameter("--url (API lancée) ou --db-url (base PostgreSQL dédiée) requis")
+        db = Database(db_url)
+        data = synthetic_dataset(scale, days=days)
+        today = pd.Timestamp.today().normalize()
+        predictions = synthetic_predictions(data["counters"], synthetic_meteo(today, 2))
+        with seeded_database(db, data, predictions) as seeded:
+            if not seeded:
+                raise typer.Exit(1)
+            server, base_url = start_api(
+                {"BENCHMARK_DATABASE_URL": db.engine.url.render_as_string(hide_password=False), **overrides}, workers
+            )
+            try:
+                steps = load(base_url)
+            finally:
+                server.terminate()
+                server.wait()
+
+    passing = [s["users"] for s in steps if s["slo_ok"]]
+    report = {
+        "meta": {
+            "label": label, "date": datetime.now().isoformat(timespec="seconds"), "commit": _git_revision(),
+            "url": url, "scale": None if url else scale, "env": overrides, "workers": workers,
+            "duration_s": duration, "think_ms": think_ms, "mix": weights,
+            "slos": {k: list(v) for k, v in slos.items()}, "max_error_rate": max_error_rate,
+        },
+        "steps": steps,
+        "max_users_within_slo": max(passing) if passing else None,
+    }
+    print(f"\n Palier le plus haut dans les SLO : {report['max_users_within_slo']}")
+    output = output or RESULTS_DIR / f"{label}_{datetime.now():%Y%m%d_%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f" Résultats : {output}")
+
+
+@app.command()
+def compare(
+    files: list[Path] = typer.Argument(..., help="Résultats de plusieurs modes (run --label ...)"),
+    metric: str = typer.Option("p99_ms", help="Statistique comparée (p50_ms, p95_ms, p99_ms, rps, errors)"),
+):
+    """Tableau mode par mode : la statistique choisie par palier et par endpoint, débit total et SLO."""
+    reports = [json.loads(path.read_text()) for path in files]
+    labels = [r["meta"]["label"] for r in reports]
+    print(f" {metric} par mode : {' | '.join(labels)}")
+
+    levels = sorted({s["users"] for r in reports for s in r["steps"]})
+    for level in levels:
+        steps = [next((s for s in r["steps"] if s["users"] == level), None) for r in reports]
+        print(f"\n {level} utilisateurs")
+        endpoints = sorted({e for s in steps if s for e in s["endpoints"]})
+        for endpoint in endpoints + ["(débit total req/s)", "(SLO)"]:
+            cells = []
+            for step in steps:
+                if step is None:
+                    cells.append("-")
+                elif endpoint == "(débit total req/s)":
+                    cells.append(str(step["throughput_rps"]))
+                elif endpoint == "(SLO)":
+                    cells.append("ok" if step["slo_ok"] else "KO")
+                else:
+                    cells.append(str(step["endpoints"].get(endpoint, {}).get(metric, "-")))
+            print(f"   {endpoint:<22} " + " ".join(f"{c:>12}" for c in cells))
+
+    print("\n Palier le plus haut dans les SLO : " + " | ".join(
+        f"{label}={r['max_users_within_slo']}" for label, r in zip(labels, reports)
+    ))
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,112 @@
+import json
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import requests
+import typer
+
+app = typer.Typer(help="Mesure du démarrage à froid de l'API (import, premier 200)")
+
+API_MODULE = "backend.api.api"
+_IMPORTTIME = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)")
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def measure_import(repeat: int = 5) -> dict:
+    """Durée d'import du module de l'API dans un interpréteur neuf (médiane), et modules les plus lourds."""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", f"import {API_MODULE}"], check=True, capture_output=True)
+        durations.append(time.perf_counter() - start)
+
+    # -X importtime : durée cumulée par module, en microsecondes (sur stderr)
+    trace = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {API_MODULE}"], check=True, capture_output=True, text=True
+    ).stderr
+    top_level = [
+        (m.group(4), int(m.group(2)) / 1e6) for m in map(_IMPORTTIME.match, trace.splitlines())
+        if m and len(m.group(3)) <= 2
+    ]
+    heaviest = sorted(top_level, key=lambda item: item[1], reverse=True)[:10]
+    return {
+        "import_seconds": round(statistics.median(durations), 3),
+        "heaviest_imports": {name: round(seconds, 3) for name, seconds in heaviest},
+    }
+
+
+def measure_first_response(path: str = "/", warmup: bool = False, timeout: float = 120) -> dict:
+    """Lance uvicorn et mesure le délai jusqu'à la première réponse 200 sur `path`."""
+    port = _free_port()
+    env = {**os.environ, "API_WARMUP": "1" if warmup else "0"}
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", f"{API_MODULE}:app", "--port", str(port), "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        first_200 = None
+        while time.perf_counter() - start < timeout:
+            try:
+                r = requests.get(f"http://127.0.0.1:{port}{path}", timeout=timeout)
+                if r.status_code == 200:
+                    first_200 = time.perf_counter() - start
+                    break
+            except requests.exceptions.ConnectionError:
+                time.sleep(0.02)
+        # Une fois le serveur prêt : latence d'une deuxième requête (caches chauds)
+        second = None
+        if first_200 is not None:
+            t = time.perf_counter()
+            requests.get(f"http://127.0.0.1:{port}{path}", timeout=timeout)
+            second = time.perf_counter() - t
+    finally:
+        server.terminate()
+        server.wait()
+
+    return {
+        "path": path, "warmup": warmup,
+        "first_200_seconds": None if first_200 is None else round(first_200, 3),
+        "second_request_seconds": None if second is None else round(second, 3),
+    }
+
+
+@app.command()
+def run(
+    paths: list[str] = typer.Option(["/", "/counters"], "--path", help="Endpoints à mesurer (répétable)"),
+    repeat: int = typer.Option(5, help="Nombre d'imports mesurés (médiane)"),
+    warmup: bool = typer.Option(False, help="Active aussi le préchauffage (API_WARMUP=1) pour comparaison"),
+    output: Path = typer.Option(None, help="Écrit les résultats en JSON"),
+):
+    """Import de l'API puis délai jusqu'au premier 200, endpoint par endpoint."""
+    results = measure_import(repeat)
+    print(f" Import {API_MODULE} : {results['import_seconds']} s")
+    for name, seconds in results["heaviest_imports"].items():
+        print(f"   {name:<40} {seconds:.3f} s")
+
+    results["first_response"] = []
+    for path in paths:
+        for mode in ([False, True] if warmup else [False]):
+            r = measure_first_response(path, warmup=mode)
+            results["first_response"].append(r)
+            print(f" Premier 200 {path} (préchauffage={mode}) : {r['first_200_seconds']} s"
+                  f" | requête suivante : {r['second_request_seconds']} s")
+
+    if output:
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,366 @@
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import typer
+from sqlalchemy import Boolean, Column, DateTime, Float, Integer, MetaData, String, Table, inspect
+
+from backend.benchmarks.synthetic import BASE_COUNTERS, synthetic_dataset, synthetic_meteo
+from backend.modeling.predict_next_day import Predictor
+
+app = typer.Typer(help="Benchmarks sur données synthétiques (1x, 10x, 100x le réseau) et comparaison des résultats")
+
+RESULTS_DIR = Path(".cache/benchmarks/results")
+DEFAULT_DB_URL = "sqlite:///.cache/benchmarks/bench.sqlite"
+BENCH_TABLE = "bench_velo_clean"
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+
+def measure(func, repeat: int = 3, budget: float = 30.0, setup=None) -> list:
+    """
+    Durées (s) de `func` : `repeat` exécutions au plus, au moins une, arrêt dès que `budget` secondes
+    sont consommées (les grandes échelles ne tournent qu'une fois). `setup` n'est pas chronométré.
+    """
+    runs = []
+    for _ in range(repeat):
+        if setup: setup()
+        start = time.perf_counter()
+        func()
+        runs.append(time.perf_counter() - start)
+        if sum(runs) > budget:
+            break
+    return runs
+
+
+class Suite:
+    """Résultats d'une exécution, un par (benchmark, échelle)."""
+
+    def __init__(self, repeat: int, budget: float, only: list):
+        self.repeat = repeat
+        self.budget = budget
+        self.only = only
+        self.results = []
+
+    def selected(self, name: str) -> bool:
+        return not self.only or any(name.startswith(prefix) for prefix in self.only)
+
+    def bench(self, name: str, scale: int, func, rows: int = None, setup=None, **extra):
+        if not self.selected(name):
+            return
+        runs = measure(func, self.repeat, self.budget, setup)
+        median = statistics.median(runs)
+        self.results.append({
+            "benchmark": name, "scale": scale, "rows": rows,
+            "median_s": round(median, 6), "min_s": round(min(runs), 6),
+            "runs": [round(r, 6) for r in runs], **extra,
+        })
+        print(f"   {name:<42} x{scale:<4} {median * 1000:10.1f} ms  (min {min(runs) * 1000:.1f} ms, {len(runs)} run(s))")
+
+
+class SyntheticWeatherPredictor(Predictor):
+    """Predictor dont la météo vient du générateur (pas d'appel à Open-Meteo pendant la mesure)."""
+
+    def __init__(self, weather: pd.DataFrame):
+        super().__init__()
+        self.weather = weather.rename(columns={'datetime': 'ds'})
+
+    def get_weather_data(self, date_target) -> pd.DataFrame:
+        day = pd.Timestamp(date_target).normalize()
+        return self.weather[(self.weather['ds'] >= day) & (self.weather['ds'] < day + timedelta(days=1))]
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def _bench_table(db) -> Table:
+    """Table jetable de même forme que velo_clean : push/pull mesurés sans toucher aux vraies tables."""
+    table = Table(
+        BENCH_TABLE, MetaData(),
+        Column("id", Integer, primary_key=True, autoincrement=True),
+        Column("datetime", DateTime, nullable=False),
+        Column("counter_id", String, nullable=False),
+        Column("intensity", Float, nullable=False),
+        Column("lat", Float, nullable=True),
+        Column("lon", Float, nullable=True),
+        Column("weekday", Integer, nullable=True),
+        Column("is_weekend", Boolean, nullable=True),
+        Column("hour", Integer, nullable=True),
+    )
+    table.drop(db.engine, checkfirst=True)
+    table.create(db.engine)
+    return table
+
+
+def _drop_bench_table(db, table: Table):
+    table.drop(db.engine, checkfirst=True)
+    if BENCH_TABLE in db.metadata.tables:
+        db.metadata.remove(db.metadata.tables[BENCH_TABLE])
+
+
+def _train_model(df_features: pd.DataFrame):
+    """Petit modèle XGBoost (mêmes features que le mode récursif) : non chronométré, sert au pas de prédiction."""
+    import xgboost as xgb
+    from backend.modeling.train import BASE_FEATURES
+
+    features_cols = BASE_FEATURES + ['lag_24h', 'lag_48h', 'lag_168h', 'mean_last_4_days']
+    model = xgb.XGBRegressor(n_estimators=50, max_depth=6, random_state=42, n_jobs=-1)
+    model.fit(df_features[features_cols], df_features['count'])
+    return model, model.get_booster().feature_names
+
+
+def bench_pipeline(suite: Suite, scale: int, data: dict) -> pd.DataFrame:
+    """Nettoyage, features et pas de prédiction d'une journée ; renvoie les prédictions (pour l'API)."""
+    from backend.data.clean_data import DataCleaning
+    from backend.modeling.features import FeatureEngineering
+
+    velo_raw, velo_clean, meteo = data["velo_raw"], data["velo_clean"], data["meteo_clean"]
+    suite.bench("clean_data_velo", scale, lambda: DataCleaning().clean_data_velo(velo_raw), rows=len(velo_raw))
+
+    # Même entrée que _build_dataset (fusion vélo x météo) ; pas de connexion BDD pour la pipeline seule
+    df_merged = pd.merge(velo_clean, meteo, on='datetime', how='inner')
+    fe = FeatureEngineering.__new__(FeatureEngineering)
+    outputs = {}
+    suite.bench(
+        "features.pipeline", scale,
+        lambda: outputs.update(features=fe._pipeline_feature_engineering_finale(df_merged)), rows=len(df_merged),
+    )
+    df_features = outputs.get("features")
+    if df_features is None:
+        df_features = fe._pipeline_feature_engineering_finale(df_merged)
+
+    # Pas de la récursion (run_recursive_prediction) : 24h x tous les compteurs, mémoire comprise
+    model, model_cols = _train_model(df_features)
+    memory = df_features.set_index(['counter_id', 'ds'])['count'].to_dict()
+    encoded_ids = dict(df_features[['counter_id', 'counter_id_encoded']].drop_duplicates(subset=['counter_id']).values)
+    target = df_features['ds'].max().normalize() + timedelta(days=1)
+    predictor = SyntheticWeatherPredictor(synthetic_meteo(target, 2, seed=scale))
+
+    suite.bench(
+        "predict.day_step", scale,
+        lambda: predictor.predict_day(model, model_cols, target, encoded_ids, memory),
+        rows=len(encoded_ids) * 24,
+    )
+    # Prédictions du jour et du lendemain, comme le job quotidien (servent à remplir model_data)
+    return pd.concat([
+        predictor.predict_day(model, model_cols, target + timedelta(days=d), encoded_ids, memory) for d in range(2)
+    ])
+
+
+def bench_database(suite: Suite, scale: int, db, velo_clean: pd.DataFrame):
+    """push_data / pull_data sur une table jetable de la base de benchmark."""
+    if not (suite.selected("db.push_data") or suite.selected("db.pull_data")):
+        return
+    table = _bench_table(db)
+    try:
+        def truncate():
+            with db.engine.begin() as conn:
+                conn.execute(table.delete())
+
+        suite.bench("db.push_data", scale, lambda: db.push_data(velo_clean, BENCH_TABLE), rows=len(velo_clean), setup=truncate)
+        if not suite.selected("db.push_data"):
+            truncate()
+            db.push_data(velo_clean, BENCH_TABLE)
+        suite.bench("db.pull_data", scale, lambda: db.pull_data(BENCH_TABLE), rows=len(velo_clean))
+    finally:
+        _drop_bench_table(db, table)
+
+
+def api_endpoints(counter_id: str, batch_ids: list) -> list:
+    """(nom, chemin, en-têtes) de chaque endpoint de lecture de l'API."""
+    batch = "&".join(f"counter_ids={c}" for c in batch_ids)
+    return [
+        ("/", "/", None),
+        ("/version", "/version", None),
+        ("/ready", "/ready", None),
+        ("/counters", "/counters", None),
+        ("/history/{id}", f"/history/{counter_id}", None),
+        ("/history/{id}?resolution=day", f"/history/{counter_id}?resolution=day", None),
+        ("/history/{id}?days=8", f"/history/{counter_id}?days=8", None),
+        ("/prediction/{id}", f"/prediction/{counter_id}", None),
+        ("/predict/{id}", f"/predict/{counter_id}", None),
+        ("/batch/history", f"/batch/history?{batch}", None),
+        ("/batch/prediction", f"/batch/prediction?{batch}", None),
+        ("/map-data", "/map-data", None),
+        ("/map-data [arrow]", "/map-data", {"Accept": ARROW_MEDIA_TYPE}),
+        ("/map-data?since", "/map-data?since=0", None),
+        ("/map-summary", "/map-summary", None),
+    ]
+
+
+@contextmanager
+def seeded_database(db, data: dict, predictions: pd.DataFrame):
+    """
+    Remplit une base PostgreSQL vide avec les données synthétiques (tables de l'API, snapshot carte),
+    puis supprime à la sortie les tables créées. Renvoie False (sans rien toucher) si la base ne convient pas.
+    """
+    if db.engine.dialect.name != "postgresql":
+        print("   (API ignorée : l'API lit la base avec asyncpg, l'URL doit pointer vers PostgreSQL)")
+        yield False
+        return
+    existing = set(inspect(db.engine).get_table_names())
+    if "velo_clean" in existing:
+        print("   (API ignorée : la base contient déjà velo_clean, utilisez une base dédiée au benchmark)")
+        yield False
+        return
+
+    db.create_tables(partitioned=False)
+    created = set(inspect(db.engine).get_table_names()) - existing
+    try:
+        db.push_data(data["velo_clean"], "velo_clean")
+        db.push_data(data["meteo_clean"], "meteo_clean")
+        db.push_data(predictions, "model_data")
+        db.refresh_map_snapshot(full=True)
+        yield True
+    finally:
+        for name in created:
+            db.drop_tables(name)
+        # Les tables seront redéfinies par create_tables au prochain remplissage
+        db.metadata.clear()
+
+
+def bench_api(suite: Suite, scale: int, db, data: dict, predictions: pd.DataFrame):
+    """
+    Chaque endpoint via TestClient, sur une base PostgreSQL remplie avec les données synthétiques :
+    à froid (cache des réponses vidé avant chaque appel) puis à chaud.
+    Les tables sont créées puis supprimées par le benchmark : la base doit être vide (base dédiée).
+    """
+    if not suite.selected("api"):
+        return
+    with seeded_database(db, data, predictions) as seeded:
+        if not seeded:
+            return
+        os.environ["BENCHMARK_DATABASE_URL"] = db.engine.url.render_as_string(hide_password=False)
+        from fastapi.testclient import TestClient
+        import backend.api.api as api
+
+        counter_ids = data["counters"]["counter_id"].tolist()
+        with TestClient(api.app) as client:
+            api.response_cache.clear()
+            api.data_version.bump()
+            for name, path, headers in api_endpoints(counter_ids[0], counter_ids[:10]):
+                status = client.get(path, headers=headers).status_code
+                suite.bench(f"api {name} (cold)", scale, lambda: client.get(path, headers=headers),
+                            setup=api.response_cache.clear, status=status)
+                client.get(path, headers=headers)
+                suite.bench(f"api {name} (warm)", scale, lambda: client.get(path, headers=headers), status=status)
+                if status != 200:
+                    print(f"   ⚠ {name} : HTTP {status}")
+
+
+@app.command()
+def run(
+    scales: list[int] = typer.Option([1, 10, 100], "--scale", help="Multiples du nombre de compteurs (répétable)"),
+    days: int = typer.Option(21, help="Jours d'historique synthétique"),
+    counters: int = typer.Option(BASE_COUNTERS, help="Nombre de compteurs à l'échelle 1x"),
+    repeat: int = typer.Option(3, help="Exécutions par benchmark (médiane)"),
+    budget: float = typer.Option(30.0, help="Au-delà de ce temps cumulé (s), un benchmark n'est plus répété"),
+    only: list[str] = typer.Option([], "--only", help="Préfixes des benchmarks à lancer (ex. features, db, api)"),
+    db_url: str = typer.Option(None, help="Base de benchmark (défaut : BENCHMARK_DATABASE_URL, sinon SQLite locale)"),
+    output: Path = typer.Option(None, help="Fichier de résultats (défaut : .cache/benchmarks/results/<date>_<commit>.json)"),
+):
+    """Lance la suite à chaque échelle et enregistre les résultats (JSON) pour comparaison."""
+    from backend.data.schemas import Database
+
+    db_url = db_url or os.getenv("BENCHMARK_DATABASE_URL", DEFAULT_DB_URL)
+    if db_url.startswith("sqlite:///"):
+        Path(db_url.removeprefix("sqlite:///")).parent.mkdir(parents=True, exist_ok=True)
+    db = Database(db_url)
+
+    suite = Suite(repeat, budget, only)
+    for scale in scales:
+        data = synthetic_dataset(scale, days=days, base_counters=counters)
+        print(f" Échelle x{scale} : {len(data['counters'])} compteurs, {len(data['velo_clean'])} lignes velo_clean")
+        predictions = bench_pipeline(suite, scale, data)
+        bench_database(suite, scale, db, data["velo_clean"])
+        bench_api(suite, scale, db, data, predictions)
+
+    revision = _git_revision()
+    report = {
+        "meta": {
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "commit": revision,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            "database": db.engine.dialect.name,
+            "days": days, "counters": counters, "scales": scales, "repeat": repeat,
+        },
+        "results": suite.results,
+    }
+    output = output or RESULTS_DIR / f"{datetime.now():%Y%m%d_%H%M%S}_{revision}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f" Résultats : {output}")
+
+
+# Paramètres qui doivent être identiques pour que deux exécutions soient comparables
+COMPARABLE_META = ["database", "days", "counters", "cpus", "platform"]
+
+
+def _load(path: Path):
+    report = json.loads(path.read_text())
+    return report["meta"], {(r["benchmark"], r["scale"]): r for r in report["results"]}
+
+
+@app.command()
+def compare(
+    baseline: Path = typer.Argument(None, help="Résultats de référence (défaut : l'avant-dernier du dossier)"),
+    current: Path = typer.Argument(None, help="Résultats à comparer (défaut : le dernier du dossier)"),
+    threshold: float = typer.Option(0.2, help="Régression si la médiane augmente de plus de cette fraction"),
+    min_delta_ms: float = typer.Option(1.0, help="Écarts absolus plus petits ignorés (bruit)"),
+    results_dir: Path = typer.Option(RESULTS_DIR, help="Dossier des résultats"),
+):
+    """Compare deux exécutions benchmark par benchmark ; code de sortie 1 en cas de régression."""
+    if baseline is None or current is None:
+        files = sorted(results_dir.glob("*.json"))
+        if len(files) < 2:
+            print(f" Il faut au moins deux résultats dans {results_dir}")
+            raise typer.Exit(2)
+        baseline, current = files[-2], files[-1]
+    print(f" Référence : {baseline}\n Comparé   : {current}")
+
+    (base_meta, base), (cur_meta, cur) = _load(baseline), _load(current)
+    for key in COMPARABLE_META:
+        if base_meta.get(key) != cur_meta.get(key):
+            print(f" ⚠ {key} différent ({base_meta.get(key)} / {cur_meta.get(key)}) : comparaison à interpréter avec prudence")
+    regressions = 0
+    for key in sorted(cur, key=lambda k: (k[1], k[0])):
+        if key not in base:
+            continue
+        before, after = base[key]["median_s"], cur[key]["median_s"]
+        ratio = after / before if before else float("inf")
+        delta_ms = (after - before) * 1000
+        flag = ""
+        if ratio > 1 + threshold and delta_ms > min_delta_ms:
+            flag, regressions = "⚠ régression", regressions + 1
+        elif ratio < 1 - threshold and -delta_ms > min_delta_ms:
+            flag = "amélioration"
+        print(f"   {key[0]:<42} x{key[1]:<4} {before * 1000:10.1f} -> {after * 1000:10.1f} ms  x{ratio:5.2f}  {flag}")
+
+    missing = sorted(set(base) - set(cur))
+    if missing:
+        print(f" Absents de l'exécution comparée : {', '.join(f'{n} x{s}' for n, s in missing)}")
+    if regressions:
+        print(f" {regressions} régression(s) au-delà de {threshold:.0%}")
+        raise typer.Exit(1)
+    print(" Aucune régression")
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,121 @@
+import numpy as np
+import pandas as pd
+
+from backend.data.clean_data import DataCleaning
+
+# Ordre de grandeur du réseau de Montpellier (compteurs EcoCounter) : échelle 1x
+BASE_COUNTERS = 60
+CENTER = (43.6108, 3.8767)
+
+
+def counter_ids(n: int) -> list:
+    return [f"urn:ngsi-ld:EcoCounter:SYN{i:05d}" for i in range(n)]
+
+
+def synthetic_counters(n: int, seed: int = 0) -> pd.DataFrame:
+    """Compteurs autour du centre-ville : position, niveau de trafic (passages/h en pointe), voie."""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "counter_id": counter_ids(n),
+        "lat": CENTER[0] + rng.normal(0, 0.03, n),
+        "lon": CENTER[1] + rng.normal(0, 0.04, n),
+        "level": rng.lognormal(np.log(40), 0.7, n),
+        "laneId": rng.integers(1, 3, n),
+        "vehicleType": "bicycle",
+    })
+
+
+def hourly_profile(hour: np.ndarray, weekend: np.ndarray) -> np.ndarray:
+    """Profil horaire relatif : pointes domicile-travail en semaine, après-midi étalé le week-end."""
+    weekday = (
+        0.05 + np.exp(-((hour - 8) ** 2) / 2) + 0.9 * np.exp(-((hour - 17.5) ** 2) / 3)
+        + 0.4 * np.exp(-((hour - 12.5) ** 2) / 4)
+    )
+    weekend_profile = 0.05 + 0.7 * np.exp(-((hour - 15) ** 2) / 10)
+    return np.where(weekend, weekend_profile, weekday)
+
+
+def synthetic_meteo(start, days: int, seed: int = 0) -> pd.DataFrame:
+    """Météo horaire (même forme que meteo_clean) : cycle de température, vent, averses."""
+    rng = np.random.default_rng(seed)
+    ds = pd.date_range(start, periods=days * 24, freq="h")
+    hour = ds.hour.to_numpy()
+    showers = rng.random(len(ds)) < 0.06
+    return pd.DataFrame({
+        "datetime": ds,
+        "temperature_2m": 15 + 6 * np.sin(2 * np.pi * (hour - 9) / 24) + rng.normal(0, 1.5, len(ds)),
+        "wind_speed_10m": rng.gamma(2.0, 5.0, len(ds)),
+        "precipitation": np.where(showers, rng.gamma(1.5, 1.2, len(ds)), 0.0),
+    })
+
+
+def expected_counts(counters: pd.DataFrame, meteo: pd.DataFrame) -> np.ndarray:
+    """Passages attendus (compteur x heure, à plat) : niveau du compteur x profil horaire, moins de vélos sous la pluie."""
+    ds = pd.DatetimeIndex(meteo["datetime"])
+    weekend = ds.dayofweek.to_numpy() >= 5
+    rain_factor = np.where(meteo["precipitation"].to_numpy() > 0, 0.4, 1.0)
+    profile = hourly_profile(ds.hour.to_numpy(), weekend) * rain_factor
+    return np.outer(counters["level"].to_numpy(), profile).ravel()
+
+
+def synthetic_velo_raw(counters: pd.DataFrame, meteo: pd.DataFrame, seed: int = 0,
+                       missing_rate: float = 0.01, outlier_rate: float = 0.001,
+                       duplicate_rate: float = 0.002) -> pd.DataFrame:
+    """
+    Séries brutes (même forme que le portail) pour chaque compteur et chaque heure de `meteo` :
+    comptages de Poisson autour du profil horaire, moins de vélos sous la pluie,
+    avec des heures manquantes, des valeurs aberrantes et des doublons comme dans les vraies données.
+    """
+    rng = np.random.default_rng(seed)
+    n_hours, n_counters = len(meteo), len(counters)
+    ds = pd.DatetimeIndex(meteo["datetime"])
+
+    intensity = rng.poisson(expected_counts(counters, meteo))
+    outliers = rng.random(len(intensity)) < outlier_rate
+    intensity[outliers] = rng.integers(300, 2000, outliers.sum())
+
+    df = pd.DataFrame({
+        # Le portail renvoie des horodatages UTC avec fuseau
+        "datetime": pd.DatetimeIndex(np.tile(ds.to_numpy(), n_counters)).tz_localize("UTC"),
+        "intensity": intensity,
+        "counter_id": np.repeat(counters["counter_id"].to_numpy(), n_hours),
+        "lat": np.repeat(counters["lat"].to_numpy(), n_hours),
+        "lon": np.repeat(counters["lon"].to_numpy(), n_hours),
+        "laneId": np.repeat(counters["laneId"].to_numpy(), n_hours),
+        "vehicleType": "bicycle",
+    })
+    df = df[rng.random(len(df)) >= missing_rate]
+    duplicates = df.sample(frac=duplicate_rate, random_state=seed)
+    return pd.concat([df, duplicates], ignore_index=True)
+
+
+def synthetic_predictions(counters: pd.DataFrame, meteo: pd.DataFrame) -> pd.DataFrame:
+    """Prédictions (même forme que model_data) pour les heures de `meteo` : le trafic attendu, sans bruit."""
+    ds = pd.DatetimeIndex(meteo["datetime"])
+    return pd.DataFrame({
+        "datetime": np.tile(ds.to_numpy(), len(counters)),
+        "counter_id": np.repeat(counters["counter_id"].to_numpy(), len(ds)),
+        "predicted_values": np.round(expected_counts(counters, meteo)),
+    })
+
+
+def synthetic_dataset(scale: int, days: int = 21, end=None, seed: int = 0,
+                      base_counters: int = BASE_COUNTERS) -> dict:
+    """
+    Jeu de données à `scale` fois la taille du réseau, sur `days` jours finissant à `end` (défaut : aujourd'hui) :
+    velo_raw, velo_clean (nettoyé par DataCleaning, comme à l'ingestion), meteo_clean et les compteurs.
+    """
+    end = pd.Timestamp(end or pd.Timestamp.today()).normalize()
+    start = end - pd.Timedelta(days=days)
+    counters = synthetic_counters(base_counters * scale, seed)
+    meteo = synthetic_meteo(start, days, seed)
+    velo_raw = synthetic_velo_raw(counters, meteo, seed)
+
+    clean = DataCleaning()
+    velo_clean = clean._standardize_delete_timezone(clean.clean_data_velo(velo_raw))
+    return {
+        "counters": counters,
+        "velo_raw": velo_raw,
+        "velo_clean": velo_clean,
+        "meteo_clean": meteo,
+    }
@@ -1,6 +1,8 @@
 import pandas as pd
 import numpy as np
 
+from backend.data.metrics import timed_stage
+
 class DataCleaning:
 
     def __init__(self):
@@ -10,6 +12,7 @@ class DataCleaning:
         self.df_200 = None
         self.df_100 = None
 
+    @timed_stage("cleaning")
     def clean_data_velo(self, df: pd.DataFrame) -> pd.DataFrame:
         df = df.drop_duplicates().copy()
         df['datetime'] = pd.to_datetime(df['datetime'])
@@ -24,6 +27,7 @@ class DataCleaning:
         self.df_clean = df
         return df
     
+    @timed_stage("cleaning")
     def _standardize_delete_timezone(self, df):
         """
         Traite les dates Vélo : Déjà en UTC, on retire juste la timezone.
@@ -34,6 +38,7 @@ class DataCleaning:
         df['datetime'] = df['datetime'].dt.tz_localize(None)
         return df
 
+    @timed_stage("cleaning")
     def _standardize_to_UTC(self, df):
             """
             Traite les dates Météo : On s'assure juste que c'est au format date.
@@ -1,6 +1,11 @@
 from backend.data.schemas import Database
-from backend.data.fetch_data import FetchAPI
+from backend.data.db_url import database_url
+from backend.data.fetch_data import FetchAPI, PORTAL_URL
 from backend.data.clean_data import DataCleaning
+from backend.data.stage_cache import StageCache, frame_fingerprint
+from backend.data.metrics import export_on_exit
+from backend.data.profiling import start_profiling
+from pathlib import Path
 import os
 from datetime import datetime
 from dotenv import load_dotenv
@@ -11,15 +16,9 @@ app = typer.Typer(help="P")
 # Load environment variables from .env
 load_dotenv()
 
-# Fetch variables
-USER = os.getenv("user")
-PASSWORD = os.getenv("password")
-HOST = os.getenv("host")
-PORT = os.getenv("port")
-DBNAME = os.getenv("dbname")
-
-DATABASE_URL = f"postgresql+psycopg2://{USER}:{PASSWORD}@{HOST}:{PORT}/{DBNAME}?sslmode=require"
-OPEN_API_URL = os.getenv("OPEN_API_URL")
+# Base de production, ou BENCHMARK_DATABASE_URL sur le banc d'essai (comme pour l'API)
+DATABASE_URL = database_url("postgresql+psycopg2")
+OPEN_API_URL = os.getenv("OPEN_API_URL", f"{PORTAL_URL}/ecocounter/")
 
 start_date="2024-11-30"
 end_date = datetime.now().strftime("%Y-%m-%d")
@@ -29,6 +28,56 @@ longitude=3.8772
 db = Database(DATABASE_URL)
 fetch = FetchAPI(OPEN_API_URL) #le url sera passé en argument de la classe
 clean = DataCleaning() #le dataframe sera passé en argument des fonctions
+cache = StageCache()
+
+
+@app.callback()
+def main(
+    ctx: typer.Context,
+    profile: Path = typer.Option(None, help="Écrit un profil par étape (cProfile + pic mémoire) dans ce dossier"),
+):
+    """
+    Chaque commande exporte ses métriques en fin d'exécution (fichier texte / Pushgateway).
+    --profile se place avant la commande : `cli_data --profile .cache/profiles push-db`.
+    """
+    if ctx.invoked_subcommand:
+        export_on_exit(ctx.invoked_subcommand)
+        if profile:
+            start_profiling(ctx.invoked_subcommand, profile)
+
+
+def _ingest_velo(data_velo):
+    """Nettoie et pousse les vélos, sauf si ce contenu exact est déjà en base (cache)."""
+    inputs = {"raw": frame_fingerprint(data_velo), "velo_raw": db.table_fingerprint("velo_raw")}
+    if cache.get("clean_velo", inputs) is not None:
+        return
+    df_clean_velo = clean.clean_data_velo(data_velo)
+    df_clean_velo = clean._standardize_delete_timezone(df_clean_velo)
+    db.push_data(data_velo, "velo_raw")
+    db.push_data(df_clean_velo, "velo_clean")
+    # L'empreinte de la table est prise APRÈS l'insertion : c'est l'état du prochain run
+    inputs["velo_raw"] = db.table_fingerprint("velo_raw")
+    cache.put("clean_velo", inputs, df_clean_velo)
+
+
+def _refresh_snapshot(full: bool = False):
+    """Rafraîchit le snapshot de la carte (n'empêche pas l'ingestion en cas d'échec)."""
+    try:
+        db.refresh_map_snapshot(full=full)
+    except Exception as e:
+        print(f" ⚠ Snapshot carte non rafraîchi : {e}")
+
+
+def _ingest_meteo(data_meteo):
+    """Nettoie et pousse la météo, sauf si ce contenu exact est déjà en base (cache)."""
+    inputs = {"raw": frame_fingerprint(data_meteo), "meteo_raw": db.table_fingerprint("meteo_raw")}
+    if cache.get("clean_meteo", inputs) is not None:
+        return
+    df_clean_meteo = clean._standardize_to_UTC(data_meteo.copy())
+    db.push_data(data_meteo, "meteo_raw")
+    db.push_data(df_clean_meteo, "meteo_clean")
+    inputs["meteo_raw"] = db.table_fingerprint("meteo_raw")
+    cache.put("clean_meteo", inputs, df_clean_meteo)
 
 
 @app.command()
@@ -63,24 +112,32 @@ def create_tables():
     db.create_tables()
     print("Tables créées avec succès.")
 
+@app.command()
+def migrate_schema(partitioned: bool = False, months_ahead: int = 3):
+    """
+    Ajoute les index (counter_id, datetime) et BRIN(datetime) aux tables temporelles.
+    --partitioned : convertit aussi velo_raw / velo_clean / model_data en partitions mensuelles.
+    """
+    stranded = db.migrate_schema(partitioned=partitioned, months_ahead=months_ahead)
+    if stranded:
+        print(f"Migration terminée avec des mois dans la partition par défaut : {', '.join(stranded)}")
+        raise typer.Exit(code=1)
+    print("Migration terminée.")
+
 @app.command()
 def push_velo():
     """Récupère les données depuis l'API et les charge dans la base de données."""
 
     data_velo = fetch.fetch_all_data_velo()
-    df_clean_velo = clean.clean_data_velo(data_velo)
-    df_clean_velo = clean._standardize_delete_timezone(df_clean_velo)
-    db.push_data(data_velo, "velo_raw")
-    db.push_data(df_clean_velo, "velo_clean")
+    _ingest_velo(data_velo)
+    _refresh_snapshot()
 
 @app.command()
 def push_meteo():
     """Récupère les données météo depuis l'API et les charge dans la base de données."""
 
     data_meteo = fetch.fetch_meteo(start_date, end_date, latitude, longitude)
-    df_clean_meteo = clean._standardize_to_UTC(data_meteo)
-    db.push_data(data_meteo, "meteo_raw")
-    db.push_data(df_clean_meteo, "meteo_clean")
+    _ingest_meteo(data_meteo)
 
 @app.command()
 def push_db():
@@ -88,16 +145,31 @@ def push_db():
 
     data_velo = fetch.fetch_all_data_velo()
     data_meteo = fetch.fetch_meteo(start_date, end_date, latitude, longitude)
-    df_clean_velo = clean.clean_data_velo(data_velo)
-    df_clean_velo = clean._standardize_delete_timezone(df_clean_velo)
-    df_clean_meteo = clean._standardize_to_UTC(data_meteo)
-    db.push_data(data_velo, "velo_raw")
-    db.push_data(df_clean_velo, "velo_clean")
-    db.push_data(data_meteo, "meteo_raw")
-    db.push_data(df_clean_meteo, "meteo_clean")
+    _ingest_velo(data_velo)
+    _ingest_meteo(data_meteo)
+    _refresh_snapshot()
     print("Données récupérées et chargées avec succès.")
 
 
+@app.command()
+def refresh_map_snapshot(full: bool = False):
+    """Rafraîchit le snapshot pré-calculé de la carte (--full : reconstruction complète)."""
+    _refresh_snapshot(full)
+
+
+@app.command()
+def update_scores(full: bool = False):
+    """Met à jour les statistiques des scores du modèle (--full : recalcul complet)."""
+    db.update_score_stats(full=full)
+
+
+@app.command()
+def clear_cache(stage: str = ""):
+    """Vide le cache des étapes du pipeline (toutes, ou une seule étape)."""
+    cache.clear(stage or None)
+    print("Cache vidé.")
+
+
 @app.command()
 def pull_db():
     """Charge les données nettoyées dans la base de données."""
@@ -0,0 +1,28 @@
+import os
+
+
+def database_url(scheme: str) -> str:
+    """
+    URL de la base pour le pilote `scheme` (ex : "postgresql+psycopg2", "postgresql" pour asyncpg),
+    partagée par l'API et la CLI de données. Sans dépendance : l'API l'utilise sans charger SQLAlchemy.
+
+    Base de production (variables user / password / host / port / dbname), sauf sur le banc d'essai :
+    BENCHMARK_DATABASE_URL (URL complète, base dédiée des benchmarks / tests de charge) est alors
+    prioritaire, avec le pilote remplacé par `scheme`. Variable propre au banc d'essai : un
+    DATABASE_URL hérité de l'environnement n'est jamais pris.
+    """
+    url = os.getenv("BENCHMARK_DATABASE_URL")
+    if url:
+        base, sep, rest = url.partition("://")
+        if not sep or base.split("+")[0] not in ("postgresql", "postgres"):
+            raise ValueError("BENCHMARK_DATABASE_URL doit être une URL PostgreSQL (postgresql://...)")
+        return f"{scheme}://{rest}"
+
+    USER = os.getenv("user")
+    PASSWORD = os.getenv("password")
+    HOST = os.getenv("host")
+    PORT = os.getenv("port")
+    DBNAME = os.getenv("dbname")
+
+    # sslmode=require est souvent obligatoire sur Azure
+    return f"{scheme}://{USER}:{PASSWORD}@{HOST}:{PORT}/{DBNAME}?sslmode=require"
@@ -1,18 +1,66 @@
+import os
+import time
 import requests
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from requests.adapters import HTTPAdapter
+
+from backend.data.metrics import FETCH_COUNTER_SECONDS, FETCH_ERRORS, FETCH_RETRIES, FETCH_SECONDS
+from backend.data.profiling import profiled
+
+# Codes HTTP pour lesquels une nouvelle tentative a un sens (limitation de débit, erreurs serveur)
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Points d'accès des API externes, surchargeables (ex. serveur local de simulation : backend/benchmarks/fake_upstream.py)
+PORTAL_URL = os.getenv("PORTAL_URL", "https://portail-api-data.montpellier3m.fr")
+METEO_ARCHIVE_URL = os.getenv("METEO_ARCHIVE_URL", "https://archive-api.open-meteo.com/v1/era5")
+METEO_FORECAST_URL = os.getenv("METEO_FORECAST_URL", "https://api.open-meteo.com/v1/forecast")
 
 class FetchAPI:
 
-    def __init__(self, url):
+    def __init__(self, url, portal_url: str = None, meteo_url: str = None):
         self.session = requests.Session()
         self.url = url
+        self.portal_url = portal_url or PORTAL_URL
+        self.meteo_url = meteo_url or METEO_ARCHIVE_URL
+        self.max_retries = int(os.getenv("FETCH_MAX_RETRIES", "3"))
+        # Compteurs récupérés en parallèle (1 = séquentiel) : une connexion keep-alive par worker
+        self.workers = int(os.getenv("FETCH_WORKERS", "1"))
+        adapter = HTTPAdapter(pool_maxsize=max(10, self.workers))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _get(self, kind: str, url: str, **kwargs) -> requests.Response:
+        """
+        GET avec nouvelles tentatives (429, 5xx, erreurs réseau) : attente Retry-After
+        si le serveur la donne, sinon 1 s, 2 s, 4 s... Chaque tentative est mesurée (`kind`).
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                with FETCH_SECONDS.labels(kind).time():
+                    response = self.session.get(url, **kwargs)
+                if response.status_code not in RETRY_STATUSES or attempt == self.max_retries:
+                    break
+                retry_after = response.headers.get("Retry-After", "")
+                delay = float(retry_after) if retry_after.isdigit() else 2 ** attempt
+            except requests.exceptions.RequestException:
+                if attempt == self.max_retries:
+                    FETCH_ERRORS.labels(kind).inc()
+                    raise
+                delay = 2 ** attempt
+            FETCH_RETRIES.labels(kind).inc()
+            time.sleep(delay)
+
+        if response.status_code != 200:
+            FETCH_ERRORS.labels(kind).inc()
+        return response
 
     # ---------------------------------------------------------
     # 1️ Récupérer la liste des compteurs
     # ---------------------------------------------------------
     def fetch_all_counters(self) -> list:
-        response = self.session.get(self.url)
+        response = self._get("counters", self.url)
 
         if response.status_code != 200:
             print("Erreur récupération liste des compteurs :", response.status_code)
@@ -34,11 +82,11 @@ class FetchAPI:
     # 2️ Récupérer les séries temporelles d’un compteur
     # ---------------------------------------------------------
     def fetch_counter_timeseries(self, counter_id: str, from_date: str, to_date: str) -> pd.DataFrame:
-        url_timeseries = f"https://portail-api-data.montpellier3m.fr/ecocounter_timeseries/{counter_id}/attrs/intensity"
+        url_timeseries = f"{self.portal_url}/ecocounter_timeseries/{counter_id}/attrs/intensity"
 
         params = {"fromDate": from_date, "toDate": to_date}
 
-        response = self.session.get(url_timeseries, params=params)
+        response = self._get("timeseries", url_timeseries, params=params)
 
         if response.status_code != 200:
             print(f"Erreur séries temporelles pour {counter_id} : {response.status_code}")
@@ -70,7 +118,7 @@ class FetchAPI:
     # ---------------------------------------------------------
     def fetch_counter_description(self, counter_id: str) -> dict:
         url_desc = f"{self.url}{counter_id}"
-        response = self.session.get(url_desc)
+        response = self._get("description", url_desc)
 
         if response.status_code != 200:
             print(f"Erreur description pour {counter_id} : {response.status_code}")
@@ -94,6 +142,7 @@ class FetchAPI:
         }
     
 
+    @profiled("fetch.meteo")
     def fetch_meteo(self, start_date, end_date, latitude:str, longitude:str) -> pd.DataFrame:
         
         if end_date is None:
@@ -102,7 +151,7 @@ class FetchAPI:
         print(f" Chargement de la météo HORAIRE pour {latitude}, {longitude}...")
         
         url_meteo = (
-            f"https://archive-api.open-meteo.com/v1/era5?"
+            f"{self.meteo_url}?"
             f"latitude={latitude}&longitude={longitude}"
             f"&start_date={start_date}&end_date={end_date}"
             f"&hourly=temperature_2m,wind_speed_10m,precipitation"
@@ -111,7 +160,7 @@ class FetchAPI:
 
         try:
             # MODIFICATION ICI : Timeout passé à 30 secondes
-            response = requests.get(url_meteo, timeout=50) 
+            response = self._get("meteo", url_meteo, timeout=50)
             response.raise_for_status()
 
             data = response.json()
@@ -131,30 +180,40 @@ class FetchAPI:
             print(f" Erreur de connexion API Météo : {e}")
             return pd.DataFrame() # Retourne un DF vide pour ne pas faire planter la suite
 
-    def fetch_all_data_velo(self, start_date="2024-11-30T00:00:00", end_date = None) -> pd.DataFrame:
-        if end_date is None:
-            end_date = datetime.now().strftime("%Y-%m-%dT23:59:59")
-        counters = self.fetch_all_counters()
-        data = []
+    def _fetch_counter(self, counter_id: str, start_date, end_date):
+        """Série temporelle + description d'un compteur (None si la série est vide)."""
+        print(f"\n➡ Récupération pour : {counter_id}")
+        start = time.perf_counter()
 
-        for counter_id in counters:
-            print(f"\n➡ Récupération pour : {counter_id}")
+        # --- Timeseries ---
+        df_ts = self.fetch_counter_timeseries(counter_id, start_date, end_date)
+        if df_ts.empty:
+            return None
 
-            # --- Timeseries ---
-            df_ts = self.fetch_counter_timeseries(counter_id, start_date, end_date)
-            if df_ts.empty:
-                continue
+        # --- Description ---
+        desc = self.fetch_counter_description(counter_id)
+        FETCH_COUNTER_SECONDS.observe(time.perf_counter() - start)
 
-            # --- Description ---
-            desc = self.fetch_counter_description(counter_id)
+        df_ts["lat"] = desc["lat"]
+        df_ts["lon"] = desc["lon"]
+        df_ts["laneId"] = desc["laneId"]
+        df_ts["vehicleType"] = desc["vehicleType"]
 
-            df_ts["lat"] = desc["lat"]
-            df_ts["lon"] = desc["lon"]
-            df_ts["laneId"] = desc["laneId"]
-            df_ts["vehicleType"] = desc["vehicleType"]
+        print(f" {len(df_ts)} lignes ajoutées")
+        return df_ts
 
-            data.append(df_ts)
-            print(f" {len(df_ts)} lignes ajoutées")
+    @profiled("fetch.velo")
+    def fetch_all_data_velo(self, start_date="2024-11-30T00:00:00", end_date = None) -> pd.DataFrame:
+        if end_date is None:
+            end_date = datetime.now().strftime("%Y-%m-%dT23:59:59")
+        counters = self.fetch_all_counters()
+
+        if self.workers > 1:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="fetch") as pool:
+                results = list(pool.map(lambda c: self._fetch_counter(c, start_date, end_date), counters))
+        else:
+            results = [self._fetch_counter(counter_id, start_date, end_date) for counter_id in counters]
+        data = [df for df in results if df is not None]
 
         if not data:
             print("Aucune donnée récupérée")
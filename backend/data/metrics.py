@@ -0,0 +1,130 @@
+import atexit
+import os
+import time
+from functools import wraps
+
+import pandas as pd
+from prometheus_client import REGISTRY, Counter, Gauge, Histogram, push_to_gateway, write_to_textfile
+
+from backend.data.profiling import profile_stage
+
+# Étapes longues (jusqu'à plusieurs minutes) : buckets élargis
+STAGE_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+# --- Récupération des données (FetchAPI) ---
+FETCH_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+FETCH_SECONDS = Histogram(
+    'velomag_fetch_seconds', "Durée d'un appel aux API externes", ['kind'], buckets=FETCH_BUCKETS
+)
+# Sans étiquette counter_id : une série par compteur ferait croître la cardinalité avec le parc
+FETCH_COUNTER_SECONDS = Histogram(
+    'velomag_fetch_counter_seconds', "Durée de récupération (série + description) d'un compteur",
+    buckets=FETCH_BUCKETS,
+)
+FETCH_RETRIES = Counter('velomag_fetch_retries_total', "Nouvelles tentatives d'appel aux API externes", ['kind'])
+FETCH_ERRORS = Counter('velomag_fetch_errors_total', "Appels aux API externes en échec (après tentatives)", ['kind'])
+
+# --- Étapes du pipeline (DataCleaning, FeatureEngineering) ---
+STAGE_SECONDS = Histogram(
+    'velomag_stage_seconds', "Durée d'une étape du pipeline", ['component', 'stage'], buckets=STAGE_BUCKETS
+)
+STAGE_ROWS = Gauge('velomag_stage_rows', "Lignes produites par la dernière exécution de l'étape", ['component', 'stage'])
+
+# --- Prédiction récursive : une mesure par étape de chaque journée ---
+PREDICTION_STEP_SECONDS = Histogram(
+    'velomag_prediction_step_seconds', "Durée des étapes d'une journée de prédiction récursive", ['step'],
+    buckets=STAGE_BUCKETS,
+)
+
+# --- Orchestrateur (backend/orchestrator.py) : un cycle ingestion -> score ---
+PIPELINE_FRESHNESS_SECONDS = Gauge(
+    'velomag_pipeline_freshness_seconds', "Âge de la mesure vélo la plus récente au moment où elle est publiée"
+)
+PIPELINE_DB_STATEMENTS = Gauge(
+    'velomag_pipeline_db_statements', "Requêtes SQL envoyées par le dernier cycle de l'orchestrateur"
+)
+PIPELINE_LAST_SUCCESS = Gauge(
+    'velomag_pipeline_last_success_timestamp_seconds', "Fin du dernier cycle réussi de l'orchestrateur"
+)
+
+
+class StageTimer:
+    """
+    Mesure une étape : `with StageTimer("features", "lags") as stage: ... ; stage.rows = len(df)`.
+    Avec --profile, l'étape a aussi son propre profil (cf. backend.data.profiling).
+    """
+
+    def __init__(self, component: str, stage: str):
+        self.component = component
+        self.stage = stage
+        self.rows = None
+
+    def __enter__(self):
+        self._profile = profile_stage(f"{self.component}.{self.stage}")
+        self._profile.__enter__()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._profile.__exit__(*exc)
+        STAGE_SECONDS.labels(self.component, self.stage).observe(time.perf_counter() - self.start)
+        if self.rows is not None:
+            STAGE_ROWS.labels(self.component, self.stage).set(self.rows)
+        return False
+
+
+class StageClock:
+    """
+    Chronomètre à tours, pour les pipelines écrites d'un seul bloc :
+    `clock.lap("resample", df)` mesure le temps écoulé depuis le tour précédent.
+    """
+
+    def __init__(self, component: str):
+        self.component = component
+        self.last = time.perf_counter()
+
+    def lap(self, stage: str, df: pd.DataFrame = None):
+        now = time.perf_counter()
+        STAGE_SECONDS.labels(self.component, stage).observe(now - self.last)
+        if df is not None:
+            STAGE_ROWS.labels(self.component, stage).set(len(df))
+        self.last = now
+
+
+def timed_stage(component: str, stage: str = None):
+    """Décorateur : durée de la fonction, et nombre de lignes si elle retourne un DataFrame."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with StageTimer(component, stage or func.__name__) as timer:
+                result = func(*args, **kwargs)
+                if isinstance(result, pd.DataFrame):
+                    timer.rows = len(result)
+            return result
+        return wrapper
+    return decorator
+
+
+def export_job_metrics(job: str):
+    """
+    Écrit les métriques du job dans un fichier texte (collecteur textfile de node_exporter),
+    et les pousse vers une Pushgateway si PUSHGATEWAY_URL est défini.
+    """
+    directory = os.getenv("METRICS_TEXTFILE_DIR", ".cache/metrics")
+    try:
+        os.makedirs(directory, exist_ok=True)
+        write_to_textfile(os.path.join(directory, f"velomag_{job}.prom"), REGISTRY)
+    except Exception as e:
+        print(f" ⚠ Métriques non écrites : {e}")
+
+    gateway = os.getenv("PUSHGATEWAY_URL")
+    if gateway:
+        try:
+            push_to_gateway(gateway, job=f"velomag_{job}", registry=REGISTRY)
+        except Exception as e:
+            print(f" ⚠ Métriques non poussées vers {gateway} : {e}")
+
+
+def export_on_exit(job: str):
+    """Exporte les métriques à la fin du processus (y compris en cas d'erreur)."""
+    atexit.register(export_job_metrics, job)
@@ -0,0 +1,156 @@
+import atexit
+import cProfile
+import io
+import json
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # Windows : pas de pic RSS, seulement tracemalloc
+    resource = None
+
+# Session active (option --profile des jobs), None sinon : les hooks ne coûtent alors rien
+_session = None
+
+
+class _Stage:
+    def __init__(self, name: str):
+        self.name = name
+        self.profiler = cProfile.Profile()
+        self.start = time.perf_counter()
+        self.peak = 0
+
+    def enable(self):
+        if self.profiler is None:
+            return
+        try:
+            self.profiler.enable()
+        except ValueError:
+            # Un autre profileur est actif (Python >= 3.12 : un seul par processus) : étape seulement chronométrée
+            self.profiler = None
+
+    def disable(self):
+        if self.profiler is not None:
+            self.profiler.disable()
+
+
+class JobProfile:
+    """
+    Profil d'un job batch, étape par étape : un fichier cProfile (.prof, lisible avec snakeviz
+    ou pstats) et un résumé texte par étape, plus summary.json (durées, pics mémoire).
+    Les étapes s'imbriquent : le profil d'une étape exclut ses sous-étapes, profilées à part.
+    Une pile d'étapes par thread (étapes lancées depuis un pool de threads) ; une étape qui ne peut
+    pas avoir son propre profileur est seulement chronométrée. Les pics mémoire (tracemalloc)
+    sont ceux du processus : approximatifs quand des étapes tournent en parallèle.
+    """
+
+    def __init__(self, job: str, directory: Path):
+        self.job = job
+        self.directory = Path(directory) / f"{job}_{datetime.now():%Y%m%d_%H%M%S}"
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.stages = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        tracemalloc.start()
+
+    @property
+    def _stack(self) -> list:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def enter(self, name: str):
+        if self._stack:
+            # Le parent est suspendu (un seul profileur actif) et garde son pic mémoire
+            parent = self._stack[-1]
+            parent.disable()
+            parent.peak = max(parent.peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        stage = _Stage(name)
+        self._stack.append(stage)
+        stage.enable()
+
+    def exit(self):
+        stage = self._stack.pop()
+        stage.disable()
+        stage.peak = max(stage.peak, tracemalloc.get_traced_memory()[1])
+        self._write(stage)
+        if self._stack:
+            parent = self._stack[-1]
+            parent.peak = max(parent.peak, stage.peak)
+            tracemalloc.reset_peak()
+            parent.enable()
+
+    def _write(self, stage: _Stage):
+        seconds = round(time.perf_counter() - stage.start, 3)
+        with self._lock:
+            index = len(self.stages)
+            self.stages.append({
+                "stage": stage.name,
+                "seconds": seconds,
+                "peak_traced_mb": round(stage.peak / 1024 ** 2, 1),
+                "profiled": stage.profiler is not None,
+            })
+        if stage.profiler is None:
+            return
+        prefix = self.directory / f"{index:02d}_{stage.name}"
+        stage.profiler.dump_stats(f"{prefix}.prof")
+        text = io.StringIO()
+        pstats.Stats(stage.profiler, stream=text).sort_stats("cumulative").print_stats(40)
+        Path(f"{prefix}.txt").write_text(text.getvalue())
+
+    def close(self):
+        while self._stack:
+            self.exit()
+        summary = {"job": self.job, "stages": self.stages}
+        if resource is not None:
+            # ru_maxrss : Ko sous Linux
+            summary["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+        (self.directory / "summary.json").write_text(json.dumps(summary, indent=2))
+        tracemalloc.stop()
+        print(f" Profils écrits dans {self.directory}")
+
+
+def start_profiling(job: str, directory: Path):
+    """Active le profilage du processus ; tout ce qui est hors étape tombe dans l'étape racine `job`."""
+    global _session
+    _session = JobProfile(job, directory)
+    _session.enter(job)
+    atexit.register(stop_profiling)
+
+
+def stop_profiling():
+    global _session
+    if _session is not None:
+        _session.close()
+        _session = None
+
+
+@contextmanager
+def profile_stage(name: str):
+    if _session is None:
+        yield
+        return
+    _session.enter(name)
+    try:
+        yield
+    finally:
+        _session.exit()
+
+
+def profiled(name: str = None):
+    """Décorateur : la fonction est une étape du profil (nom par défaut : celui de la fonction)."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with profile_stage(name or func.__name__):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
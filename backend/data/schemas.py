@@ -1,5 +1,155 @@
-from sqlalchemy import Table, Column, Integer, String, DateTime, MetaData, Float, Boolean, NullPool, create_engine, text
+from sqlalchemy import Table, Column, Integer, BigInteger, String, DateTime, Date, MetaData, Float, Boolean, NullPool, Sequence, UniqueConstraint, Index, create_engine, func, text, tuple_
+from datetime import date
+import os
 import pandas as pd
+from backend.data.profiling import profiled
+
+# Tables de séries temporelles : index (counter_id, datetime) + BRIN sur datetime,
+# et partitionnement mensuel par plage de dates en mode partitionné (DB_PARTITIONED=1)
+TIME_SERIES_TABLES = ("velo_raw", "velo_clean", "model_data")
+
+
+def next_month(first: date) -> date:
+    return date(first.year + first.month // 12, first.month % 12 + 1, 1)
+
+
+def month_starts(start, end) -> list:
+    """Premiers jours des mois couvrant [start, end] (bornes incluses)."""
+    first = date(start.year, start.month, 1)
+    months = []
+    while first <= date(end.year, end.month, 1):
+        months.append(first)
+        first = next_month(first)
+    return months
+
+
+def time_series_indexes(table_name: str) -> list:
+    """
+    Index des tables temporelles :
+    - B-tree (counter_id, datetime) pour /history, /prediction et la jointure des scores
+    - BRIN sur datetime (minuscule, efficace car les lignes arrivent dans l'ordre chronologique)
+    """
+    return [
+        Index(f"ix_{table_name}_counter_datetime", "counter_id", "datetime"),
+        Index(f"brin_{table_name}_datetime", "datetime", postgresql_using="brin"),
+    ]
+
+
+def time_series_index_ddl(table_name: str) -> list:
+    """Mêmes index que time_series_indexes, pour une table existante (migration)."""
+    return [
+        f'CREATE INDEX IF NOT EXISTS "ix_{table_name}_counter_datetime" ON "{table_name}" (counter_id, datetime)',
+        f'CREATE INDEX IF NOT EXISTS "brin_{table_name}_datetime" ON "{table_name}" USING brin (datetime)',
+    ]
+
+# Fenêtre affichée par la carte : réel sur 7 jours, prédictions de J-21 à J+2
+MAP_WINDOW_REAL = "CURRENT_DATE - INTERVAL '7 day'"
+MAP_WINDOW_PRED_START = "CURRENT_DATE - INTERVAL '21 day'"
+MAP_WINDOW_PRED_END = "CURRENT_DATE + INTERVAL '2 day'"
+
+# Upsert des seules clés (compteur, heure) modifiées depuis le dernier rafraîchissement :
+# "si j'ai une valeur réelle, je la prends, SINON la prédiction, sinon 0"
+MAP_SNAPSHOT_UPSERT = f"""
+WITH changed AS (
+    SELECT counter_id, datetime FROM velo_clean
+    WHERE id > :velo_id AND datetime >= {MAP_WINDOW_REAL}
+    UNION
+    SELECT counter_id, datetime FROM model_data
+    WHERE id > :pred_id AND counter_id IS NOT NULL
+      AND datetime >= {MAP_WINDOW_PRED_START} AND datetime < {MAP_WINDOW_PRED_END}
+),
+real AS (
+    SELECT DISTINCT ON (v.counter_id, v.datetime) v.counter_id, v.datetime, v.intensity
+    FROM velo_clean v JOIN changed c ON v.counter_id = c.counter_id AND v.datetime = c.datetime
+    WHERE v.datetime >= {MAP_WINDOW_REAL}
+    ORDER BY v.counter_id, v.datetime, v.id DESC
+),
+pred AS (
+    SELECT DISTINCT ON (m.counter_id, m.datetime) m.counter_id, m.datetime, m.predicted_values
+    FROM model_data m JOIN changed c ON m.counter_id = c.counter_id AND m.datetime = c.datetime
+    WHERE m.datetime >= {MAP_WINDOW_PRED_START} AND m.datetime < {MAP_WINDOW_PRED_END}
+    ORDER BY m.counter_id, m.datetime, m.id DESC
+),
+locs AS (
+    SELECT DISTINCT ON (counter_id) counter_id, lat, lon FROM velo_clean
+    WHERE counter_id IN (SELECT counter_id FROM changed)
+    ORDER BY counter_id, id DESC
+)
+INSERT INTO map_snapshot (counter_id, datetime, value, is_real, lat, lon)
+SELECT c.counter_id, c.datetime,
+       COALESCE(r.intensity, p.predicted_values, 0), r.intensity IS NOT NULL, l.lat, l.lon
+FROM changed c
+LEFT JOIN real r ON r.counter_id = c.counter_id AND r.datetime = c.datetime
+LEFT JOIN pred p ON p.counter_id = c.counter_id AND p.datetime = c.datetime
+LEFT JOIN locs l ON l.counter_id = c.counter_id
+ON CONFLICT (counter_id, datetime) DO UPDATE
+SET value = EXCLUDED.value, is_real = EXCLUDED.is_real, lat = EXCLUDED.lat, lon = EXCLUDED.lon,
+    revision = nextval('map_snapshot_revision_seq')
+WHERE (map_snapshot.value, map_snapshot.is_real, map_snapshot.lat, map_snapshot.lon)
+      IS DISTINCT FROM (EXCLUDED.value, EXCLUDED.is_real, EXCLUDED.lat, EXCLUDED.lon)
+"""
+
+# Révisions du snapshot carte : chaque ligne insérée, modifiée ou supprimée reçoit une révision croissante.
+# Un client (synchro incrémentale) ne redemande que ce qui a changé depuis la dernière révision vue.
+MAP_REVISION_SEQ = Sequence("map_snapshot_revision_seq")
+# Suppressions (tombstones) gardées pour les clients en retard ; au-delà, ils rechargent tout
+MAP_TOMBSTONE_RETENTION = "7 day"
+
+# Reconstruction (changement de jour / full) : on supprime les seules clés sorties de la fenêtre
+# (ou disparues des sources) en gardant une trace, le reste passe par l'upsert ci-dessus
+MAP_SNAPSHOT_PRUNE = f"""
+WITH keys AS (
+    SELECT counter_id, datetime FROM velo_clean WHERE datetime >= {MAP_WINDOW_REAL}
+    UNION
+    SELECT counter_id, datetime FROM model_data
+    WHERE counter_id IS NOT NULL AND datetime >= {MAP_WINDOW_PRED_START} AND datetime < {MAP_WINDOW_PRED_END}
+),
+gone AS (
+    DELETE FROM map_snapshot s
+    WHERE NOT EXISTS (SELECT 1 FROM keys k WHERE k.counter_id = s.counter_id AND k.datetime = s.datetime)
+    RETURNING s.counter_id, s.datetime
+)
+INSERT INTO map_snapshot_deleted (revision, counter_id, datetime)
+SELECT nextval('map_snapshot_revision_seq'), counter_id, datetime FROM gone
+"""
+
+# Bases existantes : colonnes et table de la synchro incrémentale
+MAP_SNAPSHOT_MIGRATION = [
+    "CREATE SEQUENCE IF NOT EXISTS map_snapshot_revision_seq",
+    "ALTER TABLE map_snapshot ADD COLUMN IF NOT EXISTS revision BIGINT NOT NULL DEFAULT nextval('map_snapshot_revision_seq')",
+    "CREATE INDEX IF NOT EXISTS ix_map_snapshot_revision ON map_snapshot (revision)",
+    "ALTER TABLE map_snapshot_state ADD COLUMN IF NOT EXISTS min_revision BIGINT NOT NULL DEFAULT 0",
+    """CREATE TABLE IF NOT EXISTS map_snapshot_deleted (
+        revision BIGINT PRIMARY KEY, counter_id VARCHAR NOT NULL, datetime TIMESTAMP NOT NULL,
+        deleted_at TIMESTAMP NOT NULL DEFAULT now()
+    )""",
+    'ALTER TABLE "public"."map_snapshot_deleted" ENABLE ROW LEVEL SECURITY',
+]
+
+# Statistiques suffisantes des erreurs (par compteur et par jour) des seules paires (réel, prédiction)
+# apparues depuis le dernier calcul : nouvelle ligne réelle OU nouvelle prédiction (ids bornés, sans doublon)
+SCORE_STATS_UPSERT = """
+WITH pairs AS (
+    SELECT v.counter_id, v.datetime, v.intensity AS y, m.predicted_values AS p
+    FROM velo_clean v JOIN model_data m ON v.counter_id = m.counter_id AND v.datetime = m.datetime
+    WHERE v.id > :velo_from AND v.id <= :velo_to AND m.id <= :pred_to
+    UNION ALL
+    SELECT v.counter_id, v.datetime, v.intensity, m.predicted_values
+    FROM model_data m JOIN velo_clean v ON v.counter_id = m.counter_id AND v.datetime = m.datetime
+    WHERE m.id > :pred_from AND m.id <= :pred_to AND v.id <= :velo_from
+)
+INSERT INTO score_stats (counter_id, day, n, sum_abs_err, sum_sq_err, sum_real, sum_sq_real)
+SELECT counter_id, datetime::date, COUNT(*),
+       SUM(ABS(y - p)), SUM((y - p) * (y - p)), SUM(y), SUM(y * y)
+FROM pairs
+GROUP BY 1, 2
+ON CONFLICT (counter_id, day) DO UPDATE
+SET n = score_stats.n + EXCLUDED.n,
+    sum_abs_err = score_stats.sum_abs_err + EXCLUDED.sum_abs_err,
+    sum_sq_err = score_stats.sum_sq_err + EXCLUDED.sum_sq_err,
+    sum_real = score_stats.sum_real + EXCLUDED.sum_real,
+    sum_sq_real = score_stats.sum_sq_real + EXCLUDED.sum_sq_real
+"""
 
 class Database:
 
@@ -15,6 +165,11 @@ class Database:
             return
 
         self._initialized = True
+        self._map_schema_checked = False
+        # Partitionnement connu de chaque table et partitions déjà vérifiées : le schéma ne change pas
+        # en cours de route, un push ne coûte alors aucune requête de plus (vidés par create / drop / migrate)
+        self._partitioned = {}
+        self._partitions = set()
 
         self.metadata = MetaData()
         self.engine = create_engine(database_url, poolclass=NullPool)
@@ -25,7 +180,17 @@ class Database:
         self.meteo_clean = None
         self.model_data = None
 
-    def create_tables(self):
+    def create_tables(self, partitioned: bool = None):
+        """
+        Crée les tables. En mode partitionné (paramètre ou DB_PARTITIONED=1),
+        velo_raw, velo_clean et model_data sont partitionnées par mois sur datetime.
+        """
+        if partitioned is None:
+            partitioned = os.getenv("DB_PARTITIONED") == "1"
+
+        # Une table partitionnée exige la clé de partition dans la clé primaire (id, datetime)
+        def time_series_options():
+            return {"postgresql_partition_by": "RANGE (datetime)"} if partitioned else {}
 
         self.counters = Table(
             "counters",
@@ -40,7 +205,7 @@ class Database:
             "velo_clean",
             self.metadata,
             Column("id", Integer, primary_key=True, autoincrement=True),
-            Column("datetime", DateTime, nullable=False),
+            Column("datetime", DateTime, nullable=False, primary_key=partitioned),
             Column("counter_id", String, nullable=False),
             Column("intensity", Float, nullable=False),
             Column("lat", Float, nullable=True),
@@ -48,19 +213,23 @@ class Database:
             Column("weekday", Integer, nullable=True),
             Column("is_weekend", Boolean, nullable=True),
             Column("hour", Integer, nullable=True),
+            *time_series_indexes("velo_clean"),
+            **time_series_options(),
         )
 
         self.velo_raw = Table(
             "velo_raw",
             self.metadata,
             Column("id", Integer, primary_key=True, autoincrement=True),
-            Column("datetime", DateTime, nullable=False),
+            Column("datetime", DateTime, nullable=False, primary_key=partitioned),
             Column("counter_id", String, nullable=False),
             Column("intensity", Float, nullable=False),
             Column("lat", Float, nullable=True),
             Column("lon", Float, nullable=True),
             Column("laneId", Integer, nullable=True),
             Column("vehicleType", String, nullable=True),
+            *time_series_indexes("velo_raw"),
+            **time_series_options(),
         )
         
 # --- ANCIENNES TABLES (A REMPLACER) ---
@@ -89,13 +258,77 @@ class Database:
             "model_data",
             self.metadata,
             Column("id", Integer, primary_key=True, autoincrement=True),
-            Column("datetime", DateTime, nullable=False),
+            Column("datetime", DateTime, nullable=False, primary_key=partitioned),
             Column("counter_id", String, nullable=True),  # <-- AJOUT ICI
             Column("predicted_values", Float, nullable=False),
+            *time_series_indexes("model_data"),
+            **time_series_options(),
+        )
+
+        # --- SNAPSHOT CARTE (matérialisé, rafraîchi après ingestion / prédiction) ---
+        self.map_snapshot = Table(
+            "map_snapshot",
+            self.metadata,
+            Column("id", Integer, primary_key=True, autoincrement=True),
+            Column("counter_id", String, nullable=False),
+            Column("datetime", DateTime, nullable=False),
+            Column("value", Float, nullable=False),
+            Column("is_real", Boolean, nullable=False),
+            Column("lat", Float, nullable=True),
+            Column("lon", Float, nullable=True),
+            Column("revision", BigInteger, MAP_REVISION_SEQ, server_default=MAP_REVISION_SEQ.next_value(), nullable=False),
+            UniqueConstraint("counter_id", "datetime", name="uq_map_snapshot_counter_datetime"),
+            Index("ix_map_snapshot_datetime", "datetime"),
+            Index("ix_map_snapshot_revision", "revision"),
+        )
+
+        # Clés retirées du snapshot (synchro incrémentale des clients)
+        self.map_snapshot_deleted = Table(
+            "map_snapshot_deleted",
+            self.metadata,
+            Column("revision", BigInteger, primary_key=True, autoincrement=False),
+            Column("counter_id", String, nullable=False),
+            Column("datetime", DateTime, nullable=False),
+            Column("deleted_at", DateTime, nullable=False, server_default=func.now()),
+        )
+
+        self.map_snapshot_state = Table(
+            "map_snapshot_state",
+            self.metadata,
+            Column("id", Integer, primary_key=True),
+            Column("last_velo_id", Integer, nullable=False),
+            Column("last_pred_id", Integer, nullable=False),
+            Column("window_date", Date, nullable=False),
+            # Révision la plus ancienne encore servie en delta (tombstones plus anciens purgés)
+            Column("min_revision", BigInteger, nullable=False, server_default="0"),
+        )
+
+        # --- SCORES DU MODÈLE (statistiques cumulées, mises à jour incrémentalement) ---
+        self.score_stats = Table(
+            "score_stats",
+            self.metadata,
+            Column("id", Integer, primary_key=True, autoincrement=True),
+            Column("counter_id", String, nullable=False),
+            Column("day", Date, nullable=False),
+            Column("n", Integer, nullable=False),
+            Column("sum_abs_err", Float, nullable=False),
+            Column("sum_sq_err", Float, nullable=False),
+            Column("sum_real", Float, nullable=False),
+            Column("sum_sq_real", Float, nullable=False),
+            UniqueConstraint("counter_id", "day", name="uq_score_stats_counter_day"),
+        )
+
+        self.score_state = Table(
+            "score_state",
+            self.metadata,
+            Column("id", Integer, primary_key=True),
+            Column("last_velo_id", Integer, nullable=False),
+            Column("last_pred_id", Integer, nullable=False),
         )
 
 
         self.metadata.create_all(self.engine)
+        self._forget_schema()
 
         with self.engine.begin() as conn:
             for table in [
@@ -104,6 +337,11 @@ class Database:
                 self.meteo_raw,
                 self.meteo_clean,
                 self.model_data,
+                self.map_snapshot,
+                self.map_snapshot_deleted,
+                self.map_snapshot_state,
+                self.score_stats,
+                self.score_state,
             ]:
                 conn.execute(
                     text(
@@ -111,7 +349,177 @@ class Database:
                     )
                 )
 
+        # Base créée avant la synchro incrémentale : create_all ne touche pas aux tables existantes
+        self.ensure_map_snapshot_schema()
+
+        if partitioned:
+            # Partitions du mois précédent aux 3 prochains mois (+ partition par défaut)
+            today = pd.Timestamp.today()
+            for name in TIME_SERIES_TABLES:
+                self.ensure_partitions(name, today - pd.DateOffset(months=1), today + pd.DateOffset(months=3))
+
+    def _forget_schema(self):
+        """Le schéma vient de changer : partitionnement et partitions à relire."""
+        self._partitioned.clear()
+        self._partitions.clear()
+
+    def is_partitioned(self, table_name: str) -> bool:
+        if table_name not in self._partitioned:
+            with self.engine.connect() as conn:
+                self._partitioned[table_name] = bool(conn.execute(text("""
+                    SELECT EXISTS (
+                        SELECT 1 FROM pg_partitioned_table p
+                        JOIN pg_class c ON c.oid = p.partrelid
+                        WHERE c.relname = :name
+                    )
+                """), {"name": table_name}).scalar())
+        return self._partitioned[table_name]
+
+    def ensure_partitions(self, table_name: str, start, end):
+        """
+        Crée (si besoin) les partitions mensuelles couvrant [start, end] et la partition par défaut.
+        Sans effet sur une table non partitionnée. Seules les partitions pas encore vérifiées
+        par ce processus sont cherchées en base (une requête pour toutes).
+        """
+        if not self.is_partitioned(table_name):
+            return
+        wanted = {
+            f"{table_name}_{month:%Y_%m}":
+                f"PARTITION OF \"{table_name}\" FOR VALUES FROM ('{month}') TO ('{next_month(month)}')"
+            for month in month_starts(start, end)
+        }
+        wanted[f"{table_name}_default"] = f"PARTITION OF \"{table_name}\" DEFAULT"
+        unknown = [name for name in wanted if name not in self._partitions]
+        if not unknown:
+            return
+        with self.engine.connect() as conn:
+            existing = set(conn.execute(
+                text("SELECT relname FROM pg_class WHERE relname = ANY(:names)"), {"names": unknown}
+            ).scalars())
+        self._partitions.update(existing)
+        for name in unknown:
+            if name not in existing:
+                self._create_partition(name, wanted[name])
+
+    def _create_partition(self, name: str, clause: str):
+        # Une transaction par partition : un échec (lignes du mois déjà dans la partition
+        # par défaut) n'empêche pas les autres ; le mois reste signalé par migrate-schema
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(text(f'CREATE TABLE IF NOT EXISTS "{name}" {clause}'))
+                conn.execute(text(f'ALTER TABLE "public"."{name}" ENABLE ROW LEVEL SECURITY;'))
+            self._partitions.add(name)
+        except Exception as e:
+            print(f" Erreur : partition {name} non créée, ses lignes restent dans la partition par défaut : {e}")
+
+    def default_partition_months(self, table_name: str) -> list:
+        """Mois dont des lignes sont dans la partition par défaut (partition mensuelle absente)."""
+        if not self.is_partitioned(table_name):
+            return []
+        with self.engine.connect() as conn:
+            return [month.date() for month in conn.execute(text(
+                f'SELECT DISTINCT date_trunc(\'month\', datetime) FROM "{table_name}_default" ORDER BY 1'
+            )).scalars()]
+
+    def migrate_schema(self, partitioned: bool = False, months_ahead: int = 3):
+        """
+        Migre une base existante :
+        - ajoute les index (counter_id, datetime) et BRIN(datetime) manquants
+        - avec `partitioned`, convertit velo_raw / velo_clean / model_data en tables
+          partitionnées par mois (copie des lignes dans une seule transaction par table)
+        - ajoute au snapshot carte les colonnes de la synchro incrémentale (cf. ensure_map_snapshot_schema)
+        Retourne, par table, les mois dont les lignes sont restées dans la partition par défaut.
+        """
+        self.metadata.reflect(self.engine)
+        existing = set(self.metadata.tables)
+        stranded_by_table = {}
+        for name in TIME_SERIES_TABLES:
+            if name not in existing:
+                print(f" Table {name} absente : ignorée.")
+                continue
+            if partitioned and not self.is_partitioned(name):
+                self._partition_table(name, months_ahead)
+
+            with self.engine.begin() as conn:
+                for ddl in time_series_index_ddl(name):
+                    conn.execute(text(ddl))
+                conn.execute(text(f'ANALYZE "{name}"'))
+            print(f" Table {name} migrée.")
+
+            stranded = self.default_partition_months(name)
+            if stranded:
+                stranded_by_table[name] = stranded
+                months = ", ".join(f"{month:%Y-%m}" for month in stranded)
+                print(f" Erreur : {name} a des lignes dans la partition par défaut pour {months}"
+                      " (partition mensuelle non créée : déplacer ces lignes puis relancer).")
+
+        self.ensure_map_snapshot_schema()
+        return stranded_by_table
+
+    def ensure_map_snapshot_schema(self):
+        """
+        Applique MAP_SNAPSHOT_MIGRATION si le snapshot carte existe sans les colonnes de la synchro
+        incrémentale (base antérieure). Vérifié une fois par processus : appelé par create_tables,
+        migrate_schema et avant chaque rafraîchissement, sans étape manuelle au déploiement.
+        """
+        if self._map_schema_checked:
+            return
+        with self.engine.begin() as conn:
+            tables = conn.execute(text(
+                "SELECT to_regclass('public.map_snapshot') IS NOT NULL AND to_regclass('public.map_snapshot_state') IS NOT NULL"
+            )).scalar()
+            found = conn.execute(text("""
+                SELECT COUNT(*) FROM information_schema.columns
+                WHERE table_schema = 'public' AND (table_name, column_name) IN (
+                    ('map_snapshot', 'revision'), ('map_snapshot_state', 'min_revision'), ('map_snapshot_deleted', 'revision')
+                )
+            """)).scalar()
+            if tables and found < 3:
+                for ddl in MAP_SNAPSHOT_MIGRATION:
+                    conn.execute(text(ddl))
+                print(" Snapshot carte migré (révisions, synchro incrémentale).")
+        self._map_schema_checked = True
+
+    def _partition_table(self, name: str, months_ahead: int):
+        legacy = f"{name}_legacy"
+        with self.engine.begin() as conn:
+            bounds = conn.execute(text(f'SELECT MIN(datetime), MAX(datetime) FROM "{name}"')).one()
+            sequence = conn.execute(text("SELECT pg_get_serial_sequence(:name, 'id')"), {"name": name}).scalar()
+
+            conn.execute(text(f'ALTER TABLE "{name}" RENAME TO "{legacy}"'))
+            conn.execute(text(f'ALTER INDEX IF EXISTS "{name}_pkey" RENAME TO "{legacy}_pkey"'))
+
+            conn.execute(text(
+                f'CREATE TABLE "{name}" (LIKE "{legacy}" INCLUDING DEFAULTS) PARTITION BY RANGE (datetime)'
+            ))
+            conn.execute(text(f'ALTER TABLE "{name}" ADD PRIMARY KEY (id, datetime)'))
+            if sequence:
+                conn.execute(text(f'ALTER SEQUENCE {sequence} OWNED BY "{name}".id'))
+
+            today = pd.Timestamp.today()
+            start = bounds[0] or today
+            end = max(pd.Timestamp(bounds[1] or today), today) + pd.DateOffset(months=months_ahead)
+            for month in month_starts(start, end):
+                conn.execute(text(
+                    f'CREATE TABLE "{name}_{month:%Y_%m}" PARTITION OF "{name}"'
+                    f" FOR VALUES FROM ('{month}') TO ('{next_month(month)}')"
+                ))
+                conn.execute(text(f'ALTER TABLE "public"."{name}_{month:%Y_%m}" ENABLE ROW LEVEL SECURITY;'))
+            conn.execute(text(f'CREATE TABLE "{name}_default" PARTITION OF "{name}" DEFAULT'))
+            conn.execute(text(f'ALTER TABLE "public"."{name}_default" ENABLE ROW LEVEL SECURITY;'))
+
+            # Les index sont créés après la copie (par migrate_schema), c'est plus rapide
+            copied = conn.execute(text(f'INSERT INTO "{name}" SELECT * FROM "{legacy}"')).rowcount
+            conn.execute(text(f'DROP TABLE "{legacy}"'))
+            conn.execute(text(f'ALTER TABLE "public"."{name}" ENABLE ROW LEVEL SECURITY;'))
+
+        # Le schéma a changé : les objets Table reflétés sont périmés
+        self.metadata.clear()
+        self._forget_schema()
+        print(f" Table {name} partitionnée par mois ({copied} lignes copiées).")
+
     def drop_tables(self, name: str = None):
+        self._forget_schema()
         if name is None:
             self.metadata.reflect(self.engine)
             self.metadata.drop_all(self.engine)
@@ -120,23 +528,56 @@ class Database:
             table.drop(self.engine, checkfirst=True)
 
     
-    def push_data(self, df: pd.DataFrame, table_name: str):
-        self.metadata.reflect(self.engine)
+    def _table(self, table_name: str) -> Table:
+        """Table réfléchie une seule fois (reflect ne relit de toute façon pas les tables déjà connues)."""
+        if table_name not in self.metadata.tables:
+            self.metadata.reflect(self.engine)
         table = self.metadata.tables.get(table_name)
         if table is None:
             raise ValueError(f"La table '{table_name}' n'existe pas sur Database")
+        return table
+
+    @profiled("db.push_data")
+    def push_data(self, df: pd.DataFrame, table_name: str):
+        table = self._table(table_name)
+
+        self._prepare_partitions(df, table_name)
 
         with self.engine.begin() as conn:
             conn.execute(
                 table.insert(),
                 df.to_dict(orient="records")
             )
-    
+
+    def _prepare_partitions(self, df: pd.DataFrame, table_name: str):
+        # Table partitionnée : on crée d'abord les partitions mensuelles des données poussées
+        if table_name in TIME_SERIES_TABLES and "datetime" in df.columns and not df.empty:
+            dates = pd.to_datetime(df["datetime"])
+            self.ensure_partitions(table_name, dates.min(), dates.max())
+
+    @profiled("db.replace_data")
+    def replace_data(self, df: pd.DataFrame, table_name: str, keys: tuple = ("datetime",)):
+        """
+        Remplace les lignes de `table_name` dont la clé (colonnes `keys`) figure dans `df` : suppression
+        puis insertion, dans une seule transaction (ex. heures de météo corrigées par l'archive,
+        prédictions recalculées par (counter_id, datetime)) : jamais deux lignes pour une même clé.
+        """
+        if df.empty:
+            return
+        table = self._table(table_name)
+        self._prepare_partitions(df, table_name)
+        values = df[list(keys)].drop_duplicates()
+        if len(keys) == 1:
+            condition = table.c[keys[0]].in_(values[keys[0]].tolist())
+        else:
+            condition = tuple_(*(table.c[k] for k in keys)).in_(list(values.itertuples(index=False, name=None)))
+        with self.engine.begin() as conn:
+            conn.execute(table.delete().where(condition))
+            conn.execute(table.insert(), df.to_dict(orient="records"))
+
+    @profiled("db.pull_data")
     def pull_data(self, table_name: str) -> pd.DataFrame:
-        self.metadata.reflect(self.engine)
-        table = self.metadata.tables.get(table_name)
-        if table is None:
-            raise ValueError(f"La table '{table_name}' n'existe pas sur Database")
+        table = self._table(table_name)
 
         with self.engine.begin() as conn:
             result = conn.execute(table.select())
@@ -144,6 +585,98 @@ class Database:
         
         return df
 
+    @profiled("db.refresh_map_snapshot")
+    def refresh_map_snapshot(self, full: bool = False):
+        """
+        Met à jour le snapshot de la carte avec les lignes arrivées depuis le dernier rafraîchissement.
+        Reconstruction complète au changement de jour (la fenêtre glisse) ou si `full=True`.
+        """
+        self.ensure_map_snapshot_schema()
+        with self.engine.begin() as conn:
+            # Un seul rafraîchissement à la fois : les révisions d'une transaction suivent celles déjà visibles
+            # (les lectures de l'API ne sont pas bloquées)
+            conn.execute(text("LOCK TABLE map_snapshot IN EXCLUSIVE MODE"))
+            state = conn.execute(text(
+                "SELECT last_velo_id, last_pred_id, window_date FROM map_snapshot_state WHERE id = 1"
+            )).first()
+            max_velo = conn.execute(text("SELECT COALESCE(MAX(id), 0) FROM velo_clean")).scalar()
+            max_pred = conn.execute(text("SELECT COALESCE(MAX(id), 0) FROM model_data")).scalar()
+            today = conn.execute(text("SELECT CURRENT_DATE")).scalar()
+
+            min_revision = 0
+            if full or state is None or state.window_date != today:
+                # Pas de DELETE global : les lignes inchangées gardent leur révision (delta minimal)
+                conn.execute(text(MAP_SNAPSHOT_PRUNE))
+                pruned = conn.execute(text(
+                    f"DELETE FROM map_snapshot_deleted WHERE deleted_at < now() - INTERVAL '{MAP_TOMBSTONE_RETENTION}'"
+                    " RETURNING revision"
+                )).scalars().all()
+                min_revision = max(pruned, default=0)
+                velo_from, pred_from = 0, 0
+            else:
+                velo_from, pred_from = state.last_velo_id, state.last_pred_id
+
+            result = conn.execute(text(MAP_SNAPSHOT_UPSERT), {"velo_id": velo_from, "pred_id": pred_from})
+            conn.execute(text("""
+                INSERT INTO map_snapshot_state (id, last_velo_id, last_pred_id, window_date, min_revision)
+                VALUES (1, :velo_id, :pred_id, :today, :min_revision)
+                ON CONFLICT (id) DO UPDATE
+                SET last_velo_id = EXCLUDED.last_velo_id,
+                    last_pred_id = EXCLUDED.last_pred_id,
+                    window_date = EXCLUDED.window_date,
+                    min_revision = GREATEST(map_snapshot_state.min_revision, EXCLUDED.min_revision)
+            """), {"velo_id": max_velo, "pred_id": max_pred, "today": today, "min_revision": min_revision})
+
+        print(f" Snapshot carte rafraîchi : {result.rowcount} lignes mises à jour.")
+        return result.rowcount
+
+    def update_score_stats(self, full: bool = False) -> int:
+        """
+        Ajoute aux statistiques des scores les paires (réel, prédiction) apparues depuis le dernier appel.
+        Coût proportionnel aux nouvelles lignes, pas à l'historique. `full=True` : recalcul complet.
+        """
+        with self.engine.begin() as conn:
+            # Un seul calcul à la fois (API, CLI, orchestrateur) : la mise à jour est additive,
+            # deux appels concurrents ajouteraient deux fois les mêmes paires. Verrou libéré au COMMIT.
+            conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('velomag.score_stats'))"))
+            state = conn.execute(text("SELECT last_velo_id, last_pred_id FROM score_state WHERE id = 1")).first()
+            max_velo = conn.execute(text("SELECT COALESCE(MAX(id), 0) FROM velo_clean")).scalar()
+            max_pred = conn.execute(text("SELECT COALESCE(MAX(id), 0) FROM model_data")).scalar()
+
+            if full or state is None:
+                conn.execute(text("DELETE FROM score_stats"))
+                velo_from, pred_from = 0, 0
+            else:
+                velo_from, pred_from = state.last_velo_id, state.last_pred_id
+
+            result = conn.execute(text(SCORE_STATS_UPSERT), {
+                "velo_from": velo_from, "velo_to": max_velo,
+                "pred_from": pred_from, "pred_to": max_pred,
+            })
+            conn.execute(text("""
+                INSERT INTO score_state (id, last_velo_id, last_pred_id)
+                VALUES (1, :velo_id, :pred_id)
+                ON CONFLICT (id) DO UPDATE
+                SET last_velo_id = EXCLUDED.last_velo_id, last_pred_id = EXCLUDED.last_pred_id
+            """), {"velo_id": max_velo, "pred_id": max_pred})
+
+        print(f" Scores mis à jour : {result.rowcount} (compteur, jour) modifiés.")
+        return result.rowcount
+
+    def table_fingerprint(self, table_name: str) -> dict:
+        """
+        Empreinte légère d'une table (nombre de lignes + id max) :
+        si elle ne bouge pas, les données n'ont pas changé depuis le dernier run.
+        """
+        try:
+            with self.engine.connect() as conn:
+                row = conn.execute(
+                    text(f'SELECT COUNT(*) AS n, MAX(id) AS max_id FROM "{table_name}"')
+                ).one()
+        except Exception:
+            return {"table": table_name, "missing": True}
+        return {"table": table_name, "rows": int(row.n), "max_id": row.max_id}
+
            
 
 
@@ -0,0 +1,87 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import joblib
+import pandas as pd
+
+
+def frame_fingerprint(df: pd.DataFrame) -> str:
+    """Empreinte du contenu d'un DataFrame (colonnes + valeurs)."""
+    h = hashlib.sha256()
+    h.update(",".join(map(str, df.columns)).encode())
+    h.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    return h.hexdigest()
+
+
+def file_fingerprint(path) -> str:
+    """Empreinte du contenu d'un fichier (ex : modèle sauvegardé)."""
+    try:
+        return hashlib.sha256(Path(path).read_bytes()).hexdigest()
+    except FileNotFoundError:
+        return "missing"
+
+
+class StageCache:
+    """
+    Cache disque des étapes du pipeline, indexé par l'empreinte de leurs entrées.
+    Si les entrées n'ont pas changé, l'étape est sautée et son résultat relu.
+    Éviction LRU (date d'accès) au-delà de `max_bytes`.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=None, enabled=None):
+        self.cache_dir = Path(cache_dir or os.getenv("STAGE_CACHE_DIR", ".cache/stages"))
+        self.max_bytes = max_bytes or int(float(os.getenv("STAGE_CACHE_MAX_MB", "2048")) * 1024 * 1024)
+        if enabled is None:
+            enabled = os.getenv("STAGE_CACHE", "1") != "0"
+        self.enabled = enabled
+
+    def _key(self, stage: str, inputs: dict) -> str:
+        payload = json.dumps({"stage": stage, "inputs": inputs}, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()[:32]
+
+    def _path(self, stage: str, inputs: dict) -> Path:
+        return self.cache_dir / f"{stage}-{self._key(stage, inputs)}.joblib"
+
+    def get(self, stage: str, inputs: dict):
+        """Retourne le résultat en cache, ou None si l'étape doit être recalculée."""
+        if not self.enabled:
+            return None
+        path = self._path(stage, inputs)
+        if not path.exists():
+            return None
+        try:
+            value = joblib.load(path)
+        except Exception as e:
+            print(f" ⚠ Cache illisible pour '{stage}' : {e}")
+            path.unlink(missing_ok=True)
+            return None
+        os.utime(path)  # LRU : on rafraîchit la date d'accès
+        print(f" ♻ Étape '{stage}' inchangée : résultat relu depuis le cache.")
+        return value
+
+    def put(self, stage: str, inputs: dict, value):
+        if not self.enabled:
+            return value
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        path = self._path(stage, inputs)
+        tmp = path.with_suffix(".tmp")
+        joblib.dump(value, tmp)
+        os.replace(tmp, path)  # écriture atomique
+        self._evict()
+        return value
+
+    def _evict(self):
+        files = sorted(self.cache_dir.glob("*.joblib"), key=lambda p: p.stat().st_mtime)
+        total = sum(p.stat().st_size for p in files)
+        for path in files:
+            if total <= self.max_bytes:
+                break
+            total -= path.stat().st_size
+            path.unlink(missing_ok=True)
+
+    def clear(self, stage: str = None):
+        pattern = f"{stage}-*.joblib" if stage else "*.joblib"
+        for path in self.cache_dir.glob(pattern):
+            path.unlink(missing_ok=True)
@@ -4,9 +4,15 @@ import numpy as np
 import holidays
 from dotenv import load_dotenv
 from backend.data.schemas import Database
+from backend.data.metrics import StageClock
+from backend.data.profiling import profile_stage, profiled
+from backend.data.stage_cache import StageCache
 
 load_dotenv()
 
+# À incrémenter à chaque changement de la pipeline de features (invalide le cache)
+FEATURES_VERSION = "1"
+
 class FeatureEngineering:
     def __init__(self):
         # Configuration de la DB
@@ -18,12 +24,43 @@ class FeatureEngineering:
         
         self.database_url = f"postgresql+psycopg2://{self.user}:{self.password}@{self.host}:{self.port}/{self.dbname}?sslmode=require"
         self.db = Database(self.database_url)
+        self.cache = StageCache()
+
+    def dataset_fingerprint(self) -> dict:
+        """Empreinte des entrées du dataset : tables sources + version du code des features."""
+        return {
+            "velo_clean": self.db.table_fingerprint("velo_clean"),
+            "meteo_clean": self.db.table_fingerprint("meteo_clean"),
+            "features_version": FEATURES_VERSION,
+        }
+
+    def create_dataset(self, use_cache: bool = True):
+        """Dataset final (features), relu depuis le cache si les tables sources n'ont pas bougé."""
+        if not use_cache:
+            return self._build_dataset()
+
+        inputs = self.dataset_fingerprint()
+        df_final = self.cache.get("dataset", inputs)
+        if df_final is None:
+            df_final = self._build_dataset()
+            if not df_final.empty:
+                self.cache.put("dataset", inputs, df_final)
+        return df_final
 
-    def create_dataset(self):
+    def _build_dataset(self):
         print("1️⃣  Chargement des données depuis la DB...")
+        clock = StageClock("features")
         df_velo = self.db.pull_data("velo_clean")
         df_meteo = self.db.pull_data("meteo_clean") # ou meteo_raw selon votre schéma
-        
+        clock.lap("load", df_velo)
+        return self.build_dataset_from(df_velo, df_meteo)
+
+    def build_dataset_from(self, df_velo: pd.DataFrame, df_meteo: pd.DataFrame) -> pd.DataFrame:
+        """Dataset final (features) à partir de velo_clean / meteo_clean déjà en mémoire (sans lecture en base)."""
+        clock = StageClock("features")
+        df_velo = df_velo.copy()
+        df_meteo = df_meteo.copy()
+
         # --- DEBUG : AFFICHER LA TAILLE ---
         print(f"   -> Vélos trouvés : {len(df_velo)} lignes")
         print(f"   -> Météo trouvée : {len(df_meteo)} lignes")
@@ -47,6 +84,7 @@ class FeatureEngineering:
             df_meteo['datetime'] = df_meteo['datetime'].dt.tz_localize(None)
 
         df_merged = pd.merge(df_velo, df_meteo, on='datetime', how='inner')
+        clock.lap("merge", df_merged)
         
         # --- DEBUG : AFFICHER LE RÉSULTAT DU MERGE ---
         print(f"   -> Résultat de la fusion : {len(df_merged)} lignes")
@@ -59,7 +97,8 @@ class FeatureEngineering:
             return pd.DataFrame()
 
         print("3️⃣  Feature Engineering (Création des Lags & Cycles)...")
-        df_final = self._pipeline_feature_engineering_finale(df_merged)
+        with profile_stage("features.pipeline"):
+            df_final = self._pipeline_feature_engineering_finale(df_merged)
         
         return df_final
 
@@ -69,6 +108,7 @@ class FeatureEngineering:
         Gère le ré-échantillonnage, les features cycliques et les lags.
         """
         # 1. Copie de sécurité
+        clock = StageClock("features")
         df = df_input.copy()
         
         # ---------------------------------------------------------
@@ -119,6 +159,7 @@ class FeatureEngineering:
             df_list.append(temp.reset_index())
             
         df = pd.concat(df_list, ignore_index=True)
+        clock.lap("resample", df)
 
         # ---------------------------------------------------------
         # ÉTAPE 2 : FEATURES TEMPORELLES & CYCLIQUES
@@ -137,12 +178,14 @@ class FeatureEngineering:
         df['month_cos'] = np.cos(2 * np.pi * df['month'] / 12)
         df['dow_sin'] = np.sin(2 * np.pi * df['day_of_week'] / 7)
         df['dow_cos'] = np.cos(2 * np.pi * df['day_of_week'] / 7)
+        clock.lap("calendar", df)
 
         # ---------------------------------------------------------
         # ÉTAPE 3 : CALENDRIER (Jours Fériés France)
         # ---------------------------------------------------------
         fr_holidays = holidays.France()
         df['is_holiday'] = df['ds'].apply(lambda x: 1 if x in fr_holidays else 0)
+        clock.lap("holidays", df)
 
         # ---------------------------------------------------------
         # ÉTAPE 4 : LAGS (La Mémoire du Modèle)
@@ -162,6 +205,7 @@ class FeatureEngineering:
         # (Sert à lisser les pics inhabituels)
         grouped = df.groupby('counter_id')['count']
         df['mean_last_4_days'] = grouped.shift(24).rolling(window=4).mean()
+        clock.lap("lags", df)
 
         # ---------------------------------------------------------
         # ÉTAPE 5 : NETTOYAGE FINAL
@@ -171,9 +215,79 @@ class FeatureEngineering:
         
         # Suppression des NaN générés par les lags (les 7 premiers jours de l'historique sont vides)
         df = df.dropna()
+        clock.lap("finalize", df)
         
         return df
 
+def counter_encoding(df: pd.DataFrame) -> dict:
+    """Encodage des compteurs d'un dataset de features : {counter_id: counter_id_encoded}."""
+    pairs = df[['counter_id', 'counter_id_encoded']].drop_duplicates(subset=['counter_id'])
+    return {str(c): int(code) for c, code in pairs.values}
+
+
+def encode_counters(counter_ids, known: dict = None) -> dict:
+    """
+    Codes des compteurs à prédire, à partir de l'encodage `known` sauvegardé avec le modèle.
+    Un compteur apparu après l'entraînement reçoit un code après le dernier connu : les autres ne bougent pas.
+    Sans encodage sauvegardé (ancien modèle) : ordre de tri Python, le même que cat.codes.
+    """
+    counter_ids = sorted(set(counter_ids))
+    if known is None:
+        return {c: i for i, c in enumerate(counter_ids)}
+
+    next_code = max(known.values(), default=-1) + 1
+    encoded = {}
+    for c in counter_ids:
+        if c in known:
+            encoded[c] = known[c]
+        else:
+            encoded[c] = next_code
+            next_code += 1
+    return encoded
+
+# Features du mode DIRECT : toutes connues à l'origine de la prévision (pas de récursion)
+DIRECT_LAG_COLS = ['last_same_hour', 'prev_same_hour', 'last_same_weekday', 'mean_same_hour_4d']
+
+
+def direct_lag_offsets(horizon: int) -> dict:
+    """
+    Décalages (en heures) des features directes pour un horizon de `horizon` jours.
+    Ils pointent toujours sur des heures connues à l'origine (J0).
+    """
+    weeks = -(-horizon // 7)  # arrondi supérieur
+    return {
+        'last_same_hour': [24 * horizon],
+        'prev_same_hour': [24 * (horizon + 1)],
+        'last_same_weekday': [168 * weeks],
+        'mean_same_hour_4d': [24 * (horizon + j) for j in range(4)],
+    }
+
+
+@profiled("features.direct")
+def build_direct_dataset(df: pd.DataFrame, max_horizon: int = 7) -> pd.DataFrame:
+    """
+    Empile le jeu d'entraînement pour chaque horizon 1..max_horizon (horizon = feature).
+    `df` est la sortie de `_pipeline_feature_engineering_finale` (grille horaire par compteur).
+    """
+    df = df.sort_values(['counter_id', 'ds'])
+    grouped = df.groupby('counter_id')['count']
+    shifted = {}
+
+    def shift(hours):
+        if hours not in shifted:
+            shifted[hours] = grouped.shift(hours)
+        return shifted[hours]
+
+    df_list = []
+    for horizon in range(1, max_horizon + 1):
+        temp = df.copy()
+        temp['horizon'] = horizon
+        for col, offsets in direct_lag_offsets(horizon).items():
+            temp[col] = sum(shift(h) for h in offsets) / len(offsets)
+        df_list.append(temp.dropna(subset=DIRECT_LAG_COLS))
+
+    return pd.concat(df_list, ignore_index=True)
+
 # --- Bloc de test ---
 if __name__ == "__main__":
     fe = FeatureEngineering()
@@ -1,35 +1,211 @@
+import json
 import pandas as pd
 import numpy as np
 import xgboost as xgb
 import joblib
 import requests
 import holidays
+import typer
 from datetime import datetime, timedelta
 from backend.data.schemas import Database
-from backend.modeling.features import FeatureEngineering
+from backend.data.fetch_data import METEO_ARCHIVE_URL, METEO_FORECAST_URL
+from backend.modeling.features import FeatureEngineering, DIRECT_LAG_COLS, counter_encoding, direct_lag_offsets, encode_counters
+from backend.modeling.sharding import ShardedModel
+from backend.data.stage_cache import file_fingerprint
+from backend.data.metrics import PREDICTION_STEP_SECONDS, export_on_exit
+from backend.data.profiling import profiled, start_profiling
 from pathlib import Path
 
+# Décalages (en heures) utilisés comme "mémoire" par le modèle
+LAG_HOURS = [24, 48, 168, 336, 504]
+
+# Calendrier partagé (les années sont calculées une seule fois puis gardées en cache)
+FR_HOLIDAYS = holidays.France()
+
+
+def calendar_feature_arrays(ds: pd.DatetimeIndex) -> dict:
+    """Features calendaires et cycliques (tableaux numpy) pour une série d'horodatages."""
+    hour = ds.hour.to_numpy()
+    day_of_week = ds.dayofweek.to_numpy()
+    month = ds.month.to_numpy()
+
+    # Jours fériés : un seul test par jour distinct (et non par ligne)
+    days = ds.normalize()
+    holiday_days = [d for d in days.unique() if d in FR_HOLIDAYS]
+
+    return {
+        'hour': hour,
+        'day_of_week': day_of_week,
+        'month': month,
+        'is_weekend': (day_of_week >= 5).astype(int),
+        'is_holiday': days.isin(holiday_days).astype(int),
+        'hour_sin': np.sin(2 * np.pi * hour / 24),
+        'hour_cos': np.cos(2 * np.pi * hour / 24),
+        'month_sin': np.sin(2 * np.pi * month / 12),
+        'month_cos': np.cos(2 * np.pi * month / 12),
+        'dow_sin': np.sin(2 * np.pi * day_of_week / 7),
+        'dow_cos': np.cos(2 * np.pi * day_of_week / 7),
+    }
+
+
+def lag_feature_arrays(counter_ids: list, ds: pd.DatetimeIndex, memory) -> dict:
+    """
+    Lags lus dans `memory` ({(counter_id, ds): count}), 0 si inconnus.
+    `counter_ids` et `ds` sont alignés ligne à ligne.
+    """
+    cols = {}
+    for hours in LAG_HOURS:
+        targets = (ds - timedelta(hours=hours)).tolist()
+        cols[f'lag_{hours}h'] = np.array([memory.get(k, 0) for k in zip(counter_ids, targets)], dtype=float)
+    cols['mean_last_4_days'] = (cols['lag_24h'] + cols['lag_48h']) / 2
+    return cols
+
+
+def add_calendar_features(df: pd.DataFrame) -> pd.DataFrame:
+    """Ajoute les features calendaires et cycliques à partir de la colonne 'ds'."""
+    cols = calendar_feature_arrays(pd.DatetimeIndex(df['ds']))
+    # Toutes les colonnes sont ajoutées d'un coup (bien plus rapide que colonne par colonne)
+    df = df.drop(columns=[c for c in cols if c in df.columns])
+    return pd.concat([df, pd.DataFrame(cols, index=df.index)], axis=1)
+
+
+def build_day_features(df_weather: pd.DataFrame, encoded_ids: dict, memory) -> pd.DataFrame:
+    """
+    Construit la grille (compteur x heure) à prédire à partir de la météo de la journée.
+    Les lags sont lus dans `memory` ({(counter_id, ds): count}), 0 si inconnus.
+    """
+    counters = list(encoded_ids)
+    if not counters or df_weather.empty:
+        return pd.DataFrame()
+
+    n_hours = len(df_weather)
+    df_day = df_weather.iloc[np.tile(np.arange(n_hours), len(counters))].reset_index(drop=True)
+    keys_counter = np.repeat(counters, n_hours).tolist()
+    ds = pd.DatetimeIndex(df_day['ds'])
+
+    cols = {
+        'counter_id': keys_counter,
+        'counter_id_encoded': np.repeat([encoded_ids[c] for c in counters], n_hours),
+        **lag_feature_arrays(keys_counter, ds, memory),
+        **calendar_feature_arrays(ds),
+    }
+    df_day = df_day.drop(columns=[c for c in cols if c in df_day.columns])
+    return pd.concat([df_day, pd.DataFrame(cols, index=df_day.index)], axis=1)
+
+
+@profiled("predict.direct_features")
+def build_direct_features(df_weather: pd.DataFrame, encoded_ids: dict, memory, origin, max_horizon: int = None) -> pd.DataFrame:
+    """
+    Grille (compteur x heure) sur plusieurs jours pour le mode DIRECT.
+    L'horizon est le nombre de jours depuis `origin` ; les lags ne lisent que des heures connues à l'origine.
+    """
+    counters = list(encoded_ids)
+    if not counters or df_weather.empty:
+        return pd.DataFrame()
+
+    n_hours = len(df_weather)
+    df_grid = df_weather.iloc[np.tile(np.arange(n_hours), len(counters))].reset_index(drop=True)
+    keys_counter = np.repeat(counters, n_hours).tolist()
+    ds = pd.DatetimeIndex(df_grid['ds'])
+    horizon = (ds.normalize() - origin).days.to_numpy()
+
+    cols = {c: np.zeros(len(ds)) for c in DIRECT_LAG_COLS}
+    # Un passage vectorisé par horizon (les décalages dépendent de l'horizon)
+    for h in np.unique(horizon):
+        idx = np.flatnonzero(horizon == h)
+        ids_h = [keys_counter[i] for i in idx]
+        ds_h = ds[idx]
+        for col, offsets in direct_lag_offsets(int(h)).items():
+            values = [
+                [memory.get(k, 0) for k in zip(ids_h, (ds_h - timedelta(hours=o)).tolist())]
+                for o in offsets
+            ]
+            cols[col][idx] = np.mean(values, axis=0)
+
+    cols = {
+        'counter_id': keys_counter,
+        'counter_id_encoded': np.repeat([encoded_ids[c] for c in counters], n_hours),
+        # Au-delà de l'horizon appris, on garde le dernier horizon connu du modèle
+        'horizon': np.minimum(horizon, max_horizon) if max_horizon else horizon,
+        **cols,
+        **calendar_feature_arrays(ds),
+    }
+    df_grid = df_grid.drop(columns=[c for c in cols if c in df_grid.columns])
+    return pd.concat([df_grid, pd.DataFrame(cols, index=df_grid.index)], axis=1)
+
+
+def model_feature_names(model) -> list:
+    """Colonnes attendues par le modèle (global XGBoost ou modèle par cluster)."""
+    if isinstance(model, ShardedModel):
+        return model.feature_names
+    return model.get_booster().feature_names
+
+
+# Attribut du booster XGBoost qui porte l'encodage des compteurs vu à l'entraînement
+COUNTER_ENCODING_ATTR = 'counter_ids'
+
+
+def model_counter_encoding(model):
+    """Encodage des compteurs sauvegardé avec le modèle ({counter_id: code}), None pour un ancien modèle."""
+    if isinstance(model, ShardedModel):
+        return getattr(model, 'counter_ids', None)
+    raw = model.get_booster().attr(COUNTER_ENCODING_ATTR)
+    return json.loads(raw) if raw else None
+
+
+def history_encoding(df_history: pd.DataFrame, model) -> dict:
+    """
+    Codes des compteurs de l'historique : ceux de l'entraînement (sauvegardés avec le modèle),
+    sinon (ancien modèle) ceux du dataset courant.
+    """
+    known = model_counter_encoding(model)
+    if known is None:
+        print(" ⚠ Modèle sans encodage des compteurs : codes recalculés sur l'historique (ré-entraîner le modèle)")
+        return counter_encoding(df_history)
+    return encode_counters(df_history['counter_id'].unique(), known)
+
+
+def predict_counts(model, df_day: pd.DataFrame, model_cols) -> list:
+    """Prédit les passages (entiers positifs) dans l'ordre des colonnes du modèle."""
+    for col in model_cols:
+        if col not in df_day.columns: df_day[col] = 0
+
+    preds = model.predict(df_day[model_cols])
+    return [max(0, int(x)) for x in preds]
+
+
 class Predictor:
     def __init__(self):
         # Chemin absolu dynamique
         current_dir = Path(__file__).resolve().parent
         self.model_path = current_dir.parent / "model" / "model_velo.pkl"
+        self.direct_model_path = current_dir.parent / "model" / "model_velo_direct.pkl"
+        self.sharded_model_path = current_dir.parent / "model" / "model_velo_sharded.pkl"
         print(f" Chemin du modèle défini sur : {self.model_path}")
         
         # Jusqu'à quand prédire ? (Demain réel)
         self.real_tomorrow = datetime.now().date() + timedelta(days=1)
+
+        # Open-Meteo (surchargeable : METEO_ARCHIVE_URL / METEO_FORECAST_URL)
+        self.meteo_archive_url = METEO_ARCHIVE_URL
+        self.meteo_forecast_url = METEO_FORECAST_URL
         
-    def get_weather_data(self, date_target) -> pd.DataFrame:
-        """Récupère météo Archive (Passé) ou Forecast (Futur)"""
-        is_past = date_target.date() < datetime.now().date()
+    def get_weather_data(self, date_target, end_target=None) -> pd.DataFrame:
+        """
+        Récupère météo Archive (Passé) ou Forecast (Futur), pour une journée
+        ou, avec `end_target`, pour toute la plage [date_target, end_target] en un seul appel.
+        Une plage qui atteint aujourd'hui passe entièrement par Forecast (qui accepte des dates passées).
+        """
+        end_target = end_target or date_target
+        is_past = end_target.date() < datetime.now().date()
         
-        url = "https://archive-api.open-meteo.com/v1/era5" if is_past else "https://api.open-meteo.com/v1/forecast"
+        url = self.meteo_archive_url if is_past else self.meteo_forecast_url
         
         params = {
             "latitude": 43.6108, "longitude": 3.8767,
             "hourly": "temperature_2m,wind_speed_10m,precipitation",
             "start_date": date_target.strftime("%Y-%m-%d"),
-            "end_date": date_target.strftime("%Y-%m-%d")
+            "end_date": end_target.strftime("%Y-%m-%d")
         }
         if not is_past: params["timezone"] = "UTC"
 
@@ -40,16 +216,89 @@ class Predictor:
             df['ds'] = pd.to_datetime(df['time'])
             return df
         except:
-            dates = pd.date_range(start=date_target, periods=24, freq='h')
+            n_days = (end_target.date() - date_target.date()).days + 1
+            dates = pd.date_range(start=date_target, periods=24 * n_days, freq='h')
             return pd.DataFrame({'ds': dates, 'temperature_2m': 12, 'wind_speed_10m': 10, 'precipitation': 0})
 
-    def run_recursive_prediction(self):
+    @profiled("predict.day")
+    def predict_day(self, model, model_cols, current_target_date, encoded_ids, memory) -> pd.DataFrame:
+        """
+        Une étape de la récursion : prédit les 24h d'une journée pour tous les compteurs
+        et réinjecte les prédictions dans la mémoire (pour les lags du jour suivant).
+        """
+        with PREDICTION_STEP_SECONDS.labels(step="weather").time():
+            df_weather = self.get_weather_data(current_target_date)
+
+        with PREDICTION_STEP_SECONDS.labels(step="features").time():
+            df_day = build_day_features(df_weather, encoded_ids, memory)
+        if df_day.empty:
+            return pd.DataFrame()
+
+        with PREDICTION_STEP_SECONDS.labels(step="predict").time():
+            df_day['predicted_values'] = predict_counts(model, df_day, model_cols)
+
+        # Mise à jour Mémoire
+        with PREDICTION_STEP_SECONDS.labels(step="memory").time():
+            memory.update(zip(zip(df_day['counter_id'], df_day['ds']), df_day['predicted_values']))
+
+        return df_day[['ds', 'counter_id', 'predicted_values']].rename(columns={'ds': 'datetime'})
+
+    def _refresh_map_snapshot(self, fe):
+        """Les nouvelles prédictions sont reportées dans le snapshot de la carte."""
+        try:
+            fe.db.refresh_map_snapshot()
+        except Exception as e:
+            print(f" ⚠ Snapshot carte non rafraîchi : {e}")
+
+    def _prediction_fingerprint(self, fe, mode: str, model_path) -> dict:
+        """Mêmes données, même modèle, même objectif -> les prédictions sont déjà en base."""
+        return {
+            **fe.dataset_fingerprint(), "mode": mode,
+            "model": file_fingerprint(model_path), "target": str(self.real_tomorrow),
+        }
+
+    def run_recursive_prediction(self, use_cache: bool = True):
         print(f" Démarrage du mode RÉCURSIF HYBRIDE...")
         print(f" Objectif : Atteindre le {self.real_tomorrow}")
 
-        # 1. Chargement Historique
         fe = FeatureEngineering()
-        df_history = fe.create_dataset()
+        if use_cache:
+            inputs = self._prediction_fingerprint(fe, "recursive", self.model_path)
+            if fe.cache.get("prediction", inputs) is not None:
+                return
+
+        # 1. Chargement Historique
+        df_history = fe.create_dataset(use_cache)
+
+        # 2. Chargement Modèle
+        try:
+            model = joblib.load(self.model_path)
+            model_cols = model_feature_names(model)
+        except Exception as e:
+            print(f" Erreur Modèle : {e}"); return
+
+        # === BOUCLE ===
+        push_failed = False
+        for _, df_export in self.forecast_recursive(df_history, model, model_cols):
+            try:
+                # On pousse datetime, counter_id, predicted_values, lat, lon
+                with PREDICTION_STEP_SECONDS.labels(step="push").time():
+                    fe.db.push_data(df_export, "model_data")
+            except Exception as e:
+                print(f" Erreur BDD : {e}")
+                push_failed = True
+
+        self._refresh_map_snapshot(fe)
+        if use_cache and not push_failed:
+            fe.cache.put("prediction", inputs, {"target": str(self.real_tomorrow)})
+        print(" Terminé ! Prédictions (avec GPS) envoyées.")
+
+    def forecast_recursive(self, df_history, model, model_cols, encoded_ids: dict = None):
+        """
+        Récursion jour par jour, du lendemain de la dernière heure connue jusqu'à demain (réel).
+        Génère (jour, prédictions) avec datetime, counter_id, predicted_values, lat, lon.
+        `encoded_ids` : codes des compteurs (défaut : l'encodage sauvegardé avec le modèle, cf. history_encoding).
+        """
         df_history = df_history.sort_values(['counter_id', 'ds'])
 
         # --- AJOUT : Préparation des coordonnées ---
@@ -66,95 +315,104 @@ class Predictor:
         current_target_date = last_known_date + timedelta(days=1)
         current_target_date = current_target_date.replace(hour=0, minute=0, second=0, microsecond=0)
 
-        # 3. Chargement Modèle
-        try:
-            model = joblib.load(self.model_path)
-            model_cols = model.get_booster().feature_names
-        except Exception as e:
-            print(f" Erreur Modèle : {e}"); return
+        # Identifiants encodés (identiques à ceux vus à l'entraînement)
+        if encoded_ids is None:
+            encoded_ids = history_encoding(df_history, model)
 
-        # === BOUCLE ===
         while current_target_date.date() <= self.real_tomorrow:
             print(f" Calcul pour le : {current_target_date.date()} ...")
-            
-            df_weather = self.get_weather_data(current_target_date)
-            
-            counters = df_history['counter_id'].unique()
-            unique_encoded = df_history[['counter_id', 'counter_id_encoded']].drop_duplicates()
-            
-            day_rows = []
-            
-            for counter in counters:
-                if unique_encoded[unique_encoded['counter_id'] == counter].empty: continue
-                encoded_id = unique_encoded[unique_encoded['counter_id'] == counter]['counter_id_encoded'].values[0]
-                
-                temp_df = df_weather.copy()
-                temp_df['counter_id'] = counter
-                temp_df['counter_id_encoded'] = encoded_id
-                
-                # Récupération Lags
-                def get_lag(row, hours):
-                    target = row['ds'] - timedelta(hours=hours)
-                    return memory.get((counter, target), 0)
-
-                temp_df['lag_24h'] = temp_df.apply(lambda r: get_lag(r, 24), axis=1)
-                temp_df['lag_48h'] = temp_df.apply(lambda r: get_lag(r, 48), axis=1)
-                temp_df['lag_168h'] = temp_df.apply(lambda r: get_lag(r, 168), axis=1)
-                temp_df['lag_336h'] = temp_df.apply(lambda r: get_lag(r, 336), axis=1)
-                temp_df['lag_504h'] = temp_df.apply(lambda r: get_lag(r, 504), axis=1)
-                temp_df['mean_last_4_days'] = (temp_df['lag_24h'] + temp_df['lag_48h']) / 2
-
-                day_rows.append(temp_df)
-            
-            if not day_rows:
+
+            df_export = self.predict_day(model, model_cols, current_target_date, encoded_ids, memory)
+            if df_export.empty:
                 current_target_date += timedelta(days=1)
                 continue
 
-            df_day = pd.concat(day_rows, ignore_index=True)
-            
-            # Features
-            df_day['hour'] = df_day['ds'].dt.hour
-            df_day['day_of_week'] = df_day['ds'].dt.dayofweek
-            df_day['month'] = df_day['ds'].dt.month
-            df_day['is_weekend'] = df_day['day_of_week'].isin([5, 6]).astype(int)
-            fr_holidays = holidays.France()
-            df_day['is_holiday'] = df_day['ds'].apply(lambda x: 1 if x in fr_holidays else 0)
-            
-            df_day['hour_sin'] = np.sin(2 * np.pi * df_day['hour'] / 24)
-            df_day['hour_cos'] = np.cos(2 * np.pi * df_day['hour'] / 24)
-            df_day['month_sin'] = np.sin(2 * np.pi * df_day['month'] / 12)
-            df_day['month_cos'] = np.cos(2 * np.pi * df_day['month'] / 12)
-            df_day['dow_sin'] = np.sin(2 * np.pi * df_day['day_of_week'] / 7)
-            df_day['dow_cos'] = np.cos(2 * np.pi * df_day['day_of_week'] / 7)
-
-            # Prédiction
-            for col in model_cols:
-                if col not in df_day.columns: df_day[col] = 0
-            
-            preds = model.predict(df_day[model_cols])
-            preds = [max(0, int(x)) for x in preds]
-            
-            # Mise à jour Mémoire
-            df_day['predicted_values'] = preds
-            for _, row in df_day.iterrows():
-                memory[(row['counter_id'], row['ds'])] = row['predicted_values']
-            
-            # --- Sauvegarde BDD CORRIGÉE ---
-            df_export = df_day[['ds', 'counter_id', 'predicted_values']].rename(columns={'ds': 'datetime'})
-            
             #  FUSION AVEC LES COORDONNÉES 
-            df_export = df_export.merge(coords_ref, on='counter_id', how='left')
-            
-            try:
-                # On pousse datetime, counter_id, predicted_values, lat, lon
-                fe.db.push_data(df_export, "model_data")
-            except Exception as e:
-                print(f" Erreur BDD : {e}")
+            yield current_target_date, df_export.merge(coords_ref, on='counter_id', how='left')
 
             current_target_date += timedelta(days=1)
 
-        print(" Terminé ! Prédictions (avec GPS) envoyées.")
+    def run_direct_prediction(self, use_cache: bool = True):
+        """
+        Mode DIRECT multi-horizon : J+1..J+k calculés en un seul appel au modèle,
+        à partir de features toutes connues à l'origine (pas d'erreurs qui se cumulent).
+        """
+        print(f" Démarrage du mode DIRECT multi-horizon...")
+        print(f" Objectif : Atteindre le {self.real_tomorrow}")
 
-if __name__ == "__main__":
+        fe = FeatureEngineering()
+        if use_cache:
+            inputs = self._prediction_fingerprint(fe, "direct", self.direct_model_path)
+            if fe.cache.get("prediction", inputs) is not None:
+                return
+
+        # 1. Chargement Historique
+        df_history = fe.create_dataset(use_cache)
+        if df_history.empty:
+            return
+        df_history = df_history.sort_values(['counter_id', 'ds'])
+
+        coords_ref = df_history[['counter_id', 'lat', 'lon']].drop_duplicates(subset=['counter_id'], keep='last')
+        memory = df_history.set_index(['counter_id', 'ds'])['count'].to_dict()
+
+        # 2. Horizon : du lendemain de l'origine jusqu'à demain (réel)
+        origin = df_history['ds'].max().normalize()
+        days = pd.date_range(origin + timedelta(days=1), pd.Timestamp(self.real_tomorrow), freq='D')
+        if days.empty:
+            print(" Rien à prédire : les prédictions sont à jour.")
+            return
+
+        # 3. Chargement Modèle
+        try:
+            model = joblib.load(self.direct_model_path)
+            model_cols = model.get_booster().feature_names
+            max_horizon = int(model.get_booster().attr('max_horizon') or 7)
+        except Exception as e:
+            print(f" Erreur Modèle : {e}"); return
+
+        if len(days) > max_horizon:
+            print(f" ⚠ {len(days)} jours à rattraper (horizon appris : {max_horizon} jours)")
+        encoded_ids = history_encoding(df_history, model)
+
+        # 4. Une seule requête météo, une seule grille, un seul appel au modèle
+        df_weather = self.get_weather_data(days[0], days[-1])
+        df_grid = build_direct_features(df_weather, encoded_ids, memory, origin, max_horizon)
+        df_grid['predicted_values'] = predict_counts(model, df_grid, model_cols)
+
+        df_export = df_grid[['ds', 'counter_id', 'predicted_values']].rename(columns={'ds': 'datetime'})
+        df_export = df_export.merge(coords_ref, on='counter_id', how='left')
+
+        try:
+            fe.db.push_data(df_export, "model_data")
+        except Exception as e:
+            print(f" Erreur BDD : {e}")
+            return
+
+        self._refresh_map_snapshot(fe)
+        if use_cache:
+            fe.cache.put("prediction", inputs, {"target": str(self.real_tomorrow)})
+        print(f" Terminé ! {len(days)} jour(s) prédits en un seul appel.")
+
+
+def main(
+    direct: bool = typer.Option(False, help="Mode direct multi-horizon (au lieu du récursif jour par jour)"),
+    sharded: bool = typer.Option(False, help="Utilise les modèles par cluster (train --sharded)"),
+    cache: bool = typer.Option(True, help="Saute la prédiction si données et modèle n'ont pas changé"),
+    profile: Path = typer.Option(None, help="Écrit un profil par étape (cProfile + pic mémoire) dans ce dossier"),
+):
+    if sharded and direct:
+        # Pas de modèle direct par cluster : on refuse plutôt que d'ignorer une des options
+        raise typer.BadParameter("--sharded et --direct ne peuvent pas être combinés")
+    export_on_exit("predict")
+    if profile:
+        start_profiling("predict", profile)
     p = Predictor()
-    p.run_recursive_prediction()
\ No newline at end of file
+    if sharded:
+        p.model_path = p.sharded_model_path
+    if direct:
+        p.run_direct_prediction(use_cache=cache)
+    else:
+        p.run_recursive_prediction(use_cache=cache)
+
+if __name__ == "__main__":
+    typer.run(main)
\ No newline at end of file
@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+
+
+def cluster_counters(df: pd.DataFrame, n_clusters: int = 4) -> dict:
+    """
+    Regroupe les compteurs par similarité de profil de trafic.
+    Profil = moyenne par (jour de semaine, heure), normalisée pour comparer la forme et non le volume.
+    Retourne {counter_id_encoded: numéro de cluster}.
+    """
+    profile = df.pivot_table(
+        index='counter_id_encoded', columns=['day_of_week', 'hour'],
+        values='count', aggfunc='mean'
+    ).fillna(0)
+    profile = profile.div(profile.sum(axis=1).replace(0, 1), axis=0)
+
+    # Import différé : le chargement d'un modèle par cluster (API) n'a pas besoin de scikit-learn
+    from sklearn.cluster import KMeans
+
+    n_clusters = max(1, min(n_clusters, len(profile)))
+    labels = KMeans(n_clusters=n_clusters, n_init=10, random_state=42).fit_predict(profile.values)
+    return {int(c): int(label) for c, label in zip(profile.index, labels)}
+
+
+class ShardedModel:
+    """
+    Un modèle XGBoost par cluster de compteurs.
+    `predict` route chaque ligne vers le modèle de son cluster via `counter_id_encoded`.
+    `counter_ids` : encodage des compteurs vu à l'entraînement ({counter_id: code}).
+    """
+
+    def __init__(self, routing: dict, models: dict, feature_names: list, counter_ids: dict = None):
+        self.routing = routing
+        self.models = models
+        self.feature_names = list(feature_names)
+        self.counter_ids = counter_ids
+
+        # Compteur inconnu -> cluster le plus peuplé
+        sizes = pd.Series(list(routing.values())).value_counts()
+        self.default_shard = int(sizes.index[0]) if not sizes.empty else next(iter(models))
+
+    def predict(self, X: pd.DataFrame) -> np.ndarray:
+        shards = X['counter_id_encoded'].map(self.routing).fillna(self.default_shard).astype(int).to_numpy()
+        preds = np.zeros(len(X))
+        for shard in np.unique(shards):
+            mask = shards == shard
+            model = self.models.get(shard, self.models[self.default_shard])
+            preds[mask] = model.predict(X.loc[mask, self.feature_names])
+        return preds
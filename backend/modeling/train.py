@@ -1,42 +1,68 @@
+import json
+import os
 import pandas as pd
 import xgboost as xgb
 import joblib
+import typer
+from concurrent.futures import ProcessPoolExecutor
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import mean_absolute_error, r2_score
-from backend.modeling.features import FeatureEngineering
+from backend.modeling.features import FeatureEngineering, DIRECT_LAG_COLS, build_direct_dataset, counter_encoding
+from backend.modeling.sharding import ShardedModel, cluster_counters
+from backend.modeling.predict_next_day import COUNTER_ENCODING_ATTR
+from backend.data.metrics import export_on_exit
+from backend.data.profiling import profiled, start_profiling
+from pathlib import Path
 
-def train_model():
-    print(" Démarrage de l'entraînement (Split Temporel)...")
+BASE_FEATURES = [
+    'counter_id_encoded', 'hour_sin', 'hour_cos', 
+    'month_sin', 'month_cos', 'dow_sin', 'dow_cos',
+    'is_weekend', 'is_holiday',
+    'temperature_2m', 'wind_speed_10m', 'precipitation',
+]
 
-    # --- 1. Chargement & Pipeline ---
-    fe = FeatureEngineering()
-    df = fe.create_dataset()
+XGB_PARAMS = dict(
+    n_estimators=1000, 
+    learning_rate=0.05,
+    subsample=0.9,
+    colsample_bytree=0.8, 
+    max_depth=8, 
+    random_state=42, 
+    n_jobs=-1
+)
+
+# Modèles par cluster : plus petits, chacun ne voit que des profils de trafic proches
+SHARD_PARAMS = {**XGB_PARAMS, 'n_estimators': 400}
+
+# À incrémenter quand le contenu sauvegardé avec le modèle change (2 : encodage des compteurs)
+MODEL_FORMAT = 2
+
+def save_counter_encoding(model, df: pd.DataFrame):
+    """
+    Sauvegarde avec le modèle l'encodage des compteurs de son dataset (cat.codes) :
+    la prédiction réutilise exactement ces codes, même si la liste des compteurs a changé depuis.
+    """
+    model.get_booster().set_attr(**{COUNTER_ENCODING_ATTR: json.dumps(counter_encoding(df))})
+
+@profiled("train.fit")
+def fit_xgb(df: pd.DataFrame, features_cols: list, target_col: str = 'count', params: dict = None):
+    """Split temporel 80/20, entraînement XGBoost et évaluation. Retourne le modèle (ou None)."""
 
     # --- ÉTAPE CRUCIALE POUR LE TEMPOREL ---
     # On trie impérativement par date pour que le split coupe le "passé" du "futur"
     print(" Tri des données par ordre chronologique...")
     df = df.sort_values(by=['ds', 'counter_id'])
 
-    # --- 2. Sélection des Features ---
-    features_cols = [
-        'counter_id_encoded', 'hour_sin', 'hour_cos', 
-        'month_sin', 'month_cos', 'dow_sin', 'dow_cos',
-        'is_weekend', 'is_holiday',
-        'temperature_2m', 'wind_speed_10m', 'precipitation',
-        'lag_24h', 'lag_48h', 'lag_168h', 'mean_last_4_days'
-    ]
-    target_col = 'count'
-
     # Vérification colonnes
     missing = [c for c in features_cols if c not in df.columns]
     if missing:
         print(f" Erreur : Colonnes manquantes : {missing}")
-        return
+        return None
 
     X = df[features_cols]
     y = df[target_col]
 
-    # --- 3. Séparation Train / Test (TEMPORELLE) ---
+    # --- Séparation Train / Test (TEMPORELLE) ---
     # shuffle=False : On prend les 80% premiers jours pour Train, 
     # et les 20% derniers jours pour Test.
     print("  Séparation Temporelle (Train sur le passé / Test sur le futur récent)...")
@@ -54,20 +80,12 @@ def train_model():
     print(f"   -> Fin de l'entraînement : {last_train_date}")
     print(f"   -> Début du test : {first_test_date}")
 
-    # --- 4. Entraînement ---
+    # --- Entraînement ---
     print(" Entraînement du modèle XGBoost...")
-    model = xgb.XGBRegressor(
-        n_estimators=1000, 
-        learning_rate=0.05,
-        subsample=0.9,
-        colsample_bytree=0.8, 
-        max_depth=8, 
-        random_state=42, 
-        n_jobs=-1
-    )
+    model = xgb.XGBRegressor(**(params or XGB_PARAMS))
     model.fit(X_train, y_train)
 
-    # --- 5. Évaluation ---
+    # --- Évaluation ---
     print(" Prédiction sur les données récentes...")
     predictions = model.predict(X_test)
     predictions = [max(0, x) for x in predictions]
@@ -78,12 +96,35 @@ def train_model():
     print(f"\n RÉSULTATS (Sur données jamais vues) :")
     print(f"   - MAE : {mae:.2f}")
     print(f"   - R2 Score : {r2:.4f}")
+    return model
 
-    # --- 6. Sauvegarde Modèle ---
+def train_model(use_cache: bool = True):
+    print(" Démarrage de l'entraînement (Split Temporel)...")
+
+    fe = FeatureEngineering()
+    features_cols = BASE_FEATURES + ['lag_24h', 'lag_48h', 'lag_168h', 'mean_last_4_days']
+
+    # --- 0. Cache : mêmes données + mêmes hyperparamètres -> même modèle ---
+    inputs = {**fe.dataset_fingerprint(), "params": XGB_PARAMS, "features": features_cols, "format": MODEL_FORMAT}
+    model = fe.cache.get("model", inputs) if use_cache else None
+
+    if model is None:
+        # --- 1. Chargement & Pipeline ---
+        df = fe.create_dataset(use_cache)
+
+        # --- 2. Split, Entraînement & Évaluation ---
+        model = fit_xgb(df, features_cols)
+        if model is None:
+            return
+        save_counter_encoding(model, df)
+        if use_cache:
+            fe.cache.put("model", inputs, model)
+
+    # --- 4. Sauvegarde Modèle ---
     joblib.dump(model, 'backend/model/model_velo.pkl')
     print(" Modèle sauvegardé.")
 
-    # --- 7. Sauvegarde BDD ---
+    # --- 5. Sauvegarde BDD ---
     # N'oubliez pas de vider la table model_data avant si vous voulez éviter les doublons
     # python -m data.cli_data delete-tables-by-name --table-name model_data
     # python -m data.cli_data create-tables
@@ -101,5 +142,115 @@ def train_model():
     # except Exception as e:
     #     print(f"❌ Erreur BDD : {e}")
 
+def train_direct_model(max_horizon: int = 7, use_cache: bool = True):
+    """
+    Mode DIRECT multi-horizon : un seul modèle avec l'horizon (en jours) comme feature.
+    Toutes les features sont connues à l'origine -> J+1..J+k prédits en un seul appel.
+    """
+    print(f" Démarrage de l'entraînement DIRECT (horizons 1..{max_horizon})...")
+
+    fe = FeatureEngineering()
+    features_cols = BASE_FEATURES + ['horizon'] + DIRECT_LAG_COLS
+
+    inputs = {
+        **fe.dataset_fingerprint(), "params": XGB_PARAMS,
+        "features": features_cols, "max_horizon": max_horizon, "format": MODEL_FORMAT,
+    }
+    model = fe.cache.get("model_direct", inputs) if use_cache else None
+
+    if model is None:
+        df = fe.create_dataset(use_cache)
+        if df.empty:
+            return
+
+        df = build_direct_dataset(df, max_horizon)
+        print(f"   -> {len(df)} lignes (tous horizons confondus)")
+
+        model = fit_xgb(df, features_cols)
+        if model is None:
+            return
+
+        # L'horizon maximal appris et l'encodage des compteurs voyagent avec le modèle
+        model.get_booster().set_attr(max_horizon=str(max_horizon))
+        save_counter_encoding(model, df)
+        if use_cache:
+            fe.cache.put("model_direct", inputs, model)
+    joblib.dump(model, 'backend/model/model_velo_direct.pkl')
+    print(" Modèle direct sauvegardé.")
+
+def _fit_shard(shard: int, df: pd.DataFrame, features_cols: list, params: dict):
+    """Worker (processus séparé) : entraîne le modèle d'un cluster."""
+    print(f" [Cluster {shard}] {df['counter_id'].nunique()} compteurs, {len(df)} lignes")
+    return shard, fit_xgb(df, features_cols, params=params)
+
+def train_sharded_model(n_clusters: int = 4, workers: int = None, use_cache: bool = True):
+    """
+    Regroupe les compteurs par profil de trafic et entraîne un modèle par cluster,
+    en parallèle dans des processus séparés. La prédiction route chaque compteur vers son modèle.
+    """
+    workers = workers or min(n_clusters, os.cpu_count() or 1)
+    print(f" Démarrage de l'entraînement PAR CLUSTER ({n_clusters} clusters, {workers} processus)...")
+
+    fe = FeatureEngineering()
+    features_cols = BASE_FEATURES + ['lag_24h', 'lag_48h', 'lag_168h', 'mean_last_4_days']
+    # Les cœurs sont partagés entre les processus (pas de sur-souscription)
+    params = {**SHARD_PARAMS, 'n_jobs': max(1, (os.cpu_count() or 1) // workers)}
+
+    inputs = {
+        **fe.dataset_fingerprint(), "params": params,
+        "features": features_cols, "n_clusters": n_clusters, "format": MODEL_FORMAT,
+    }
+    model = fe.cache.get("model_sharded", inputs) if use_cache else None
+
+    if model is None:
+        df = fe.create_dataset(use_cache)
+        if df.empty:
+            return
+
+        routing = cluster_counters(df, n_clusters)
+        df['shard'] = df['counter_id_encoded'].map(routing)
+
+        models = {}
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(_fit_shard, shard, df_shard, features_cols, params)
+                for shard, df_shard in df.groupby('shard')
+            ]
+            for future in futures:
+                shard, shard_model = future.result()
+                if shard_model is None:
+                    print(f" Erreur : le cluster {shard} n'a pas pu être entraîné")
+                    return
+                models[int(shard)] = shard_model
+
+        model = ShardedModel(routing, models, features_cols, counter_encoding(df))
+        if use_cache:
+            fe.cache.put("model_sharded", inputs, model)
+
+    joblib.dump(model, 'backend/model/model_velo_sharded.pkl')
+    print(" Modèles par cluster sauvegardés.")
+
+def main(
+    direct: bool = typer.Option(False, help="Entraîne le modèle direct multi-horizon"),
+    max_horizon: int = typer.Option(7, help="Horizon maximal (jours) du mode direct"),
+    sharded: bool = typer.Option(False, help="Entraîne un modèle par cluster de compteurs, en parallèle"),
+    n_clusters: int = typer.Option(4, help="Nombre de clusters de compteurs (mode --sharded)"),
+    workers: int = typer.Option(None, help="Nombre de processus (mode --sharded, défaut : nb de cœurs)"),
+    cache: bool = typer.Option(True, help="Saute les étapes dont les entrées n'ont pas changé"),
+    profile: Path = typer.Option(None, help="Écrit un profil par étape (cProfile + pic mémoire) dans ce dossier"),
+):
+    if sharded and direct:
+        # Pas de modèle direct par cluster : on refuse plutôt que d'ignorer une des options
+        raise typer.BadParameter("--sharded et --direct ne peuvent pas être combinés")
+    export_on_exit("train")
+    if profile:
+        start_profiling("train", profile)
+    if sharded:
+        train_sharded_model(n_clusters, workers, use_cache=cache)
+    elif direct:
+        train_direct_model(max_horizon, use_cache=cache)
+    else:
+        train_model(use_cache=cache)
+
 if __name__ == "__main__":
-    train_model()
\ No newline at end of file
+    typer.run(main)
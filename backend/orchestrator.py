@@ -0,0 +1,338 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import joblib
+import pandas as pd
+import requests
+import typer
+from sqlalchemy import event
+
+from backend.data import cli_data
+from backend.data.metrics import (
+    PIPELINE_DB_STATEMENTS, PIPELINE_FRESHNESS_SECONDS, PIPELINE_LAST_SUCCESS, StageTimer,
+    export_job_metrics, export_on_exit,
+)
+from backend.data.stage_cache import file_fingerprint
+from backend.modeling.features import FeatureEngineering, encode_counters
+from backend.modeling.predict_next_day import LAG_HOURS, Predictor, model_counter_encoding, model_feature_names
+
+app = typer.Typer(help="Orchestrateur : ingestion -> nettoyage -> features -> prédiction -> scores, en continu")
+
+# Les mesures du portail arrivent avec du retard : chaque cycle relit les derniers jours (doublons écartés)
+INGEST_OVERLAP_DAYS = 2
+# Historique nécessaire aux features : le lag le plus long + les 7 jours retirés par dropna (lags 168h)
+FEATURE_WINDOW_DAYS = max(LAG_HOURS) // 24 + 8
+WEATHER_COLS = ["temperature_2m", "wind_speed_10m", "precipitation"]
+
+
+@contextmanager
+def count_statements(engine):
+    """Compte les requêtes SQL envoyées sur `engine` pendant le bloc (un executemany compte pour une)."""
+    counter = {"n": 0}
+
+    def on_execute(*args):
+        counter["n"] += 1
+
+    event.listen(engine, "before_cursor_execute", on_execute)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, "before_cursor_execute", on_execute)
+
+
+def invalidate_api_cache():
+    """
+    Nouvelles données publiées (après le rafraîchissement du snapshot) : vide le cache de réponses de l'API,
+    comme l'étape de publication du workflow quotidien. Sans API_URL, rien à faire ; un échec n'arrête pas le cycle.
+    """
+    api_url = os.getenv("API_URL")
+    if not api_url:
+        return
+    try:
+        response = requests.post(
+            f"{api_url}/cache/invalidate",
+            headers={"X-Invalidate-Token": os.getenv("CACHE_INVALIDATE_TOKEN", "")}, timeout=10,
+        )
+        response.raise_for_status()
+    except Exception as e:
+        print(f" ⚠ Cache de l'API non invalidé : {e}")
+
+
+class Pipeline:
+    """
+    Cycle ingestion -> nettoyage -> features -> prédiction -> scores, avec l'état gardé en mémoire
+    entre deux cycles : historique vélo (fenêtre des features), météo, dernière heure par compteur.
+    La base n'est lue qu'au premier cycle ; ensuite, seules les nouvelles lignes y sont écrites.
+    """
+
+    def __init__(self, predict: bool = True):
+        self.db = cli_data.db
+        self.fe = FeatureEngineering()
+        self.predictor = Predictor()
+        self.predict = predict
+
+        self.velo = None
+        self.meteo = None
+        self.counters = set()
+        self.history = None          # dataset de features du dernier cycle (réutilisé si rien de neuf)
+        self.model = None
+        self.model_cols = None
+        self.model_key = None
+        self.last_prediction = None  # (dernière heure connue, demain, modèle) des prédictions en base
+        self.durations = {}
+
+    @contextmanager
+    def _stage(self, name: str):
+        """Étape du cycle : durée exportée (velomag_stage_seconds) et gardée pour le résumé."""
+        start = time.perf_counter()
+        with StageTimer("pipeline", name) as timer:
+            yield timer
+        self.durations[name] = time.perf_counter() - start
+
+    # ---------------------------------------------------------
+    # Ingestion (vélo et météo en parallèle)
+    # ---------------------------------------------------------
+    def _load_state(self):
+        """Seule lecture complète de la base : velo_clean et meteo_clean, au premier cycle."""
+        with self._stage("load") as stage:
+            velo = self.db.pull_data("velo_clean").drop(columns=["id"], errors="ignore")
+            meteo = self.db.pull_data("meteo_clean").drop(columns=["id"], errors="ignore")
+            stage.rows = len(velo)
+        velo["datetime"] = pd.to_datetime(velo["datetime"])
+        meteo["datetime"] = pd.to_datetime(meteo["datetime"])
+        self._commit(velo, meteo)
+
+    def _fetch_velo(self) -> pd.DataFrame:
+        if self.velo.empty:
+            start = f"{cli_data.start_date}T00:00:00"
+        else:
+            start = (self.velo["datetime"].max() - timedelta(days=INGEST_OVERLAP_DAYS)).strftime("%Y-%m-%dT%H:%M:%S")
+        with self._stage("ingest_velo") as stage:
+            df = cli_data.fetch.fetch_all_data_velo(start_date=start)
+            stage.rows = len(df)
+        return df
+
+    def _fetch_meteo(self) -> pd.DataFrame:
+        # On repart de la dernière heure complète : l'archive publie les derniers jours avec retard (valeurs nulles)
+        complete = self.meteo.dropna(subset=WEATHER_COLS)["datetime"]
+        start = complete.max().strftime("%Y-%m-%d") if not complete.empty else cli_data.start_date
+        with self._stage("ingest_meteo") as stage:
+            df = cli_data.fetch.fetch_meteo(start, None, cli_data.latitude, cli_data.longitude)
+            stage.rows = len(df)
+        return df
+
+    # ---------------------------------------------------------
+    # Nettoyage : seulement les lignes absentes de l'état en mémoire (vélo) ou modifiées (météo)
+    # ---------------------------------------------------------
+    def _clean(self, raw_velo: pd.DataFrame, raw_meteo: pd.DataFrame) -> dict:
+        with self._stage("clean") as stage:
+            if not raw_velo.empty:
+                # Clé (compteur, heure UTC) : une heure publiée en retard, même antérieure à la dernière
+                # heure connue du compteur, est gardée ; une heure déjà en mémoire est écartée
+                ds = pd.to_datetime(raw_velo["datetime"], utc=True).dt.tz_localize(None)
+                keys = pd.MultiIndex.from_arrays([raw_velo["counter_id"], ds])
+                known = pd.MultiIndex.from_frame(self.velo[["counter_id", "datetime"]])
+                raw_velo = raw_velo[~keys.isin(known) & ~keys.duplicated()]
+            velo_new = raw_velo
+            if not raw_velo.empty:
+                velo_new = cli_data.clean._standardize_delete_timezone(cli_data.clean.clean_data_velo(raw_velo))
+
+            meteo_fetched, meteo_raw, meteo_new = raw_meteo, raw_meteo, raw_meteo
+            if not raw_meteo.empty:
+                meteo_fetched = cli_data.clean._standardize_to_UTC(raw_meteo.copy()).drop_duplicates("datetime", keep="last")
+
+                # Relue depuis la dernière heure complète : heures nouvelles ou dont une valeur a changé
+                # (valeur publiée, corrigée par l'archive), deux valeurs manquantes étant égales
+                fetched = meteo_fetched.set_index("datetime")[WEATHER_COLS].astype(float)
+                known = self.meteo.drop_duplicates("datetime", keep="last").set_index("datetime")[WEATHER_COLS]
+                known = known.astype(float).reindex(fetched.index)
+                same = ((fetched == known) | (fetched.isna() & known.isna())).all(axis=1).to_numpy()
+                meteo_new = meteo_fetched[~same]
+                meteo_raw = raw_meteo.loc[meteo_new.index]
+            stage.rows = len(velo_new)
+
+        return {
+            "velo_raw": raw_velo,
+            "velo_clean": velo_new,
+            "meteo_raw": meteo_raw,
+            "meteo_clean": meteo_new,
+            "meteo_fetched": meteo_fetched,
+            "changed": not velo_new.empty or not meteo_new.empty,
+        }
+
+    def _merge(self, batch: dict):
+        """État candidat : historique + nouvelles lignes (la météo relue remplace les heures en mémoire)."""
+        velo, meteo = self.velo, self.meteo
+        if not batch["velo_clean"].empty:
+            velo = pd.concat([velo, batch["velo_clean"]], ignore_index=True)
+        fetched = batch["meteo_fetched"]
+        if not fetched.empty:
+            meteo = pd.concat([meteo[meteo["datetime"] < fetched["datetime"].min()], fetched], ignore_index=True)
+        return velo, meteo
+
+    def _commit(self, velo: pd.DataFrame, meteo: pd.DataFrame):
+        """L'état en mémoire n'avance qu'une fois les écritures réussies ; on ne garde que la fenêtre utile."""
+        self.counters.update(velo["counter_id"].unique())
+        if not velo.empty:
+            since = velo["datetime"].max() - timedelta(days=FEATURE_WINDOW_DAYS)
+            velo = velo[velo["datetime"] >= since]
+            meteo = meteo[meteo["datetime"] >= since]
+        self.velo = velo.reset_index(drop=True)
+        self.meteo = meteo.reset_index(drop=True)
+
+    # ---------------------------------------------------------
+    # Publication : écritures en base (en parallèle des features et de la prédiction)
+    # ---------------------------------------------------------
+    def _publish(self, batch: dict):
+        with self._stage("publish") as stage:
+            for table in ("velo_raw", "velo_clean"):
+                if not batch[table].empty:
+                    self.db.push_data(batch[table], table)
+            # Heures de météo modifiées : remplacées en base (pas de doublon par heure)
+            for table in ("meteo_raw", "meteo_clean"):
+                if not batch[table].empty:
+                    self.db.replace_data(batch[table], table)
+
+            if not batch["velo_clean"].empty:
+                cli_data._refresh_snapshot()
+                newest = batch["velo_clean"]["datetime"].max()
+                PIPELINE_FRESHNESS_SECONDS.set((pd.Timestamp.now(tz="UTC").tz_localize(None) - newest).total_seconds())
+            if any(not batch[table].empty for table in ("velo_clean", "meteo_clean")):
+                invalidate_api_cache()
+            stage.rows = len(batch["velo_clean"])
+
+    # ---------------------------------------------------------
+    # Features et prédiction, à partir des frames en mémoire
+    # ---------------------------------------------------------
+    def _features(self, velo: pd.DataFrame, meteo: pd.DataFrame) -> pd.DataFrame:
+        since = velo["datetime"].max() - timedelta(days=FEATURE_WINDOW_DAYS)
+        with self._stage("features") as stage:
+            df = self.fe.build_dataset_from(velo[velo["datetime"] >= since], meteo[meteo["datetime"] >= since])
+            stage.rows = len(df)
+        return df
+
+    def _load_model(self) -> bool:
+        """(Re)charge le modèle seulement si le fichier a changé (ex. après un nouvel entraînement)."""
+        key = file_fingerprint(self.predictor.model_path)
+        if key == self.model_key:
+            return True
+        try:
+            self.model = joblib.load(self.predictor.model_path)
+            self.model_cols = model_feature_names(self.model)
+        except Exception as e:
+            print(f" Erreur Modèle : {e}")
+            return False
+        self.model_key = key
+        return True
+
+    def _forecast(self, velo: pd.DataFrame, meteo: pd.DataFrame, changed: bool):
+        """Prédictions jusqu'à demain (réel), ou None si celles en base sont déjà à jour."""
+        if not self.predict or velo.empty or not self._load_model():
+            return None, None
+
+        if changed or self.history is None:
+            self.history = self._features(velo, meteo)
+        if self.history.empty:
+            return None, None
+
+        self.predictor.real_tomorrow = datetime.now().date() + timedelta(days=1)
+        key = (self.history["ds"].max(), self.predictor.real_tomorrow, self.model_key)
+        if key == self.last_prediction:
+            print(" Prédictions à jour.")
+            return None, None
+
+        # Même encodage qu'à l'entraînement : celui sauvegardé avec le modèle (nouveaux compteurs à la suite),
+        # sinon (ancien modèle) l'ordre de tri de tous les compteurs connus, pas seulement ceux de la fenêtre
+        encoded_ids = encode_counters(self.counters, model_counter_encoding(self.model))
+        with self._stage("predict") as stage:
+            days = self.predictor.forecast_recursive(self.history, self.model, self.model_cols, encoded_ids)
+            frames = [df for _, df in days]
+            predictions = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+            stage.rows = len(predictions)
+        return predictions, key
+
+    # ---------------------------------------------------------
+    # Un cycle complet
+    # ---------------------------------------------------------
+    def run_cycle(self):
+        self.durations = {}
+        with count_statements(self.db.engine) as statements, self._stage("cycle"):
+            if self.velo is None:
+                self._load_state()
+
+            with ThreadPoolExecutor(max_workers=2, thread_name_prefix="ingest") as pool:
+                velo_job = pool.submit(self._fetch_velo)
+                meteo_job = pool.submit(self._fetch_meteo)
+                raw_velo, raw_meteo = velo_job.result(), meteo_job.result()
+
+            batch = self._clean(raw_velo, raw_meteo)
+            changed = batch["changed"]
+            print(f" Nouvelles lignes : {len(batch['velo_clean'])} vélo, {len(batch['meteo_clean'])} météo (nouvelles ou corrigées).")
+
+            with ThreadPoolExecutor(max_workers=1, thread_name_prefix="publish") as pool:
+                publish_job = pool.submit(self._publish, batch)
+                velo, meteo = self._merge(batch)
+                try:
+                    predictions, key = self._forecast(velo, meteo, changed)
+                finally:
+                    # Écritures réussies -> l'état avance, même si la prédiction a échoué
+                    publish_job.result()
+                    self._commit(velo, meteo)
+
+            if predictions is not None and not predictions.empty:
+                with self._stage("push_predictions") as stage:
+                    # Une prédiction par (compteur, heure) : celles d'un cycle précédent sont remplacées
+                    self.db.replace_data(predictions, "model_data", keys=("counter_id", "datetime"))
+                    stage.rows = len(predictions)
+                self.last_prediction = key
+                cli_data._refresh_snapshot()
+                invalidate_api_cache()
+
+            if changed or predictions is not None:
+                with self._stage("score"):
+                    self.db.update_score_stats()
+
+        PIPELINE_DB_STATEMENTS.set(statements["n"])
+        PIPELINE_LAST_SUCCESS.set_to_current_time()
+        stages = " | ".join(f"{name} {seconds:.1f} s" for name, seconds in self.durations.items() if name != "cycle")
+        print(f" Cycle terminé en {self.durations['cycle']:.1f} s ({statements['n']} requêtes SQL) : {stages}")
+
+
+@app.command()
+def run(predict: bool = typer.Option(True, help="Prédit jusqu'à demain après l'ingestion")):
+    """Un seul cycle (ingestion -> scores), puis sortie."""
+    export_on_exit("pipeline")
+    Pipeline(predict=predict).run_cycle()
+
+
+@app.command()
+def daemon(
+    interval: int = typer.Option(900, help="Secondes entre deux débuts de cycle"),
+    max_cycles: int = typer.Option(0, help="Arrêt après N cycles (0 : sans fin)"),
+    predict: bool = typer.Option(True, help="Prédit jusqu'à demain après l'ingestion"),
+):
+    """
+    Cycles en continu. L'état reste en mémoire d'un cycle à l'autre ; un cycle en échec
+    ne fait pas avancer l'état et sera rejoué au suivant. Métriques exportées après chaque cycle.
+    """
+    pipeline = Pipeline(predict=predict)
+    cycles = 0
+    while True:
+        start = time.monotonic()
+        try:
+            pipeline.run_cycle()
+        except Exception as e:
+            print(f" ⚠ Cycle en échec : {e}")
+        export_job_metrics("pipeline")
+
+        cycles += 1
+        if max_cycles and cycles >= max_cycles:
+            break
+        time.sleep(max(0, interval - (time.monotonic() - start)))
+
+
+if __name__ == "__main__":
+    app()
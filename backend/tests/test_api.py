@@ -0,0 +1,103 @@
+from datetime import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+
+from backend.api import api
+from backend.data.db_url import database_url
+
+
+class FakeAsyncDatabase:
+    """Pool asyncpg factice : /history renvoie `rows` points horaires."""
+
+    def __init__(self, rows: int = 200):
+        self.rows = rows
+        self.queries = 0
+
+    async def fetch(self, query, params=None, timeout=None):
+        self.queries += 1
+        return ["datetime", "count"], [(datetime(2025, 1, 1 + h // 24, h % 24), h) for h in range(self.rows)]
+
+    async def fetchrow(self, query, params=None, timeout=None):
+        return {"velo": 1, "pred": 1, "snapshot": "1.1.2025-01-01"}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    db = FakeAsyncDatabase()
+    monkeypatch.setattr(api, "get_async_db", lambda: db)
+    api.response_cache.clear()
+    api.data_version.bump()
+    yield TestClient(api.app)
+    api.response_cache.clear()
+
+
+def test_history_etag_and_304(client):
+    first = client.get("/history/c1", headers={"Accept-Encoding": "identity"})
+    assert first.status_code == 200
+    etag = first.headers["etag"]
+
+    again = client.get("/history/c1", headers={"Accept-Encoding": "identity", "If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.content == b""
+
+
+def test_gzip_representation_has_its_own_etag(client):
+    identity = client.get("/history/c1", headers={"Accept-Encoding": "identity"})
+    gzipped = client.get("/history/c1", headers={"Accept-Encoding": "gzip"})
+    assert gzipped.headers["content-encoding"] == "gzip"
+    assert gzipped.headers["etag"] != identity.headers["etag"]
+    assert "Accept-Encoding" in gzipped.headers["vary"]
+
+    # L'ETag de la version non compressée ne valide pas la version gzip (et inversement)
+    cross = client.get("/history/c1", headers={"Accept-Encoding": "gzip", "If-None-Match": identity.headers["etag"]})
+    assert cross.status_code == 200
+    same = client.get("/history/c1", headers={"Accept-Encoding": "gzip", "If-None-Match": gzipped.headers["etag"]})
+    assert same.status_code == 304
+
+
+def test_cache_invalidate_requires_configured_token(client, monkeypatch):
+    monkeypatch.delenv("CACHE_INVALIDATE_TOKEN", raising=False)
+    assert client.post("/cache/invalidate").status_code == 403
+
+    monkeypatch.setenv("CACHE_INVALIDATE_TOKEN", "secret")
+    assert client.post("/cache/invalidate", headers={"X-Invalidate-Token": "nope"}).status_code == 403
+    assert client.post("/cache/invalidate", headers={"X-Invalidate-Token": "secret"}).status_code == 200
+
+
+def test_ready_after_failed_warmup(client, monkeypatch):
+    monkeypatch.setenv("API_WARMUP", "1")
+    monkeypatch.setitem(api.warmup_state, "status", "pending")
+    assert client.get("/ready").status_code == 503
+
+    monkeypatch.setitem(api.warmup_state, "status", "failed")
+    monkeypatch.setitem(api.warmup_state, "error", "TimeoutError: ")
+    ready = client.get("/ready")
+    assert ready.status_code == 200
+    assert ready.json()["warmup"]["status"] == "failed"
+
+
+def test_db_url_override_is_limited_to_benchmark_postgres(monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", "postgresql://other@host/prod")
+    monkeypatch.delenv("BENCHMARK_DATABASE_URL", raising=False)
+    monkeypatch.setenv("host", "db.example")
+    assert "other@host" not in database_url("postgresql")
+
+    monkeypatch.setenv("BENCHMARK_DATABASE_URL", "postgresql+psycopg2://bench@localhost/bench")
+    assert database_url("postgresql") == "postgresql://bench@localhost/bench"
+
+    monkeypatch.setenv("BENCHMARK_DATABASE_URL", "sqlite:///bench.db")
+    with pytest.raises(ValueError):
+        database_url("postgresql")
+
+
+def test_metrics_scrape_reads_score_stats(monkeypatch):
+    class ScoreDatabase:
+        async def fetch(self, query, params=None, timeout=None):
+            return ["counter_id", "n", "sum_abs_err", "sum_sq_err", "sum_real", "sum_sq_real"], [("c1", 2, 4.0, 10.0, 6.0, 20.0)]
+
+    monkeypatch.setattr(api, "get_async_db", lambda: ScoreDatabase())
+    monkeypatch.setattr(api, "_score_gauges_read_at", float("-inf"))
+    body = TestClient(api.app).get("/metrics").text
+    assert 'velomag_counter_mae{counter_id="c1"} 2.0' in body
+    assert "velomag_model_mae 2.0" in body
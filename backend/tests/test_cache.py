@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+
+from backend.api.cache import ResponseCache, SingleFlight, encoding_etag, etag_matches
+
+
+def test_lru_eviction_by_entries():
+    cache = ResponseCache(max_entries=2)
+    cache.put("a", b"1")
+    cache.put("b", b"2")
+    cache.get("a")  # "a" devient le plus récent
+    cache.put("c", b"3")
+    assert cache.get("b") is None
+    assert cache.get("a").body == b"1"
+    assert cache.get("c").body == b"3"
+
+
+def test_lru_eviction_by_bytes():
+    cache = ResponseCache(max_entries=10, max_bytes=10)
+    cache.put("a", b"x" * 6)
+    cache.put("b", b"y" * 6)
+    assert cache.get("a") is None
+    assert cache.get("b") is not None
+    # Trop gros pour être gardé, mais servi quand même
+    entry = cache.put("c", b"z" * 11)
+    assert entry.body == b"z" * 11 and cache.get("c") is None
+
+
+def test_etag_depends_on_body_only():
+    cache = ResponseCache()
+    first = cache.put("a", b"same")
+    second = cache.put("b", b"same", media_type="text/csv")
+    assert first.etag == second.etag
+    assert cache.put("c", b"other").etag != first.etag
+
+
+def test_etag_matches():
+    etag = '"abc"'
+    assert etag_matches('"abc"', etag)
+    assert etag_matches('"x", "abc"', etag)
+    assert etag_matches('W/"abc"', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches('"abd"', etag)
+    assert not etag_matches(None, etag)
+
+
+def test_encoding_etag():
+    assert encoding_etag('"abc"', "gzip") == '"abc-gzip"'
+    assert encoding_etag('"abc"') == '"abc"'
+    assert not etag_matches('"abc"', encoding_etag('"abc"', "gzip"))
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    async def run():
+        flight, calls = SingleFlight(), []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "ok"
+
+        results = await asyncio.gather(*(flight.do("k", compute) for _ in range(5)))
+        return results, calls, flight.in_flight()
+
+    results, calls, in_flight = asyncio.run(run())
+    assert len(calls) == 1
+    assert [value for value, _ in results] == ["ok"] * 5
+    assert sorted(shared for _, shared in results) == [False] + [True] * 4
+    assert in_flight == 0
+
+
+def test_single_flight_shares_errors_then_retries():
+    async def run():
+        flight, calls = SingleFlight(), []
+
+        async def fail():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            raise ValueError("boom")
+
+        results = await asyncio.gather(flight.do("k", fail), flight.do("k", fail), return_exceptions=True)
+        assert all(isinstance(r, ValueError) for r in results)
+        # Calcul terminé : l'appel suivant relance `fn`
+        with pytest.raises(ValueError):
+            await flight.do("k", fail)
+        return calls
+
+    assert len(asyncio.run(run())) == 2
@@ -0,0 +1,34 @@
+import pandas as pd
+import xgboost as xgb
+
+from backend.modeling.features import counter_encoding, encode_counters
+from backend.modeling.predict_next_day import model_counter_encoding
+from backend.modeling.sharding import ShardedModel
+from backend.modeling.train import save_counter_encoding
+
+
+def test_encode_counters_keeps_training_codes():
+    known = {"b": 0, "c": 1, "z": 2}
+    # "a" apparaît après l'entraînement, "z" n'a plus de données récentes
+    encoded = encode_counters(["c", "a", "b"], known)
+    assert encoded == {"a": 3, "b": 0, "c": 1}
+
+
+def test_encode_counters_without_saved_encoding_uses_byte_order():
+    # Ordre de cat.codes (pas la collation PostgreSQL, qui mettrait "a" avant "B")
+    assert encode_counters(["a", "B", "_x"]) == {"B": 0, "_x": 1, "a": 2}
+
+
+def test_counter_encoding_roundtrip_with_model():
+    df = pd.DataFrame({"counter_id": ["b", "a", "b"], "x": [0.0, 1.0, 2.0]})
+    df["counter_id_encoded"] = df["counter_id"].astype("category").cat.codes
+    model = xgb.XGBRegressor(n_estimators=2)
+    model.fit(df[["x"]], [1.0, 2.0, 3.0])
+
+    save_counter_encoding(model, df)
+    assert model_counter_encoding(model) == {"a": 0, "b": 1} == counter_encoding(df)
+
+
+def test_sharded_model_without_encoding():
+    model = ShardedModel({0: 0}, {0: None}, ["x"])
+    assert model_counter_encoding(model) is None
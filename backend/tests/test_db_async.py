@@ -0,0 +1,23 @@
+from datetime import datetime, timedelta, timezone
+
+from backend.api.db_async import bind_params
+
+
+def test_bind_params_numbers_named_placeholders_in_order():
+    sql, args = bind_params(
+        "SELECT * FROM t WHERE id = %(id)s AND d >= %(start)s AND other = %(id)s LIMIT %(limit)s",
+        {"limit": 10, "id": "c1", "start": datetime(2025, 1, 1), "unused": 1},
+    )
+    assert sql == "SELECT * FROM t WHERE id = $1 AND d >= $2 AND other = $1 LIMIT $3"
+    assert args == ["c1", datetime(2025, 1, 1), 10]
+
+
+def test_bind_params_without_params():
+    assert bind_params("SELECT 1") == ("SELECT 1", [])
+
+
+def test_bind_params_converts_aware_datetimes_to_naive_utc():
+    paris = timezone(timedelta(hours=1))
+    _, args = bind_params("%(a)s %(b)s", {"a": datetime(2025, 1, 1, 12, tzinfo=paris), "b": datetime(2025, 1, 1, 12)})
+    assert args == [datetime(2025, 1, 1, 11), datetime(2025, 1, 1, 12)]
+    assert args[0].tzinfo is None
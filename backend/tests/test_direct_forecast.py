@@ -0,0 +1,58 @@
+import pandas as pd
+
+from backend.modeling import predict_next_day
+from backend.modeling.predict_next_day import Predictor, build_direct_features
+
+
+def test_build_direct_features_reads_lags_known_at_origin():
+    origin = pd.Timestamp("2025-01-10")
+    df_weather = pd.DataFrame({
+        "ds": pd.to_datetime(["2025-01-11 00:00", "2025-01-12 00:00"]),
+        "temperature_2m": [5.0, 6.0], "wind_speed_10m": [1.0, 2.0], "precipitation": [0.0, 0.0],
+    })
+    # Minuit du jour d du mois -> d passages
+    memory = {("a", pd.Timestamp(2025, 1, d)): float(d) for d in range(1, 11)}
+
+    df = build_direct_features(df_weather, {"a": 3}, memory, origin, max_horizon=1)
+
+    assert df["counter_id_encoded"].tolist() == [3, 3]
+    # Au-delà de l'horizon appris, on garde le dernier horizon connu
+    assert df["horizon"].tolist() == [1, 1]
+    assert df["last_same_hour"].tolist() == [10, 10]
+    assert df["prev_same_hour"].tolist() == [9, 9]
+    assert df["last_same_weekday"].tolist() == [4, 5]
+    assert df["mean_same_hour_4d"].tolist() == [8.5, 8.5]
+
+
+def test_direct_weather_is_one_range_request(monkeypatch):
+    calls = []
+
+    class FakeResponse:
+        def raise_for_status(self):
+            pass
+
+        def json(self):
+            times = pd.date_range("2025-01-11", periods=48, freq="h").strftime("%Y-%m-%dT%H:%M")
+            return {"hourly": {"time": list(times), "temperature_2m": [1.0] * 48,
+                               "wind_speed_10m": [2.0] * 48, "precipitation": [0.0] * 48}}
+
+    def fake_get(url, params, timeout):
+        calls.append(params)
+        return FakeResponse()
+
+    monkeypatch.setattr(predict_next_day.requests, "get", fake_get)
+    df = Predictor().get_weather_data(pd.Timestamp("2025-01-11"), pd.Timestamp("2025-01-12"))
+
+    assert len(calls) == 1
+    assert (calls[0]["start_date"], calls[0]["end_date"]) == ("2025-01-11", "2025-01-12")
+    assert len(df) == 48
+
+
+def test_weather_fallback_covers_the_whole_range(monkeypatch):
+    def failing_get(*args, **kwargs):
+        raise predict_next_day.requests.ConnectionError("hors ligne")
+
+    monkeypatch.setattr(predict_next_day.requests, "get", failing_get)
+    df = Predictor().get_weather_data(pd.Timestamp("2025-01-11"), pd.Timestamp("2025-01-13"))
+    assert len(df) == 72
+    assert df["ds"].iloc[-1] == pd.Timestamp("2025-01-13 23:00")
@@ -0,0 +1,23 @@
+from backend.benchmarks.loadtest import _parse_slo, check_slos
+
+
+def step(**endpoints) -> dict:
+    return {"endpoints": {label: {"p50_ms": 10.0, "p95_ms": p95, "count": 100, "errors": errors}
+                          for label, (p95, errors) in endpoints.items()}}
+
+
+def test_check_slos_latency_and_errors():
+    slos = dict([_parse_slo("/history/{id}:p95=400"), _parse_slo("/map-data:p95=200")])
+    verdicts = check_slos(
+        step(**{"/history/{id}": (350.0, 0), "/map-data": (250.0, 0), "/counters": (900.0, 5)}),
+        slos, max_error_rate=0.01,
+    )
+    assert verdicts["/history/{id}"] == {"target": "p95 <= 400.0 ms", "ok": True}
+    assert verdicts["/map-data"]["ok"] is False
+    # Sans SLO de latence : seul le taux d'erreurs compte (5 % > 1 %)
+    assert verdicts["/counters"] == {"target": None, "ok": False}
+
+
+def test_check_slos_error_rate_at_threshold_passes():
+    verdicts = check_slos(step(**{"/version": (5.0, 1)}), {}, max_error_rate=0.01)
+    assert verdicts["/version"]["ok"] is True
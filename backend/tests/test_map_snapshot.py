@@ -0,0 +1,46 @@
+import os
+
+import pandas as pd
+import pytest
+from sqlalchemy import text
+
+from backend.data.schemas import Database
+
+# Base PostgreSQL jetable : toutes ses tables sont supprimées puis recréées
+DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+pytestmark = pytest.mark.skipif(not DATABASE_URL, reason="TEST_DATABASE_URL non défini")
+
+
+@pytest.fixture
+def legacy_db(monkeypatch):
+    """Base créée avant la synchro incrémentale : snapshot sans révisions ni tombstones."""
+    monkeypatch.setattr(Database, "_instance", None)
+    db = Database(DATABASE_URL)
+    db.drop_tables()
+    db.create_tables()
+    with db.engine.begin() as conn:
+        conn.execute(text("DROP TABLE map_snapshot_deleted"))
+        conn.execute(text("ALTER TABLE map_snapshot DROP COLUMN revision"))
+        conn.execute(text("ALTER TABLE map_snapshot_state DROP COLUMN min_revision"))
+
+    hours = pd.date_range(pd.Timestamp.today().normalize(), periods=24, freq="h")
+    db.push_data(pd.DataFrame({"datetime": hours, "counter_id": "c1", "intensity": 5.0}), "velo_clean")
+
+    # Nouveau processus : la migration n'a pas encore été vérifiée
+    monkeypatch.setattr(Database, "_instance", None)
+    yield Database(DATABASE_URL)
+    Database._instance.drop_tables()
+
+
+def columns(db, table: str) -> set:
+    with db.engine.connect() as conn:
+        return set(conn.execute(text(
+            "SELECT column_name FROM information_schema.columns WHERE table_name = :table"
+        ), {"table": table}).scalars())
+
+
+def test_refresh_migrates_legacy_snapshot(legacy_db):
+    assert legacy_db.refresh_map_snapshot() == 24
+    assert "revision" in columns(legacy_db, "map_snapshot")
+    assert "min_revision" in columns(legacy_db, "map_snapshot_state")
+    assert "revision" in columns(legacy_db, "map_snapshot_deleted")
@@ -0,0 +1,78 @@
+import asyncio
+import os
+
+import httpx
+import pandas as pd
+import pytest
+
+from backend.api import api
+from backend.api.db_async import AsyncDatabase
+from backend.data.schemas import Database
+
+# Base PostgreSQL jetable : toutes ses tables sont supprimées puis recréées
+DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+pytestmark = pytest.mark.skipif(not DATABASE_URL, reason="TEST_DATABASE_URL non défini")
+
+
+@pytest.fixture
+def db(monkeypatch):
+    monkeypatch.setattr(Database, "_instance", None)
+    Database(DATABASE_URL).drop_tables()
+    monkeypatch.setattr(Database, "_instance", None)
+    db = Database(DATABASE_URL)
+    db.create_tables()
+
+    # Réel sur les 12 premières heures du jour, prédictions sur toute la journée
+    today = pd.Timestamp.today().normalize()
+    hours = pd.date_range(today, periods=24, freq="h")
+    velo = pd.DataFrame({"datetime": hours[:12], "counter_id": "c1", "intensity": 5.0, "lat": 43.6, "lon": 3.9})
+    preds = pd.DataFrame({"datetime": hours, "counter_id": "c1", "predicted_values": 1.0})
+    db.push_data(velo, "velo_clean")
+    db.push_data(preds, "model_data")
+    yield db
+    db.drop_tables()
+
+
+def get_summary(monkeypatch) -> dict:
+    async def run():
+        async_db = AsyncDatabase("postgresql://" + DATABASE_URL.split("://", 1)[1])
+        monkeypatch.setattr(api, "get_async_db", lambda: async_db)
+        api.response_cache.clear()
+        try:
+            transport = httpx.ASGITransport(app=api.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                response = await client.get("/map-summary")
+                response.raise_for_status()
+                return response.json()
+        finally:
+            await async_db.close()
+
+    return asyncio.run(run())
+
+
+def test_summary_without_snapshot_falls_back_to_sources(db, monkeypatch):
+    summary = get_summary(monkeypatch)
+    assert summary["date"] == pd.Timestamp.today().date().isoformat()
+    assert summary["total"] == 12 * 5.0 + 12 * 1.0
+    assert summary["counters"] == [{"counter_id": "c1", "total": 72.0, "lat": 43.6, "lon": 3.9}]
+
+
+def test_summary_fallback_matches_snapshot(db, monkeypatch):
+    fallback = get_summary(monkeypatch)
+    db.refresh_map_snapshot()
+    assert get_summary(monkeypatch) == fallback
+
+
+def test_data_version_changes_when_snapshot_is_refreshed(db, monkeypatch):
+    async def version():
+        async_db = AsyncDatabase("postgresql://" + DATABASE_URL.split("://", 1)[1])
+        monkeypatch.setattr(api, "get_async_db", lambda: async_db)
+        try:
+            return await api._load_data_version()
+        finally:
+            await async_db.close()
+
+    # Lignes insérées, snapshot pas encore rafraîchi : même id max, mais version différente après
+    before = asyncio.run(version())
+    db.refresh_map_snapshot()
+    assert asyncio.run(version()) != before
@@ -0,0 +1,119 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# cli_data crée le moteur SQLAlchemy à l'import : URL factice, aucune connexion n'est ouverte ici
+_url_set = "BENCHMARK_DATABASE_URL" not in os.environ
+os.environ.setdefault("BENCHMARK_DATABASE_URL", "postgresql://localhost/velomag_test")
+from backend import orchestrator  # noqa: E402
+if _url_set:
+    del os.environ["BENCHMARK_DATABASE_URL"]
+
+HOUR = pd.Timestamp("2025-01-01")
+
+
+def meteo(hours, precipitation) -> pd.DataFrame:
+    return pd.DataFrame({
+        "datetime": [HOUR + pd.Timedelta(hours=h) for h in hours],
+        "temperature_2m": 10.0, "wind_speed_10m": 5.0, "precipitation": precipitation,
+    })
+
+
+@pytest.fixture
+def pipeline():
+    pipeline = orchestrator.Pipeline(predict=False)
+    pipeline.velo = pd.DataFrame({
+        "datetime": [HOUR + pd.Timedelta(hours=h) for h in (10, 12)],
+        "counter_id": "c1", "intensity": [1.0, 2.0],
+    })
+    pipeline.meteo = meteo([0, 1, 2], [0.0, 0.0, np.nan])
+    return pipeline
+
+
+def raw_velo(rows) -> pd.DataFrame:
+    return pd.DataFrame([
+        {"datetime": (HOUR + pd.Timedelta(hours=h)).strftime("%Y-%m-%dT%H:%M:%S+00:00"), "counter_id": c, "intensity": 3.0}
+        for c, h in rows
+    ])
+
+
+def test_clean_keeps_late_hours_and_drops_known_keys(pipeline):
+    # c1 11h arrive en retard (avant sa dernière heure connue), c1 12h est déjà en mémoire
+    batch = pipeline._clean(raw_velo([("c1", 11), ("c1", 12), ("c2", 10), ("c2", 10)]), pd.DataFrame())
+    keys = set(zip(batch["velo_clean"]["counter_id"], batch["velo_clean"]["datetime"].dt.hour))
+    assert keys == {("c1", 11), ("c2", 10)}
+    assert batch["changed"]
+
+
+def test_clean_keeps_new_and_corrected_weather_hours(pipeline):
+    # 1h inchangée, 2h complétée par l'archive, 3h nouvelle
+    batch = pipeline._clean(pd.DataFrame(), meteo([1, 2, 3], [0.0, 0.5, 0.2]))
+    assert batch["meteo_clean"]["datetime"].dt.hour.tolist() == [2, 3]
+    assert batch["meteo_raw"].index.tolist() == batch["meteo_clean"].index.tolist()
+    assert batch["changed"]
+
+
+def test_clean_treats_missing_weather_values_as_unchanged(pipeline):
+    batch = pipeline._clean(pd.DataFrame(), meteo([1, 2], [0.0, np.nan]))
+    assert batch["meteo_clean"].empty
+    assert not batch["changed"]
+
+
+def test_merge_replaces_refetched_weather_hours(pipeline):
+    batch = pipeline._clean(raw_velo([("c1", 11)]), meteo([1, 2], [0.0, 0.5]))
+    velo, weather = pipeline._merge(batch)
+    assert len(velo) == 3
+    assert weather["datetime"].dt.hour.tolist() == [0, 1, 2]
+    assert weather["precipitation"].tolist() == [0.0, 0.0, 0.5]
+
+
+DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+
+class FakeResponse:
+    def raise_for_status(self):
+        pass
+
+
+@pytest.mark.skipif(not DATABASE_URL, reason="TEST_DATABASE_URL non défini")
+def test_two_cycles_keep_one_prediction_per_key(monkeypatch):
+    from sqlalchemy import text
+
+    from backend.data import cli_data
+    from backend.data.schemas import Database
+
+    monkeypatch.setattr(Database, "_instance", None)
+    db = Database(DATABASE_URL)
+    db.drop_tables()
+    db.create_tables()
+    monkeypatch.setattr(cli_data, "db", db)
+    try:
+        pipeline = orchestrator.Pipeline()
+        pipeline.db = db
+        tomorrow = pd.date_range(HOUR + pd.Timedelta(days=1), periods=24, freq="h")
+        cycles = iter([[("c1", 10)], [("c1", 11)]])
+
+        def forecast(velo, meteo, changed):
+            # Nouvelle heure ingérée -> nouvelle clé : demain est prédit de nouveau
+            predictions = pd.DataFrame({"datetime": tomorrow, "counter_id": "c1", "predicted_values": 1.0,
+                                        "lat": 43.6, "lon": 3.9})
+            return predictions, (velo["datetime"].max(),)
+
+        monkeypatch.setattr(pipeline, "_fetch_velo", lambda: raw_velo(next(cycles)))
+        monkeypatch.setattr(pipeline, "_fetch_meteo", lambda: pd.DataFrame())
+        monkeypatch.setattr(pipeline, "_forecast", forecast)
+        invalidations = []
+        monkeypatch.setenv("API_URL", "http://api")
+        monkeypatch.setattr(orchestrator.requests, "post", lambda url, **kwargs: invalidations.append(url) or FakeResponse())
+        pipeline.run_cycle()
+        pipeline.run_cycle()
+        # Par cycle : après la publication des comptages, puis après celle des prédictions
+        assert invalidations == ["http://api/cache/invalidate"] * 4
+
+        with db.engine.connect() as conn:
+            counts = conn.execute(text("SELECT COUNT(*), COUNT(DISTINCT (counter_id, datetime)) FROM model_data")).one()
+        assert tuple(counts) == (24, 24)
+    finally:
+        db.drop_tables()
@@ -0,0 +1,55 @@
+import os
+
+import pandas as pd
+import pytest
+from sqlalchemy import event, text
+
+from backend.data.schemas import Database
+
+# Base PostgreSQL jetable : toutes ses tables sont supprimées puis recréées
+DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+pytestmark = pytest.mark.skipif(not DATABASE_URL, reason="TEST_DATABASE_URL non défini")
+
+
+@pytest.fixture
+def db(monkeypatch):
+    monkeypatch.setattr(Database, "_instance", None)
+    db = Database(DATABASE_URL)
+    db.drop_tables()
+    db.create_tables(partitioned=True)
+    yield db
+    db.drop_tables()
+
+
+def velo(start: str, periods: int = 24) -> pd.DataFrame:
+    hours = pd.date_range(start, periods=periods, freq="h")
+    return pd.DataFrame({"datetime": hours, "counter_id": "c1", "intensity": 5.0})
+
+
+def test_second_push_in_same_month_only_inserts(db):
+    db.push_data(velo("2020-01-01"), "velo_clean")
+
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(db.engine, "before_cursor_execute", listener)
+    try:
+        db.push_data(velo("2020-01-02"), "velo_clean")
+    finally:
+        event.remove(db.engine, "before_cursor_execute", listener)
+
+    assert statements and all(s.lstrip().upper().startswith("INSERT") for s in statements)
+
+
+def test_month_stuck_in_default_partition_is_reported(db, capsys):
+    # Lignes d'un mois sans partition : elles tombent dans la partition par défaut
+    with db.engine.begin() as conn:
+        conn.execute(text(
+            "INSERT INTO velo_clean (datetime, counter_id, intensity) VALUES ('2019-06-15', 'c1', 1.0)"
+        ))
+
+    db.push_data(velo("2019-06-16"), "velo_clean")
+    assert "Erreur : partition velo_clean_2019_06 non créée" in capsys.readouterr().out
+
+    stranded = db.migrate_schema()
+    assert [f"{month:%Y-%m}" for month in stranded["velo_clean"]] == ["2019-06"]
+    assert "2019-06" in capsys.readouterr().out
@@ -0,0 +1,39 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from backend.data import profiling
+
+
+def run_job(directory) -> dict:
+    def work(i):
+        with profiling.profile_stage(f"worker{i}"):
+            with profiling.profile_stage(f"worker{i}.inner"):
+                sum(range(10000))
+
+    profiling.start_profiling("job", directory)
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        list(pool.map(work, range(8)))
+    profiling.stop_profiling()
+    run_dir = next(directory.iterdir())
+    return json.loads((run_dir / "summary.json").read_text()), run_dir
+
+
+def test_stages_from_threads_keep_their_own_stack(tmp_path):
+    summary, run_dir = run_job(tmp_path)
+    names = [stage["stage"] for stage in summary["stages"]]
+    assert sorted(names) == sorted(["job"] + [f"worker{i}" for i in range(8)] + [f"worker{i}.inner" for i in range(8)])
+    # Une sous-étape se termine avant son parent, dans le même thread
+    for i in range(8):
+        assert names.index(f"worker{i}.inner") < names.index(f"worker{i}")
+    assert len(list(run_dir.glob("*.prof"))) == len(names)
+
+
+def test_stage_is_only_timed_when_another_profiler_is_active(tmp_path, monkeypatch):
+    class BusyProfile(profiling.cProfile.Profile):
+        def enable(self, *args, **kwargs):
+            raise ValueError("Another profiling tool is already active")
+
+    monkeypatch.setattr(profiling.cProfile, "Profile", BusyProfile)
+    summary, run_dir = run_job(tmp_path)
+    assert not any(stage["profiled"] for stage in summary["stages"])
+    assert not list(run_dir.glob("*.prof"))
@@ -0,0 +1,51 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pytest
+from sqlalchemy import text
+
+from backend.data.schemas import Database
+
+# Base PostgreSQL jetable : toutes ses tables sont supprimées puis recréées
+DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+pytestmark = pytest.mark.skipif(not DATABASE_URL, reason="TEST_DATABASE_URL non défini")
+
+
+@pytest.fixture
+def db(monkeypatch):
+    monkeypatch.setattr(Database, "_instance", None)
+    Database(DATABASE_URL).drop_tables()
+    monkeypatch.setattr(Database, "_instance", None)
+    db = Database(DATABASE_URL)
+    db.create_tables()
+
+    hours = pd.date_range("2025-01-01", periods=48, freq="h")
+    velo = pd.DataFrame({"datetime": hours, "counter_id": "c1", "intensity": range(48)})
+    preds = pd.DataFrame({"datetime": hours, "counter_id": "c1", "predicted_values": [10.0] * 48})
+    db.push_data(velo, "velo_clean")
+    db.push_data(preds, "model_data")
+    yield db
+    db.drop_tables()
+
+
+def score_stats(db) -> list:
+    with db.engine.connect() as conn:
+        return conn.execute(text(
+            "SELECT counter_id, day, n, sum_abs_err, sum_sq_err, sum_real, sum_sq_real FROM score_stats ORDER BY 1, 2"
+        )).all()
+
+
+def test_update_without_new_rows_leaves_stats_unchanged(db):
+    db.update_score_stats()
+    first = score_stats(db)
+    assert sum(row.n for row in first) == 48
+
+    assert db.update_score_stats() == 0
+    assert score_stats(db) == first
+
+
+def test_concurrent_updates_count_each_pair_once(db):
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        list(pool.map(lambda _: db.update_score_stats(), range(4)))
+    assert sum(row.n for row in score_stats(db)) == 48
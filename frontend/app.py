@@ -1,12 +1,11 @@
 import streamlit as st
 import pandas as pd
-import requests
-import folium
-from streamlit_folium import st_folium
 import plotly.express as px
 import plotly.graph_objects as go
 from datetime import date
 import os
+from data_client import DataClient
+from map_layer import MAP_CENTER, MAP_ZOOM, deck_layer
 
 # --- 1. CONFIGURATION ---
 st.set_page_config(page_title="VéloMag Montpellier", page_icon="🚲", layout="wide")
@@ -17,57 +16,61 @@ st.title("🚲 Tableau de Bord - VéloMag")
 
 # --- 2. FONCTIONS DE CHARGEMENT (CACHÉES) ---
 
-@st.cache_data(ttl=3600)
-def get_map_data():
-    """Récupère les données globales pour la carte (Route /map-data)"""
+@st.cache_resource
+def get_client():
+    """Client de l'API partagé entre les sessions : connexions, ETag, cache par compteur, préchargement."""
+    return DataClient(API_URL, prefetch_count=int(os.getenv("PREFETCH_COUNTERS", "5")))
+
+def api_get(path, decode, accept="application/json"):
+    """GET conditionnel : l'API répond 304 (sans corps) si les données n'ont pas changé."""
+    return get_client().get(path, decode, accept)
+
+def get_map_summary(day=None):
+    """
+    Résumé de la carte pour une journée : totaux par compteur, profil horaire de la ville et dates disponibles.
+    Calculé sur le snapshot synchronisé par deltas (changer de date ne refait aucune requête),
+    sinon demandé à l'API (Route /map-summary, agrégée en SQL).
+    """
     try:
-        response = requests.get(f"{API_URL}/map-data")
-        response.raise_for_status()
-        df = pd.DataFrame(response.json())
-        if not df.empty:
-            df['datetime_obj'] = pd.to_datetime(df['date'])
-            df['day_date'] = df['datetime_obj'].dt.date
-            df['hour'] = df['datetime_obj'].dt.hour
-            df = df.dropna(subset=['lat', 'lon'])
-        return df
-    except Exception as e:
-        return pd.DataFrame()
+        summary = get_client().map_summary(day)
+        if summary is not None:
+            return summary
+        path = "/map-summary" + (f"?date={day.isoformat()}" if day else "")
+        return api_get(path, lambda response: response.json())
+    except Exception:
+        return None
 
 @st.cache_data(ttl=3600)
 def get_counters_list():
     """Récupère la liste des compteurs disponibles"""
     try:
-        response = requests.get(f"{API_URL}/counters")
-        if response.status_code == 200:
-            return response.json()['counters']
-        return []
+        return api_get("/counters", lambda response: response.json())['counters']
     except:
         return []
 
 def get_detail_data(counter_id):
-    """Récupère l'historique et la prédiction pour un compteur spécifique"""
-    # Pas de cache ici pour permettre le changement rapide de compteur
-    try:
-        # Historique
-        res_hist = requests.get(f"{API_URL}/history/{counter_id}")
-        df_hist = pd.DataFrame(res_hist.json()) if res_hist.status_code == 200 else pd.DataFrame()
-        
-        # Prédiction
-        res_pred = requests.get(f"{API_URL}/prediction/{counter_id}")
-        df_pred = pd.DataFrame(res_pred.json()) if res_pred.status_code == 200 else pd.DataFrame()
-        
-        # Conversion dates
-        if not df_hist.empty: df_hist['datetime'] = pd.to_datetime(df_hist['datetime'])
-        if not df_pred.empty: df_pred['datetime'] = pd.to_datetime(df_pred['datetime'])
-        
-        return df_hist, df_pred
-    except:
-        return pd.DataFrame(), pd.DataFrame()
+    """
+    Récupère l'historique (7 derniers jours) et la prédiction pour un compteur spécifique :
+    appels en parallèle, résultat gardé par le client tant que les données de l'API n'ont pas changé.
+    """
+    return get_client().detail(counter_id)
 
-def get_color(daily_intensity):
-    if daily_intensity < 500: return "green"
-    elif daily_intensity < 1500: return "orange"
-    else: return "red"
+@st.cache_resource
+def get_base_view():
+    """Vue initiale de la carte deck.gl, construite une fois : seule la couche des compteurs change ensuite."""
+    import pydeck as pdk
+    return pdk.ViewState(latitude=MAP_CENTER[0], longitude=MAP_CENTER[1], zoom=MAP_ZOOM)
+
+def render_map(df_agg):
+    """Carte des totaux du jour : tous les compteurs dans une seule couche, styles calculés en bloc."""
+    import pydeck as pdk
+    deck = pdk.Deck(
+        layers=[deck_layer(df_agg)],
+        initial_view_state=get_base_view(),
+        map_style="light",
+        tooltip={"text": "{label}"},
+    )
+    st.pydeck_chart(deck, height=500, key="map")
 
 # --- 3. INTERFACE UTILISATEUR (ONGLETS) ---
 
@@ -79,61 +82,50 @@ tab1, tab2 = st.tabs([" Météo du Trafic (Carte)", " Analyse Détaillée (Courb
 with tab1:
     st.header("Prévisions de trafic sur la ville")
     
-    df_map = get_map_data()
+    # Premier appel sans date : liste des journées disponibles + journée par défaut
+    summary = get_map_summary()
     
-    if not df_map.empty:
+    if summary and summary["dates"]:
         # --- Filtres ---
         col_filter, _ = st.columns([1, 3])
         with col_filter:
-            unique_dates = sorted(df_map['day_date'].unique())
+            unique_dates = [date.fromisoformat(d) for d in summary["dates"]]
             selected_date = st.selectbox(
                 " Choisir la date à visualiser", 
                 unique_dates, 
+                index=summary["dates"].index(summary["date"]),
                 format_func=lambda d: d.strftime('%A %d %B %Y')
             )
         
-        # Filtrage
-        df_day = df_map[df_map['day_date'] == selected_date]
+        # Résumé de la journée choisie (calcul local, sans requête)
+        if selected_date.isoformat() != summary["date"]:
+            summary = get_map_summary(selected_date) or summary
         
         # --- KPI ---
-        total_trafic = df_day['predicted_intensity'].sum()
-        temp_moy = df_day['temperature_2m'].mean()
+        total_trafic = summary["total"]
+        temp_moy = summary["temperature_2m"]
         
         kpi1, kpi2, kpi3 = st.columns(3)
         kpi1.metric("Date", selected_date.strftime('%d/%m/%Y'))
         kpi2.metric("Trafic Total Prévu", f"{int(total_trafic):,} vélos".replace(",", " "))
         kpi3.metric("Météo Moyenne", f"{temp_moy:.0f}°C")
         
-        # --- Carte Folium ---
+        # --- Carte ---
         row1_col1, row1_col2 = st.columns([2, 1])
         
         with row1_col1:
             st.subheader(" Carte des volumes")
-            # Agrégation par compteur pour la journée
-            df_agg = df_day.groupby('counter_id').agg({
-                'predicted_intensity': 'sum', 'lat': 'first', 'lon': 'first'
-            }).reset_index()
-            
-            m = folium.Map(location=[43.6107, 3.8767], zoom_start=13, tiles="CartoDB positron")
-            
-            for _, row in df_agg.iterrows():
-                vol = int(row['predicted_intensity'])
-                folium.CircleMarker(
-                    location=[row['lat'], row['lon']],
-                    radius=5 + (vol / 500),
-                    color=get_color(vol),
-                    fill=True, fill_color=get_color(vol), fill_opacity=0.7,
-                    tooltip=f"{row['counter_id']}: {vol} vélos"
-                ).add_to(m)
+            # Totaux par compteur pour la journée (résumé du jour)
+            df_agg = pd.DataFrame(summary["counters"], columns=['counter_id', 'total', 'lat', 'lon'])
             
-            st_folium(m, width=None, height=500)
+            render_map(df_agg)
             
         with row1_col2:
             st.subheader(" Profil Horaire Ville")
-            df_chart = df_day.groupby('hour')['predicted_intensity'].sum().reset_index()
+            df_chart = pd.DataFrame(summary["hourly"], columns=['hour', 'total'])
             fig_area = px.area(
-                df_chart, x='hour', y='predicted_intensity',
-                labels={'predicted_intensity': 'Vélos', 'hour': 'Heure'},
+                df_chart, x='hour', y='total',
+                labels={'total': 'Vélos', 'hour': 'Heure'},
                 color_discrete_sequence=['#0072B2']
             )
             fig_area.update_layout(height=450)
@@ -156,6 +148,8 @@ with tab2:
         
         # Chargement des détails
         df_real, df_pred = get_detail_data(selected_counter)
+        # Les compteurs les plus consultés sont préparés pendant la lecture du graphique
+        get_client().prefetch(counters_list)
         
         if not df_pred.empty:
             # Calculs pour le zoom (7 derniers jours réels + prédictions)
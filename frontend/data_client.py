@@ -0,0 +1,281 @@
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+import pandas as pd
+import pyarrow as pa
+import requests
+from requests.adapters import HTTPAdapter
+
+# Format le plus rapide à décoder (Arrow IPC), JSON en repli si l'API ne le propose pas
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+ACCEPT = f"{ARROW_MEDIA_TYPE}, application/json;q=0.5"
+
+# Historique utile au graphique détaillé : 7 jours affichés + une marge
+DETAIL_HISTORY_DAYS = 8
+
+# Fenêtre du snapshot carte côté API (J-21 -> J+2) : les lignes plus anciennes sortent sans suppression explicite
+MAP_WINDOW_DAYS = 21
+MAP_KEY = ["counter_id", "date"]
+
+
+def decode_frame(response) -> pd.DataFrame:
+    if response.headers.get("content-type", "").startswith(ARROW_MEDIA_TYPE):
+        # Types conservés (dates comprises) : pas de re-parsing côté client
+        return pa.ipc.open_stream(response.content).read_pandas()
+    return pd.DataFrame(response.json())
+
+
+def prepare_map(df: pd.DataFrame) -> pd.DataFrame:
+    """Lignes du snapshot carte indexées par (counter_id, date), avec la journée et l'heure précalculées."""
+    if df.empty:
+        # Snapshot vidé : frame vide, mais indexé comme les autres (les deltas suivants s'y appliquent)
+        df = pd.DataFrame({"counter_id": pd.Series(dtype=object), "date": pd.Series(dtype="datetime64[ns]")})
+    df = df.copy()
+    df['date'] = pd.to_datetime(df['date'])
+    df['day'] = df['date'].dt.date
+    df['hour'] = df['date'].dt.hour
+    return df.set_index(MAP_KEY)
+
+
+def apply_map_delta(frame: pd.DataFrame, delta: dict) -> pd.DataFrame:
+    """Fusionne un delta de /map-data?since=... : suppressions, puis lignes nouvelles ou modifiées."""
+    if delta["reset"] or frame is None:
+        return prepare_map(pd.DataFrame(delta["rows"]))
+    if delta["deleted"]:
+        deleted = pd.DataFrame(delta["deleted"])
+        deleted['date'] = pd.to_datetime(deleted['date'])
+        frame = frame.drop(index=pd.MultiIndex.from_frame(deleted[MAP_KEY]), errors="ignore")
+    if delta["rows"]:
+        # Seules les lignes reçues sont converties (dates, journée, heure)
+        rows = prepare_map(pd.DataFrame(delta["rows"]))
+        frame = pd.concat([frame.drop(index=rows.index, errors="ignore"), rows])
+    cutoff = pd.Timestamp(date.today() - timedelta(days=MAP_WINDOW_DAYS))
+    return frame[frame.index.get_level_values("date") >= cutoff]
+
+
+class DataClient:
+    """
+    Accès à l'API pour le tableau de bord, partagé par toutes les sessions Streamlit :
+    - une Session HTTP (connexions keep-alive réutilisées) et des GET conditionnels (ETag)
+    - le détail d'un compteur (historique + prédiction) est chargé en parallèle, puis gardé
+      tant que la version des données de l'API (/version) ne change pas : revenir sur un compteur
+      ne coûte aucune requête
+    - les compteurs les plus consultés sont préchargés en tâche de fond
+    - le snapshot carte est chargé une fois puis tenu à jour par deltas (/map-data?since=révision) ;
+      le résumé d'une journée est calculé localement : changer de date ne coûte aucune requête
+    """
+
+    def __init__(self, base_url: str, max_counters: int = 64, version_ttl: float = 60,
+                 prefetch_count: int = 5, timeout: float = 30, map_sync_interval: float = 300):
+        self.base_url = base_url
+        self.max_counters = max_counters
+        self.version_ttl = version_ttl
+        self.prefetch_count = prefetch_count
+        self.timeout = timeout
+        self.map_sync_interval = map_sync_interval
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="velomag-client")
+
+        self._etags = {}                # url -> (ETag, données décodées)
+        self._details = OrderedDict()   # counter_id -> (version, df_hist, df_pred), LRU
+        self._pending = {}              # counter_id -> préchargement en cours (Future)
+        self._views = Counter()
+        self._version = (None, float("-inf"))
+        self._lock = threading.Lock()
+        self._map = (None, None, float("-inf"))  # (lignes indexées, révision, dernière synchro)
+        self._map_lock = threading.Lock()       # une seule synchro à la fois, les autres sessions attendent
+
+    # --- GET conditionnels ---
+    def get(self, path: str, decode, accept: str = "application/json"):
+        """
+        GET conditionnel : l'API répond 304 (sans corps) si les données n'ont pas changé.
+        Un 304 sans réponse en cache (réponse d'un intermédiaire) est redemandé en entier.
+        """
+        url = f"{self.base_url}{path}"
+        headers = {"Accept": accept, "Accept-Encoding": "gzip"}
+        with self._lock:
+            cached = self._etags.get(url)
+        if cached: headers["If-None-Match"] = cached[0]
+
+        response = self.session.get(url, headers=headers, timeout=self.timeout)
+        if response.status_code == 304:
+            if cached:
+                return cached[1]
+            headers.pop("If-None-Match", None)
+            headers["Cache-Control"] = "no-cache"
+            response = self.session.get(url, headers=headers, timeout=self.timeout)
+        response.raise_for_status()
+
+        data = decode(response)
+        if response.headers.get("ETag"):
+            with self._lock:
+                self._etags[url] = (response.headers["ETag"], data)
+        return data
+
+    def get_frame(self, path: str) -> pd.DataFrame:
+        """GET conditionnel en Arrow (JSON en repli), décodé en DataFrame."""
+        return self.get(path, decode_frame, ACCEPT)
+
+    def data_version(self):
+        """Version des données de l'API, relue au plus toutes les `version_ttl` secondes (None si inconnue)."""
+        version, checked_at = self._version
+        if time.monotonic() - checked_at > self.version_ttl:
+            try:
+                version = self.session.get(f"{self.base_url}/version", timeout=5).json()["version"]
+            except Exception:
+                version = None
+            self._version = (version, time.monotonic())
+        return version
+
+    # --- Détail d'un compteur ---
+    def _load_detail(self, counter_id: str, parallel: bool = True):
+        paths = (f"/history/{counter_id}?days={DETAIL_HISTORY_DAYS}", f"/prediction/{counter_id}")
+        if parallel:
+            # Les deux appels partent ensemble : la latence est celle du plus lent
+            futures = [self.executor.submit(self.get_frame, path) for path in paths]
+            frames = [future.result() for future in futures]
+        else:
+            frames = [self.get_frame(path) for path in paths]
+        for df in frames:
+            if not df.empty: df['datetime'] = pd.to_datetime(df['datetime'])
+        return frames[0], frames[1]
+
+    def _store(self, counter_id: str, version, df_hist: pd.DataFrame, df_pred: pd.DataFrame):
+        if version is None:
+            return
+        with self._lock:
+            self._details[counter_id] = (version, df_hist, df_pred)
+            self._details.move_to_end(counter_id)
+            while len(self._details) > self.max_counters:
+                self._details.popitem(last=False)
+
+    def _cached_detail(self, counter_id: str, version):
+        with self._lock:
+            entry = self._details.get(counter_id)
+            if entry is None or version is None or entry[0] != version:
+                return None
+            self._details.move_to_end(counter_id)
+            return entry[1], entry[2]
+
+    def detail(self, counter_id: str):
+        """Historique récent et prédictions d'un compteur (DataFrames vides si l'API ne répond pas)."""
+        with self._lock:
+            self._views[counter_id] += 1
+            pending = self._pending.get(counter_id)
+        if pending is not None:
+            pending.result()  # déjà en cours de préchargement : on l'attend plutôt que de refaire l'appel
+
+        version = self.data_version()
+        cached = self._cached_detail(counter_id, version)
+        if cached is not None:
+            return cached
+
+        try:
+            df_hist, df_pred = self._load_detail(counter_id)
+        except Exception:
+            # Erreur passagère : rien n'est gardé, le prochain affichage réessaiera
+            return pd.DataFrame(), pd.DataFrame()
+        self._store(counter_id, version, df_hist, df_pred)
+        return df_hist, df_pred
+
+    # --- Préchargement ---
+    def prefetch(self, counter_ids: list):
+        """Précharge en tâche de fond les compteurs les plus consultés (à défaut, les premiers de la liste)."""
+        version = self.data_version()
+        if version is None:
+            return
+        available = set(counter_ids)
+        with self._lock:
+            ranked = [c for c, _ in self._views.most_common() if c in available]
+            ranked += [c for c in counter_ids if c not in self._views]
+            targets = [
+                c for c in ranked[:self.prefetch_count]
+                if c not in self._pending and (c not in self._details or self._details[c][0] != version)
+            ]
+            for counter_id in targets:
+                self._pending[counter_id] = self.executor.submit(self._prefetch_one, counter_id, version)
+
+    def _prefetch_one(self, counter_id: str, version):
+        try:
+            # Séquentiel : ce worker ne doit pas attendre d'autres tâches du même pool
+            df_hist, df_pred = self._load_detail(counter_id, parallel=False)
+            self._store(counter_id, version, df_hist, df_pred)
+        except Exception as e:
+            print(f" ⚠ Préchargement {counter_id} : {e}")
+        finally:
+            with self._lock:
+                self._pending.pop(counter_id, None)
+
+    # --- Snapshot carte (synchro incrémentale) ---
+    def _load_map(self):
+        """Chargement complet du snapshot (Arrow), avec la révision à partir de laquelle synchroniser."""
+        response = self.session.get(
+            f"{self.base_url}/map-data", headers={"Accept": ACCEPT, "Accept-Encoding": "gzip"}, timeout=self.timeout
+        )
+        response.raise_for_status()
+        revision = response.headers.get("X-Map-Revision")
+        df = decode_frame(response)
+        return (prepare_map(df) if not df.empty else None), (int(revision) if revision else None)
+
+    def map_data(self) -> pd.DataFrame:
+        """
+        Lignes du snapshot carte (index counter_id, date), synchronisées au plus toutes les
+        `map_sync_interval` secondes : seules les lignes modifiées depuis la dernière révision transitent.
+        """
+        with self._map_lock:
+            frame, revision, synced_at = self._map
+            if frame is not None and time.monotonic() - synced_at < self.map_sync_interval:
+                return frame
+            try:
+                if frame is None or revision is None:
+                    frame, revision = self._load_map()
+                else:
+                    response = self.session.get(
+                        f"{self.base_url}/map-data", params={"since": revision},
+                        headers={"Accept-Encoding": "gzip"}, timeout=self.timeout,
+                    )
+                    response.raise_for_status()
+                    delta = response.json()
+                    if delta["revision"] is None:
+                        frame, revision = self._load_map()
+                    else:
+                        frame, revision = apply_map_delta(frame, delta), delta["revision"]
+            except Exception as e:
+                # On garde les lignes déjà connues, la synchro sera retentée à l'échéance suivante
+                print(f" ⚠ Synchro carte : {e}")
+            self._map = (frame, revision, time.monotonic())
+            return frame if frame is not None else pd.DataFrame()
+
+    def map_summary(self, day: date = None):
+        """
+        Résumé d'une journée, même forme que /map-summary, calculé sur le snapshot local
+        (None si aucune donnée) : totaux par compteur localisé, profil horaire, dates disponibles.
+        """
+        frame = self.map_data()
+        if frame.empty:
+            return None
+        dates = sorted(frame['day'].unique())
+        selected = day or (date.today() if date.today() in dates else dates[-1])
+
+        rows = frame[(frame['day'] == selected) & frame['lat'].notna() & frame['lon'].notna()]
+        counters = (
+            rows.groupby(level="counter_id")
+            .agg(total=('predicted_intensity', 'sum'), lat=('lat', 'max'), lon=('lon', 'max'))
+            .reset_index()
+        )
+        hourly = rows.groupby('hour')['predicted_intensity'].sum().reindex(range(24), fill_value=0.0)
+        return {
+            "date": selected.isoformat(),
+            "dates": [d.isoformat() for d in dates],
+            "counters": counters.to_dict(orient="records"),
+            "hourly": [{"hour": h, "total": float(total)} for h, total in hourly.items()],
+            "total": float(counters['total'].sum()),
+            "temperature_2m": float(rows['temperature_2m'].mean()) if not rows.empty else 15.0,
+        }
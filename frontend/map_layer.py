@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+
+# Centre et zoom de la carte (Montpellier)
+MAP_CENTER = (43.6107, 3.8767)
+MAP_ZOOM = 13
+
+# Seuils de trafic journalier : < 500 vert, < 1500 orange, sinon rouge
+COLOR_THRESHOLDS = [500, 1500]
+COLOR_RGBA = np.array([[0, 128, 0, 180], [255, 165, 0, 180], [255, 0, 0, 180]])
+
+
+def marker_style(df_agg: pd.DataFrame) -> pd.DataFrame:
+    """
+    Style des marqueurs calculé d'un bloc (sans boucle par compteur) à partir des totaux du jour :
+    volume, niveau de couleur (0 vert, 1 orange, 2 rouge), rayon en pixels et libellé de l'infobulle.
+    """
+    df = df_agg.copy()
+    volume = df['total'].fillna(0).to_numpy().astype(int)
+    df['volume'] = volume
+    df['level'] = np.searchsorted(COLOR_THRESHOLDS, volume, side="right")
+    df['radius'] = 5 + volume / 500
+    df['label'] = df['counter_id'].astype(str) + ": " + df['volume'].astype(str) + " vélos"
+    return df
+
+
+def deck_layer(df_agg: pd.DataFrame):
+    """Tous les compteurs dans une seule couche ScatterplotLayer (deck.gl, rendu WebGL)."""
+    import pydeck as pdk
+
+    df = marker_style(df_agg)
+    rgba = COLOR_RGBA[df['level'].to_numpy()]
+    df['color'] = rgba.tolist()
+    return pdk.Layer(
+        "ScatterplotLayer",
+        data=df[['counter_id', 'lat', 'lon', 'volume', 'radius', 'color', 'label']],
+        id="counters",
+        get_position=["lon", "lat"],
+        get_fill_color="color",
+        get_radius="radius",
+        radius_units="pixels",
+        pickable=True,
+    )
+
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Le tableau de bord est lancé depuis frontend/ (imports `from data_client import ...`)
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
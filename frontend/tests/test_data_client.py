@@ -0,0 +1,56 @@
+import pandas as pd
+
+from data_client import DataClient
+
+
+class FakeResponse:
+    def __init__(self, status_code: int, body=None, etag: str = None):
+        self.status_code = status_code
+        self.body = body
+        self.headers = {"ETag": etag} if etag else {}
+
+    def json(self):
+        return self.body
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"HTTP {self.status_code}")
+
+
+class FakeSession:
+    """Rejoue les réponses prévues et garde les en-têtes envoyés."""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.sent = []
+
+    def get(self, url, headers=None, timeout=None, params=None):
+        self.sent.append(dict(headers or {}))
+        return self.responses.pop(0)
+
+
+def make_client(*responses) -> DataClient:
+    client = DataClient("http://api")
+    client.session = FakeSession(*responses)
+    return client
+
+
+def decode(response):
+    return pd.DataFrame(response.json())
+
+
+def test_get_reuses_cached_body_on_304():
+    client = make_client(FakeResponse(200, [{"a": 1}], etag='"v1"'), FakeResponse(304))
+    first = client.get("/counters", decode)
+    again = client.get("/counters", decode)
+    assert again is first
+    assert client.session.sent[1]["If-None-Match"] == '"v1"'
+
+
+def test_get_refetches_on_304_without_cached_body():
+    client = make_client(FakeResponse(304), FakeResponse(200, [{"a": 1}], etag='"v1"'))
+    df = client.get("/counters", decode)
+    assert df.to_dict(orient="records") == [{"a": 1}]
+    retry = client.session.sent[1]
+    assert "If-None-Match" not in retry
+    assert retry["Cache-Control"] == "no-cache"
@@ -0,0 +1,55 @@
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+
+from data_client import MAP_WINDOW_DAYS, apply_map_delta, prepare_map
+
+TODAY = datetime.combine(date.today(), datetime.min.time())
+
+
+def row(counter_id: str, hours: int, value: float) -> dict:
+    return {
+        "counter_id": counter_id, "date": (TODAY + timedelta(hours=hours)).isoformat(),
+        "predicted_intensity": value, "lat": 43.6, "lon": 3.9, "temperature_2m": 15.0,
+    }
+
+
+def delta(rows=(), deleted=(), reset=False, revision=2) -> dict:
+    return {"revision": revision, "reset": reset, "rows": list(rows), "deleted": list(deleted)}
+
+
+def values(frame: pd.DataFrame) -> dict:
+    return {(c, d.hour): v for (c, d), v in frame["predicted_intensity"].items()}
+
+
+def test_delta_deletes_then_upserts_rows():
+    frame = prepare_map(pd.DataFrame([row("c1", 0, 1.0), row("c1", 1, 2.0), row("c2", 0, 3.0)]))
+    removed = {"counter_id": "c2", "date": TODAY.isoformat()}
+    merged = apply_map_delta(frame, delta(rows=[row("c1", 1, 20.0), row("c1", 2, 4.0)], deleted=[removed]))
+    assert values(merged) == {("c1", 0): 1.0, ("c1", 1): 20.0, ("c1", 2): 4.0}
+    assert merged.loc[("c1", TODAY + timedelta(hours=2)), "hour"] == 2
+
+
+def test_reset_replaces_frame():
+    frame = prepare_map(pd.DataFrame([row("c1", 0, 1.0)]))
+    merged = apply_map_delta(frame, delta(rows=[row("c2", 0, 5.0)], reset=True))
+    assert values(merged) == {("c2", 0): 5.0}
+
+
+def test_rows_leaving_the_window_are_dropped():
+    old = -24 * (MAP_WINDOW_DAYS + 1)
+    frame = prepare_map(pd.DataFrame([row("c1", old, 1.0), row("c1", 0, 2.0)]))
+    merged = apply_map_delta(frame, delta())
+    assert len(merged) == 1
+    assert values(merged) == {("c1", 0): 2.0}
+
+
+def test_reset_to_empty_snapshot_then_delta():
+    frame = prepare_map(pd.DataFrame([row("c1", 0, 1.0)]))
+    empty = apply_map_delta(frame, delta(reset=True))
+    assert empty.empty
+    assert list(empty.index.names) == ["counter_id", "date"]
+    assert apply_map_delta(None, delta(reset=True)).empty
+
+    merged = apply_map_delta(empty, delta(rows=[row("c2", 1, 5.0)], deleted=[{"counter_id": "c1", "date": TODAY.isoformat()}]))
+    assert values(merged) == {("c2", 1): 5.0}